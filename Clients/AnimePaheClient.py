@@ -2,6 +2,7 @@ __author__ = 'Prudhvi PLN'
 
 import json
 import re
+from functools import lru_cache
 from urllib.parse import quote_plus
 
 # modules to bypass DDoS protection
@@ -10,6 +11,24 @@ from selenium.webdriver.common.by import By
 from time import sleep
 
 from Clients.BaseClient import BaseClient
+from Utils.commons import ordered_map
+
+
+# episodes of the anime (by session id) fetched in this process: (total episodes, episodes)
+_episodes_cache = {}
+
+# regexes to unpack the packed (p.a.c.k.e.r) javascript of kwik & extract the m3u8 link
+_PACKED_ARGS_REGEX = re.compile(r"\}\('(.*)'\)*,*(\d+)*,*(\d+)*,*'((?:[^'\\]|\\.)*)'\.split\('\|'\)*,*(\d+)*,*(\{\})")
+_PACKED_WORD_REGEX = re.compile(r'\b(\w+)\b')
+_M3U8_LINK_REGEX = re.compile('http.*.m3u8')
+
+
+@lru_cache(maxsize=None)
+def _to_base(c, a):
+    # base-N encoding of the word index, used as the placeholder of the word in packed javascript
+    prefix = '' if c < a else _to_base(c // a, a)
+    c = c % a
+    return prefix + (chr(c + 29) if c > 35 else '0123456789abcdefghijklmnopqrstuvwxyz'[c])
 
 
 class AnimePaheClient(BaseClient):
@@ -26,7 +45,8 @@ class AnimePaheClient(BaseClient):
         self.anime_id = ''      # anime id. required to create referer link
         self.selector_strategy = config.get('alternate_resolution_selector', 'lowest')
         self.hls_size_accuracy = config.get('hls_size_accuracy', 0)
-        super().__init__(config['request_timeout'], session)
+        self.max_parallel_requests = config.get('max_parallel_requests', 8)
+        super().__init__(config['request_timeout'], session, config.get('response_cache'))
         self.logger.debug(f'AnimePahe client initialized with {config = }')
 
     # step-1.1.1
@@ -180,26 +200,21 @@ class AnimePaheClient(BaseClient):
         parse m3u8 link using javascript's packed function implementation
         '''
         self.logger.debug('Extracting packed args from javascript code')
-        x = r"\}\('(.*)'\)*,*(\d+)*,*(\d+)*,*'((?:[^'\\]|\\.)*)'\.split\('\|'\)*,*(\d+)*,*(\{\})"
         try:
-            p, a, c, k, e, d = re.findall(x, text)[0]
+            p, a, c, k, e, d = _PACKED_ARGS_REGEX.findall(text)[0]
             p, a, c, k, e, d = p, int(a), int(c), k.split('|'), int(e), {}
         except Exception as e:
             raise Exception('m3u8 link extraction failed. Unable to extract packed args')
 
-        def e(c):
-            x = '' if c < a else e(int(c/a))
-            c = c % a
-            return x + (chr(c + 29) if c > 35 else '0123456789abcdefghijklmnopqrstuvwxyz'[c])
-
         self.logger.debug('Unpacking extracted packed args')
-        for i in range(c): d[e(i)] = k[i] or e(i)
-        parsed_js_code = re.sub(r'\b(\w+)\b', lambda e: d.get(e.group(0)) or e.group(0), p)
+        for i in range(c): d[_to_base(i, a)] = k[i] or _to_base(i, a)
+        parsed_js_code = _PACKED_WORD_REGEX.sub(lambda e: d.get(e.group(0)) or e.group(0), p)
 
         self.logger.debug('Extracting m3u8 link from unpacked javascript code')
-        parsed_link = self._regex_extract('http.*.m3u8', parsed_js_code, 0)
+        parsed_link = _M3U8_LINK_REGEX.search(parsed_js_code)
         if not parsed_link:
             raise Exception('m3u8 link extraction failed. link not found')
+        parsed_link = parsed_link.group(0)
 
         return parsed_link
 
@@ -244,14 +259,23 @@ class AnimePaheClient(BaseClient):
 
         last_page = int(raw_data['last_page'])
         self.logger.debug(f'{last_page = }')
+        # reuse the episodes fetched earlier (in this process), if no episodes are added since then
+        cached_total, cached_episodes = _episodes_cache.get(session, (None, None))
+        if cached_episodes is not None and cached_total == raw_data.get('total'):
+            self.logger.debug(f'Reusing {len(cached_episodes)} cached episodes of {session = }')
+            return list(cached_episodes)
+
         # add first page's episodes
         episodes_data = raw_data['data']
 
-        # if last page is not 1, get episodes from all pages
+        # if last page is not 1, get episodes from all pages in parallel. Pages are merged in order
         if last_page > 1:
-            for pgno in range(2, last_page+1):
-                self.logger.debug(f'Found more than 1 pages. Fetching episodes from page-{pgno}')
-                episodes_data.extend(self._send_request(f'{list_episodes_url}&page={pgno}', cookies=self.cookies, return_type='json').get('data', []))
+            self.logger.debug(f'Found more than 1 pages. Fetching episodes from pages 2-{last_page}')
+            get_page = lambda pgno: self._send_request(f'{list_episodes_url}&page={pgno}', cookies=self.cookies, return_type='json').get('data', [])
+            for _, page_data in ordered_map(get_page, range(2, last_page+1), self.max_parallel_requests, 'udb-pages-'):
+                episodes_data.extend(page_data)
+
+        _episodes_cache[session] = (raw_data.get('total'), list(episodes_data))
 
         return episodes_data
 
@@ -273,27 +297,28 @@ class AnimePaheClient(BaseClient):
         '''
         download_links = {}
         ep_start, ep_end, specific_eps = ep_ranges['start'], ep_ranges['end'], ep_ranges.get('specific_no', [])
+        selected_episodes = [ episode for episode in episodes if (float(episode.get('episode')) >= ep_start and float(episode.get('episode')) <= ep_end)
+                              or (float(episode.get('episode')) in specific_eps) ]
 
-        for episode in episodes:
-            # self.logger.debug(f'Current {episode = }')
-
-            if (float(episode.get('episode')) >= ep_start and float(episode.get('episode')) <= ep_end) or (float(episode.get('episode')) in specific_eps):
-                self.logger.debug(f'Processing {episode = }')
-                episode_link = self.episode_url.format(anime_id=self.anime_id, episode_id=episode.get('session'))
+        def get_links(episode):
+            self.logger.debug(f'Processing {episode = }')
+            episode_link = self.episode_url.format(anime_id=self.anime_id, episode_id=episode.get('session'))
+            self.logger.debug(f'Fetching kwik link for {episode_link = }')
+            return episode_link, self._get_kwik_links_v2(episode_link)
 
-                self.logger.debug(f'Fetching kwik link for {episode_link = }')
-                links = self._get_kwik_links_v2(episode_link)
-                self.logger.debug(f'Extracted & filtered (no eng dub & prefer AV1) kwik links: {links = }')
+        # episode pages are fetched in parallel (re-using the cookies), and the links are shown in episode order
+        for episode, (episode_link, links) in ordered_map(get_links, selected_episodes, self.max_parallel_requests, 'udb-links-'):
+            self.logger.debug(f'Extracted & filtered (no eng dub & prefer AV1) kwik links: {links = }')
 
-                # skip if no links found
-                if links is None:
-                    continue
+            # skip if no links found
+            if links is None:
+                continue
 
-                # add episode uid & link to udb dict
-                self._update_udb_dict(episode.get('episode'), {'episodeId': episode.get('session'), 'episodeLink': episode_link})
+            # add episode uid & link to udb dict
+            self._update_udb_dict(episode.get('episode'), {'episodeId': episode.get('session'), 'episodeLink': episode_link})
 
-                download_links[episode.get('episode')] = links
-                self._show_episode_links(episode.get('episode'), links)
+            download_links[episode.get('episode')] = links
+            self._show_episode_links(episode.get('episode'), links)
 
         return download_links
 
@@ -312,10 +337,11 @@ class AnimePaheClient(BaseClient):
         '''
         return dict containing m3u8 links based on resolution
         '''
-        _get_ep_name = lambda resltn: f"{episode_prefix}{' ' if episode_prefix.lower().endswith('movie') and len(target_links.items()) <= 1 else f' {ep} '}- {resltn}P.mp4"
+        _get_ep_name = lambda ep, resltn: f"{episode_prefix}{' ' if episode_prefix.lower().endswith('movie') and len(target_links.items()) <= 1 else f' {ep} '}- {resltn}P.mp4"
 
-        for ep, link in target_links.items():
-            error = None
+        def get_m3u8_link(target_link):
+            ep, link = target_link
+            error, ep_link = None, None
             self.logger.debug(f'Episode: {ep}, Link: {link}')
             info = f'Episode: {self._safe_type_cast(ep)} |'
 
@@ -333,7 +359,7 @@ class AnimePaheClient(BaseClient):
             else:
                 info = f'{info} {selected_resolution}P |'
                 try:
-                    ep_name = _get_ep_name(selected_resolution)
+                    ep_name = _get_ep_name(ep, selected_resolution)
                     ep_name = self._windows_safe_string(ep_name)
                     kwik_link = res_dict['kwik']
 
@@ -346,17 +372,28 @@ class AnimePaheClient(BaseClient):
 
                     # add m3u8 & kwik links against episode. set type of download link as hls
                     self._update_udb_dict(ep, {'episodeName': ep_name, 'refererLink': kwik_link, 'downloadLink': ep_link, 'downloadType': 'hls'})
-                    self.logger.debug(f'{info} Link found [{ep_link}]')
-                    self._colprint('results', f'{info} Link found [{ep_link}]')
+                    # size shown by the site. ex: "SubsPlease · 1080p (151MB)"
+                    filesize = re.search(r'\(([\d.]+)\s*([MG])B\)', str(res_dict.get('filesize', '')))
+                    if filesize:
+                        self._update_udb_dict(ep, {'filesize_mb': round(float(filesize.group(1)) * (1024 if filesize.group(2) == 'G' else 1))})
 
                 except Exception as e:
                     error = f'Failed to fetch link with error [{e}]'
 
             if error:
-                # add error message and log it
-                ep_name = _get_ep_name(resolution)
+                # add error message
+                ep_name = _get_ep_name(ep, resolution)
                 self._update_udb_dict(ep, {'episodeName': ep_name, 'error': error})
+
+            return info, error, ep_link
+
+        # kwik pages are fetched & unpacked in parallel, and the links are shown in episode order
+        for _, (info, error, ep_link) in ordered_map(get_m3u8_link, list(target_links.items()), self.max_parallel_requests, 'udb-m3u8-'):
+            if error:
                 self.logger.error(f'{info} {error}')
+            else:
+                self.logger.debug(f'{info} Link found [{ep_link}]')
+                self._colprint('results', f'{info} Link found [{ep_link}]')
 
         final_dict = { k:v for k,v in self._get_udb_dict().items() }
 
@@ -2,11 +2,13 @@ __author__ = 'Prudhvi PLN'
 
 import json
 import logging
+import random
 import re
 import requests
 import os
 from bs4 import BeautifulSoup as BS
 from copy import deepcopy
+from threading import Lock
 from urllib.parse import parse_qs, urlparse
 
 # modules for encryption
@@ -16,21 +18,37 @@ from Cryptodome.Cipher import AES
 # modules to bypass DDoS protection & Complex Javascript execution
 import undetected_chromedriver as uc
 
-from Utils.commons import colprint, exec_os_cmd, pretty_time, retry, threaded, ExitException
+from Utils.commons import colprint, exec_os_cmd, ordered_map, pretty_time, retry, ExitException
+from Utils.M3U8Parser import parse_m3u8
+from Utils.MP4Probe import probe_init_section, probe_mp4
+from Utils.ResponseCache import CacheMissError, get_response_cache
+
+# metadata of the video links: {(link, link type): (duration, size, resolution)}
+_video_metadata = {}
 
 
 class BaseClient():
     '''
     Base Client Implementation for Site-specific clients
     '''
-    def __init__(self, request_timeout=30, session=None):
+    def __init__(self, request_timeout=30, session=None, response_cache_config=None):
         # create a requests session and use across to re-use cookies
         self.req_session = session if session else requests.Session()
         self.request_timeout = request_timeout
+        # cache of the metadata responses shared by all clients, if enabled
+        self.response_cache = get_response_cache(response_cache_config)
         try:
             self.hls_size_accuracy
         except AttributeError:
             self.hls_size_accuracy = 0      # set default value if not set
+        try:
+            self.max_parallel_requests
+        except AttributeError:
+            self.max_parallel_requests = 8  # set default value if not set
+        # keep a connection per parallel request, instead of dropping them once the default pool of 10 connections is full
+        adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=max(10, self.max_parallel_requests))
+        self.req_session.mount('https://', adapter)
+        self.req_session.mount('http://', adapter)
 
         self.header = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36",
@@ -38,6 +56,7 @@ class BaseClient():
             "Connection": "keep-alive"
         }
         self.udb_episode_dict = {}   # dict containing all details of epsiodes
+        self.udb_dict_lock = Lock()  # udb dict can be updated from parallel requests
         self.cookies_file = os.path.join(os.path.dirname(__file__), '.udb_client_cookies.json')      # file containing re-usable cookies
         # list of invalid characters not allowed in windows file system
         self.invalid_chars = ['/', '\\', '"', ':', '?', '|', '<', '>', '*']
@@ -48,11 +67,12 @@ class BaseClient():
         self._regex_extract = lambda rgx, txt, grp: re.search(rgx, txt).group(grp) if re.search(rgx, txt) else False
 
     def _update_udb_dict(self, parent_key, child_dict):
-        if parent_key in self.udb_episode_dict:
-            self.udb_episode_dict[parent_key].update(child_dict)
-        else:
-            self.udb_episode_dict[parent_key] = child_dict
-        self.logger.debug(f'Updated udb dict: {self.udb_episode_dict}')
+        with self.udb_dict_lock:
+            if parent_key in self.udb_episode_dict:
+                self.udb_episode_dict[parent_key].update(child_dict)
+            else:
+                self.udb_episode_dict[parent_key] = child_dict
+            self.logger.debug(f'Updated udb dict: {self.udb_episode_dict}')
 
     def _get_udb_dict(self):
         return self.udb_episode_dict
@@ -93,7 +113,18 @@ class BaseClient():
         if return_type.lower() == 'json': header.update({'Accept': 'application/json'})
         if extra_headers: header.update(extra_headers)
         # self.logger.debug(f'Cookies before request: {self.req_session.cookies.get_dict()}')
-        if request_type == 'get':
+        if request_type == 'get' and self.response_cache and return_type.lower() != 'raw':
+            send_request = lambda conditional_headers: self.req_session.get(url, timeout=self.request_timeout, headers={**header, **conditional_headers}, cookies=cookies)
+            try:
+                response = self.response_cache.fetch(url, send_request)
+            except CacheMissError as e:
+                _conditional_logger(silent, str(e))
+                return
+        elif self._is_offline():
+            # only cached GET requests are served in offline mode
+            _conditional_logger(silent, f'Offline mode. Skipped {request_type.upper()} request to {url}')
+            return
+        elif request_type == 'get':
             response = self.req_session.get(url, timeout=self.request_timeout, headers=header, cookies=cookies)
         elif request_type == 'post':
             response = self.req_session.post(url, timeout=self.request_timeout, headers=header, cookies=cookies, data=post_data, files=upload_data)
@@ -134,6 +165,16 @@ class BaseClient():
         if html_content is not None:
             return BS(html_content, 'html.parser')
 
+    def _is_offline(self):
+        return self.response_cache is not None and self.response_cache.offline
+
+    def _check_online(self, target):
+        '''
+        Fail fast for the network requests which can't be served from the response cache, in offline mode
+        '''
+        if self._is_offline():
+            raise CacheMissError(f'Offline mode. Skipped network request to {target}')
+
     def _exec_cmd(self, cmd):
         return exec_os_cmd(cmd)
 
@@ -226,8 +267,13 @@ class BaseClient():
             master_is_child = re.search('#EXT-X-ENDLIST', master_m3u8_data)
             if 'original' in master_m3u8_link or master_is_child:
                 self.logger.debug('master m3u8 link itself is the download link')
-                # treat is as mp4 to fetch metadata using ffprobe
-                duration, size, resolution = self._get_video_metadata(master_m3u8_link, 'mp4', referer)
+                duration, _, resolution = self._get_video_metadata(master_m3u8_link, 'hls', referer)
+                if resolution is None:
+                    # resolution is not known from the playlist (not a fragmented mp4 stream). Fetch it using ffprobe
+                    try:
+                        resolution = self._get_ffprobe_metadata(master_m3u8_link, referer)[2]
+                    except Exception as e:
+                        self.logger.warning(f'Failed to fetch video resolution. Error: {e}')
                 _res_key = resolution.split('x')[-1] if resolution else '1080'
                 m3u8_links[_res_key] = {
                     'resolution_size': resolution,
@@ -236,8 +282,8 @@ class BaseClient():
                     'duration': pretty_time(duration)
                 }
                 # get approx download size and add file size if available
-                file_size = self._get_download_size(master_m3u8_link, referer)
-                if file_size: m3u8_links['1080'].update({'filesize_mb': file_size})
+                file_size, margin = self._get_download_size(master_m3u8_link, referer)
+                if file_size: m3u8_links[_res_key].update({'filesize_mb': file_size, 'filesize_margin_mb': margin})
 
             return m3u8_links
 
@@ -255,91 +301,170 @@ class BaseClient():
                 'duration': duration
             }
             # get approx download size and add file size if available
-            file_size = self._get_download_size(m3u8_link, referer)
-            if file_size: m3u8_links[_res.replace('p','')].update({'filesize_mb': file_size})
+            file_size, margin = self._get_download_size(m3u8_link, referer)
+            if file_size: m3u8_links[_res.replace('p','')].update({'filesize_mb': file_size, 'filesize_margin_mb': margin})
 
         return m3u8_links
 
     # step-4.2.2.2 -- used in GogoAnime, MyAsianTV
     def _get_video_metadata(self, link, link_type='mp4', referer=None):
         '''
-        return duration & size of the video using ffprobe command
+        return duration, size & resolution of the video. Metadata is cached per link
+        - hls: duration from the playlist, and resolution from the init section of fragmented mp4 streams
+        - mp4: from the index (moov box) of the video, fetched using range requests. ffprobe is used only if it fails
         Note: size is available only for mp4 links
         '''
+        if (link, link_type) in _video_metadata:
+            return _video_metadata[(link, link_type)]
+
         duration, size, resolution = 0, None, None
+        header = deepcopy(self.header)
+        if referer: header.update({'referer': referer})
         try:
-            # Note: ffprobe is taking 3-10s, so try to avoid as much as possible
             if link_type == 'hls':
                 self.logger.debug('Fetching video duration by parsing video link')
                 data = self._send_request(link)
-                duration = sum([ float(match.group(1)) for match in re.finditer('#EXTINF:(.*),', data) ])
+                playlist = parse_m3u8(data, link)
+                duration = playlist.duration
+                init_section = next(( segment.map for segment in playlist.segments if segment.map ), None)
+                if init_section:
+                    try:
+                        self._check_online(init_section[0])
+                        metadata = probe_init_section(init_section[0], self.req_session, init_section[1], header, self.request_timeout)
+                        if metadata and metadata['width']: resolution = f"{metadata['width']}x{metadata['height']}"
+                    except Exception as e:
+                        self.logger.debug(f'Failed to fetch resolution from init section. Error: {e}')
             else:
-                # add -show_streams in ffprobe to get more information
-                ffprobe_cmd = f'ffprobe -extension_picky 0 -allowed_extensions ALL -loglevel quiet -print_format json -show_format -select_streams v:0 -show_entries stream=width,height'
-                if referer:
-                    ffprobe_cmd += f' -referer "{referer}"'
-                self.logger.debug(f'Fetching video duration using ffprobe command: {ffprobe_cmd} "{link}"')
-                video_metadata = json.loads(self._exec_cmd(f'{ffprobe_cmd} "{link}"'))
-                duration = float(video_metadata.get('format', {}).get('duration', 0))
-                size = float(video_metadata.get('format', {}).get('size', 0))
-                resolution = f"{video_metadata.get('streams', [{}])[0].get('width')}x{video_metadata.get('streams', [{}])[0].get('height')}"
-                self.logger.debug(f'Size fetched is {size} bytes, Resoltion: {resolution}')
+                self._check_online(link)
+                self.logger.debug(f'Fetching video metadata from the index of {link}')
+                try:
+                    metadata = probe_mp4(link, self.req_session, header, self.request_timeout)
+                except Exception as e:
+                    self.logger.debug(f'Failed to fetch the index of the video. Error: {e}')
+                    metadata = None
+
+                if metadata and metadata['width']:
+                    duration, size, resolution = metadata['duration'], metadata['size'], f"{metadata['width']}x{metadata['height']}"
+                    self.logger.debug(f'Size fetched is {size} bytes, Resoltion: {resolution}')
+                else:
+                    self.logger.debug('Video index is not available. Falling back to ffprobe')
+                    duration, size, resolution = self._get_ffprobe_metadata(link, referer)
 
             self.logger.debug(f'Duration fetched is {duration} seconds')
+            _video_metadata[(link, link_type)] = (round(duration), size, resolution)
 
         except Exception as e:
             self.logger.warning(f'Failed to fetch video duration. Error: {e}')
 
         return round(duration), size, resolution
 
-    @threaded()
-    def _fetch_content_length(self, url):
+    def _get_ffprobe_metadata(self, link, referer=None):
+        '''
+        return duration, size & resolution of the video using ffprobe command
+        '''
+        self._check_online(link)
+        # Note: ffprobe is taking 3-10s, so try to avoid as much as possible
+        # add -show_streams in ffprobe to get more information
+        ffprobe_cmd = f'ffprobe -extension_picky 0 -allowed_extensions ALL -loglevel quiet -print_format json -show_format -select_streams v:0 -show_entries stream=width,height'
+        if referer:
+            ffprobe_cmd += f' -referer "{referer}"'
+        self.logger.debug(f'Fetching video duration using ffprobe command: {ffprobe_cmd} "{link}"')
+        video_metadata = json.loads(self._exec_cmd(f'{ffprobe_cmd} "{link}"'))
+        duration = float(video_metadata.get('format', {}).get('duration', 0))
+        size = float(video_metadata.get('format', {}).get('size', 0))
+        resolution = f"{video_metadata.get('streams', [{}])[0].get('width')}x{video_metadata.get('streams', [{}])[0].get('height')}"
+        self.logger.debug(f'Size fetched is {size} bytes, Resoltion: {resolution}')
+
+        return duration, size, resolution
+
+    def _probe_content_length(self, url, referer=None):
+        '''
+        return the size (in bytes) of the url without downloading it: Content-Length of a HEAD request, else the total size
+        from Content-Range of a single byte range request. Returns None if the size is not known.
+        '''
+        self._check_online(url)
+        header = deepcopy(self.header)
+        if referer: header.update({'referer': referer})
         try:
-            content_len = float(requests.get(url).headers.get('content-length', 0))
+            response = self.req_session.head(url, timeout=self.request_timeout, headers=header, allow_redirects=True)
+            if response.status_code == 200 and int(response.headers.get('content-length') or 0) > 0:
+                return int(response.headers['content-length'])
+
+            # HEAD is not supported (or has no length). Request a single byte and get the size from Content-Range
+            header.update({'Range': 'bytes=0-0'})
+            with self.req_session.get(url, timeout=self.request_timeout, headers=header, stream=True) as response:
+                content_range = re.match(r'bytes\s+\d+-\d+/(\d+)', response.headers.get('content-range') or '')
+                if response.status_code == 206 and content_range:
+                    return int(content_range.group(1))
+                if response.status_code == 200 and int(response.headers.get('content-length') or 0) > 0:
+                    # range is ignored. Size is known from the headers, without reading the data
+                    return int(response.headers['content-length'])
+
         except Exception as e:
-            self.logger.warning(f'Failed to fetch video content length for {url = }. Error: {e}')
-            content_len = 0
+            self.logger.warning(f'Failed to fetch content length for {url = }. Error: {e}')
 
-        return content_len
+        return None
 
     # step-4.2.2.1.1
     def _get_download_size(self, m3u8_link, referer=None):
         '''
-        return the download file size (in MB) of a HLS stream based on estimation quality.
+        return the estimated download size (in MB) of a HLS stream and its margin of error (in MB, at 95% confidence), based on estimation quality.
+        Sizes of a sample of segments (one from every equal part of the playlist) are probed without downloading them, and the size
+        of the stream is estimated from the bytes per second of the sample (ratio estimator).
         '''
         try:
             if self.hls_size_accuracy == 0:     # this parameter should be defined in respective client initialization
-                return None                     # do nothing if disabled
+                return None, None               # do nothing if disabled
             self.logger.debug(f'Calculating download size for {m3u8_link = }')
             m3u8_data = self._send_request(m3u8_link, referer=referer)
-            # extract ts segment urls. same as in HLS downloader
-            base_url = '/'.join(m3u8_link.split('/')[:-1])
-            normalize_url = lambda url, base_url: (url if url.startswith('http') else f'{base_url}/{url}')
-            urls = [ normalize_url(url.group(0), base_url) for url in re.finditer("^(?!#).+$", m3u8_data, re.MULTILINE) ]
-
-            # Logic for 'approx' quality: find content size of a few segments and multiply the average with number of segments
-            tgt_len = len(urls) * self.hls_size_accuracy // 100
-            url_set = urls[:tgt_len]
-            # define correction factor to adjust the estimated size
+            # unique segments. same as in HLS downloader
+            segments = list({ (segment.uri, segment.byterange): segment for segment in parse_m3u8(m3u8_data, m3u8_link).segments }.values())
+            # define correction factor to adjust the estimated size, as video compresses after converting to mp4
             cf = 0.85 if self.hls_size_accuracy < 95 else 0.9
-            self.logger.debug(f'Segments considered based on accuracy of {self.hls_size_accuracy}% is {tgt_len}/{len(urls)}. Correction factor: {cf}')
-            content_lens = self._fetch_content_length(url_set)
 
-            # calculate total file size in bytes
-            if self.hls_size_accuracy == 100:
-                dl_size = sum(content_lens) * cf   # cf is required as video compresses after converting to mp4
+            if segments and all( segment.byterange for segment in segments ):
+                # size of byte-range segments is known from the playlist itself
+                dl_size, margin = sum( segment.byterange[1] for segment in segments ) * cf, 0
+
             else:
-                avg_content_len = sum(content_lens) / len(content_lens)
-                dl_size = avg_content_len * len(urls) * cf
+                # stratified sample: a random segment from every stratum, so that the whole playlist is covered
+                sample_size = max(1, -(-len(segments) * self.hls_size_accuracy // 100))
+                strata = [ segments[len(segments) * i // sample_size:len(segments) * (i + 1) // sample_size] for i in range(sample_size) ]
+                sample = [ random.choice(stratum) for stratum in strata ]
+                self.logger.debug(f'Segments considered based on accuracy of {self.hls_size_accuracy}% is {sample_size}/{len(segments)}. Correction factor: {cf}')
+
+                get_size = lambda segment: segment.byterange[1] if segment.byterange else self._probe_content_length(segment.uri, referer)
+                sizes = [ (segment, size) for segment, size in ordered_map(get_size, sample, self.max_parallel_requests, 'udb-size-') if size ]
+                if not sizes:
+                    raise Exception('Failed to fetch the size of the segments')
+
+                # size is proportional to the duration of the segment. Count the segments instead, if the durations are not known
+                use_duration = all( segment.duration > 0 for segment in segments )
+                weight = lambda segment: segment.duration if use_duration else 1
+                total_weight = sum( weight(segment) for segment in segments )
+                ratio = sum( size for _, size in sizes ) / sum( weight(segment) for segment, _ in sizes )
+                dl_size = ratio * total_weight * cf
+
+                # standard error of the ratio estimator with finite population correction (conservative for a stratified sample).
+                # Margin is zero if all the segments are sampled, and unknown for a single segment
+                n = len(sizes)
+                if n > 1 or n == len(segments):
+                    variance = sum( (size - ratio * weight(segment))**2 for segment, size in sizes ) / max(1, n - 1)
+                    mean_weight = sum( weight(segment) for segment, _ in sizes ) / n
+                    std_error = total_weight / mean_weight * ((1 - n / len(segments)) * variance / n) ** 0.5
+                    margin = 1.96 * std_error * cf
+                else:
+                    margin = None
 
             dl_size = round(dl_size / (1024**2))         # bytes to MB
-            self.logger.debug(f'Download size is {dl_size} MB')
+            margin = round(margin / (1024**2)) if margin is not None else None
+            self.logger.debug(f'Download size is {dl_size} MB (margin: {margin} MB)')
 
         except Exception as e:
             self.logger.warning(f'Failed to fetch download size for {m3u8_link = }. Error: {e}')
-            dl_size = None
+            dl_size, margin = None, None
 
-        return dl_size
+        return dl_size, margin
 
     # step-4.2.1 -- used in GogoAnime, MyAsianTV
     def _get_download_sources(self, **gdl_config):
@@ -489,6 +614,13 @@ class BaseClient():
                 duration, file_size, resolution = self._get_video_metadata(dlink, link_type='mp4', referer=link)
                 duration = pretty_time(duration)
                 resltn = resolution.split('x')[-1]
+                existing_link = resolution_links.get(resltn, {})
+                if file_size and existing_link.get('downloadType') == 'mp4' and existing_link.get('filesize_bytes') == int(file_size):
+                    # same resolution & exact size as a preferred link. Use it as a mirror to download from multiple sources.
+                    # Links of unknown size are never mirrors, as they can be different videos
+                    self.logger.debug(f'Adding [{dlink}] as a mirror of [{existing_link["downloadLink"]}]')
+                    existing_link.setdefault('mirrorLinks', []).append(dlink)
+                    continue
                 resolution_links[resltn] = {
                     'resolution_size': resolution,
                     'downloadLink': dlink,
@@ -497,8 +629,7 @@ class BaseClient():
                 }
                 # get actual download size and add file size if available
                 if file_size:
-                    file_size = round(file_size / (1024**2))    # Bytes to MB
-                    resolution_links[resltn].update({'filesize_mb': file_size})
+                    resolution_links[resltn].update({'filesize_mb': round(file_size / (1024**2)), 'filesize_bytes': int(file_size)})    # Bytes to MB
 
             else:
                 # unknown download type
@@ -530,7 +661,7 @@ class BaseClient():
 
         for _res, _vals in details.items():
             info += f' | {_res}P ({_vals["resolution_size"]})' #| URL: {_vals["downloadLink"]}
-            if 'filesize_mb' in _vals: info += f' [~{_vals["filesize_mb"]} MB]'
+            if 'filesize_mb' in _vals: info += f' [~{_vals["filesize_mb"]}{" ±" + str(_vals["filesize_margin_mb"]) if _vals.get("filesize_margin_mb") else ""} MB]'
 
         self._colprint('results', info)
 
@@ -586,6 +717,9 @@ class BaseClient():
 
                     # add download link and it's type against episode
                     self._update_udb_dict(ep, {'episodeName': ep_name, 'downloadLink': ep_link, 'downloadType': link_type})
+                    # estimated size is used to show the total download size of the batch
+                    if res_dict.get('filesize_mb'): self._update_udb_dict(ep, {'filesize_mb': res_dict['filesize_mb']})
+                    if res_dict.get('mirrorLinks'): self._update_udb_dict(ep, {'mirrorLinks': res_dict['mirrorLinks']})
                     self.logger.debug(f'{info} Link found [{ep_link}]')
                     self._colprint('results', f'{info} Link found [{ep_link}]')
 
@@ -709,6 +843,7 @@ class BaseClient():
         Get the undetected chrome driver based on installed Chrome broswer available.
         Args: client - name of the client (used for logging only)
         '''
+        self._check_online(f'{client} using browser')
         def __suppress_exception_in_del(uc):
             '''
             Suppress the exception saying "OSError: [WinError 6] The handle is invalid"
@@ -1,6 +1,7 @@
 __author__ = 'Prudhvi PLN'
 
 import re
+from concurrent.futures import ThreadPoolExecutor
 from quickjs import Context as quickjsContext
 from urllib.parse import quote_plus
 
@@ -23,7 +24,8 @@ class KissKhClient(BaseClient):
         self.selector_strategy = config.get('alternate_resolution_selector', 'lowest')
         self.hls_size_accuracy = config.get('hls_size_accuracy', 0)
         self.search_limit = config.get('search_limit', 5)
-        super().__init__(config.get('request_timeout', 30), session)
+        self.max_parallel_requests = config.get('max_parallel_requests', 8)
+        super().__init__(config.get('request_timeout', 30), session, config.get('response_cache'))
         self.logger.debug(f'KissKh Drama client initialized with {config = }')
         self.token_generation_js_code = None
         self.quickjs_context = None
@@ -105,39 +107,45 @@ class KissKhClient(BaseClient):
         # url encode search keyword
         search_key = quote_plus(keyword)
 
-        for code, type in search_types.items():
-            if search_type and search_type != code:
-                continue
-            self._colprint('blurred', f"-------------- {type} --------------")
+        def get_details(series_id):
+            self.logger.debug(f'Fetching additional details for series_id: {series_id}')
+            series_data = self._send_request(self.series_url + str(series_id), return_type='json')
+            # episodes are not kept here. They are fetched only for the selected series
+            item = {
+                'title': series_data['title'],
+                'series_id': series_id,
+                'country': series_data['country'],
+                'episodesCount': series_data['episodesCount'],
+                'series_type': series_data['type'],
+                'status': series_data['status']
+            }
+            try:
+                item['year'] = series_data['releaseDate'].split('-')[0]
+            except:
+                item['year'] = 'XXXX'
+
+            return item
+
+        def search_by_type(code, type):
             self.logger.debug(f'Searching for {type} with keyword: {keyword}')
             search_url = self.search_url + search_key + '&type=' + str(code)
-            search_data = self._send_request(search_url, return_type='json')[:search_limit]
-            # if len(search_data) == 0:
-            #     self.logger.error('Nothing here')
-
-            # Get basic details available from the site
-            for result in search_data:
-                series_id = result['id']
-                self.logger.debug(f'Fetching additional details for series_id: {series_id}')
-                series_data = self._send_request(self.series_url + str(series_id), return_type='json')
-                item = {
-                    'title': series_data['title'],
-                    'series_id': series_id,
-                    'country': series_data['country'],
-                    'episodesCount': series_data['episodesCount'],
-                    'series_type': series_data['type'],
-                    'status': series_data['status'],
-                    'episodes': series_data['episodes']
-                }
-                try:
-                    item['year'] = series_data['releaseDate'].split('-')[0]
-                except:
-                    item['year'] = 'XXXX'
-
-                # Add index to every search result
-                search_results[idx] = item
-                self._show_search_results(idx, item)
-                idx += 1
+            search_data = (self._send_request(search_url, return_type='json') or [])[:search_limit]
+            # fetch the details of all the results in parallel, as soon as the search completes
+            return [ executor.submit(get_details, result['id']) for result in search_data ]
+
+        # search all the types & fetch the details of the results in parallel.
+        # Results are shown in order, as soon as they (and the results before them) are fetched
+        with ThreadPoolExecutor(max_workers=self.max_parallel_requests, thread_name_prefix='udb-search-') as executor:
+            searches = { code: executor.submit(search_by_type, code, type) for code, type in search_types.items() if not search_type or search_type == code }
+
+            for code, search in searches.items():
+                self._colprint('blurred', f"-------------- {search_types[code]} --------------")
+                for details in search.result():
+                    item = details.result()
+                    # Add index to every search result
+                    search_results[idx] = item
+                    self._show_search_results(idx, item)
+                    idx += 1
 
         return search_results
 
@@ -147,7 +155,8 @@ class KissKhClient(BaseClient):
         fetch episode links as dict containing link, name
         '''
         all_episodes_list = []
-        episodes = target['episodes']
+        self.logger.debug(f'Fetching episodes of series_id: {target["series_id"]}')
+        episodes = self._send_request(self.series_url + str(target['series_id']), return_type='json')['episodes']
 
         self.logger.debug(f'Extracting episode details for {target["title"]}')
         for episode in episodes:
@@ -229,13 +238,13 @@ class KissKhClient(BaseClient):
                         self.logger.debug(f'Checking encryption type for {k} language...')
                         encryption_type = v.split('?')[0].split('.')[-1]
                         if encryption_type == 'txt':
-                            encrypted_subs_details[k] = {'key': self.DECRYPT_SUBS_KEY, 'iv': self.DECRYPT_SUBS_IV, 'decrypter': self._aes_decrypt}
+                            encrypted_subs_details[k] = {'key': self.DECRYPT_SUBS_KEY, 'iv': self.DECRYPT_SUBS_IV}
                         elif encryption_type == 'txt1':
-                            encrypted_subs_details[k] = {'key': self.DECRYPT_SUBS_KEY2, 'iv': self.DECRYPT_SUBS_IV2, 'decrypter': self._aes_decrypt}
+                            encrypted_subs_details[k] = {'key': self.DECRYPT_SUBS_KEY2, 'iv': self.DECRYPT_SUBS_IV2}
                         elif encryption_type == 'srt':
                             continue    # no encryption
                         else:
-                            encrypted_subs_details[k] = {'key': self.DECRYPT_SUBS_KEY3, 'iv': self.DECRYPT_SUBS_IV3, 'decrypter': self._aes_decrypt}  # use default encryption
+                            encrypted_subs_details[k] = {'key': self.DECRYPT_SUBS_KEY3, 'iv': self.DECRYPT_SUBS_IV3}  # use default encryption
 
                     if encrypted_subs_details:
                         self.logger.debug(f'Encrypted subtitles found. Adding decryption details to udb dict...')
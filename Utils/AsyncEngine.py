@@ -0,0 +1,115 @@
+__author__ = 'Prudhvi PLN'
+
+import asyncio
+import atexit
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+
+
+class AsyncEngine():
+    '''
+    Download engine running all segment / chunk requests as coroutines on a single asyncio event loop (in a background thread).
+    - Requests are made using aiohttp. Total connections are limited by max_connections and per host by max_per_host.
+    - File writes (& other blocking work like decryption) are done through a small threadpool, so that the event loop is never blocked.
+    - Downloaders submit coroutines from their own thread and wait on the returned (concurrent.futures) futures.
+    '''
+    def __init__(self, aiohttp, max_connections, max_per_host=None, file_workers=4):
+        self.logger = logging.getLogger()
+        self.aiohttp = aiohttp
+        self.max_connections = max_connections
+        self.loop = asyncio.new_event_loop()
+        Thread(target=self.loop.run_forever, name='udb-asyncio', daemon=True).start()
+        self.file_executor = ThreadPoolExecutor(max_workers=file_workers, thread_name_prefix='udb-file-')
+        # session must be created within the event loop
+        self.session = asyncio.run_coroutine_threadsafe(self._create_session(max_connections, max_per_host), self.loop).result()
+        atexit.register(self.close)
+        self.logger.debug(f'Asyncio download engine started with {max_connections} connections & {max_per_host} connections per host')
+
+    async def _create_session(self, max_connections, max_per_host):
+        connector = self.aiohttp.TCPConnector(limit=max_connections, limit_per_host=max_per_host or 0)
+        return self.aiohttp.ClientSession(connector=connector)
+
+    async def _create_semaphore(self, value):
+        return asyncio.Semaphore(value)
+
+    async def _run_limited(self, async_func, item, semaphore):
+        async with semaphore:
+            return await async_func(item)
+
+    def submit(self, async_func, items, max_in_flight=None):
+        '''
+        Schedule async_func for every item on the event loop. Returns futures in the same order as items.
+        '''
+        if not max_in_flight:
+            return [ asyncio.run_coroutine_threadsafe(async_func(item), self.loop) for item in items ]
+
+        # create the semaphore within the event loop (required in python < 3.10)
+        semaphore = asyncio.run_coroutine_threadsafe(self._create_semaphore(max_in_flight), self.loop).result()
+        return [ asyncio.run_coroutine_threadsafe(self._run_limited(async_func, item, semaphore), self.loop) for item in items ]
+
+    def cancel(self, futures):
+        for future in futures:
+            future.cancel()
+
+    def get(self, url, headers, timeout):
+        '''
+        Returns an async context manager for the GET response. Raises an exception if the response is not 200 / 206.
+        '''
+        timeout = self.aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        return self.session.get(url, headers=headers, timeout=timeout, raise_for_status=self._check_status)
+
+    async def _check_status(self, response):
+        if response.status not in [200, 206]:   # 206 means partial data (i.e., for chunked downloads)
+            raise Exception(f'Failed with response code: {response.status}')
+
+    async def iter_response(self, response, block_size, rate_limiter=None):
+        '''
+        Iterate over the response data in blocks. Every block is accounted against the download rate limit.
+        '''
+        async for chunk in response.content.iter_chunked(block_size):
+            if rate_limiter:
+                delay = rate_limiter.reserve(len(chunk))
+                if delay > 0: await asyncio.sleep(delay)
+            yield chunk
+
+    async def run_blocking(self, func, *args):
+        # file writes & decryption run in the threadpool, so that the event loop is never blocked
+        return await self.loop.run_in_executor(self.file_executor, func, *args)
+
+    def close(self):
+        '''
+        Close the open connections & stop the event loop
+        '''
+        if self.session.closed:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result(timeout=5)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.file_executor.shutdown(wait=False)
+
+
+_engine = None
+_engine_lock = Lock()
+
+def get_async_engine(dl_config):
+    '''
+    Returns the process-wide asyncio download engine. Returns None if aiohttp is not installed.
+    '''
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            try:
+                import aiohttp
+            except ImportError:
+                logging.getLogger().warning('aiohttp is not installed. Using threads as download engine. Install aiohttp to use asyncio engine')
+                _engine = False
+                return None
+
+            max_connections = dl_config.get('max_concurrent_requests', 'auto')
+            max_connections = 100 if max_connections == 'auto' else int(max_connections)
+            max_per_host = dl_config.get('max_requests_per_host', 'auto')
+            _engine = AsyncEngine(aiohttp, max_connections, None if max_per_host == 'auto' else int(max_per_host))
+
+        return _engine or None
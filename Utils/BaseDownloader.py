@@ -2,15 +2,36 @@ __author__ = 'Prudhvi PLN'
 
 import logging
 import os
+import re
 import requests
+import struct
 import sys
 import http.client
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
+from requests.cookies import get_cookie_header
 from shutil import rmtree
-from ssl import _create_unverified_context
+from subprocess import DEVNULL, PIPE, Popen
+from urllib.parse import urlparse
+from threading import Lock
+from time import perf_counter
 from tqdm.auto import tqdm
 
-from Utils.commons import colprint, exec_os_cmd, retry, PRINT_THEMES, DISPLAY_COLORS
+from Utils.commons import async_retry, colprint, retry, PRINT_THEMES, DISPLAY_COLORS
+from Utils.AsyncEngine import get_async_engine
+from Utils.ConnectionPool import get_connection_pool
+from Utils.DownloadJournal import DownloadJournal
+from Utils.DownloadScheduler import get_download_scheduler
+from Utils.MirrorSelector import MirrorSelector
+from Utils.PostProcessor import get_post_processor
+from Utils.RateLimiter import get_rate_limiter
+from Utils.SegmentCache import get_segment_cache
+from Utils.SubtitleDecrypter import decrypt_srt
+
+
+# subtitles shared by all downloads of the run. Fetched once per url
+_subtitles = {}
+_subtitle_locks = {}
+_subtitles_lock = Lock()
 
 
 class BaseDownloader():
@@ -26,6 +47,7 @@ class BaseDownloader():
         # add extra folder for season
         if ep_details.get('type', '') == 'tv':
             self.out_dir = f"{self.out_dir}{os.sep}Season-{ep_details['season']}"
+        # max in-flight requests per episode. If set to auto, episode can use any idle worker of the shared scheduler
         self.concurrency = None if dl_config.get('concurrency_per_file', 'auto') == 'auto' else dl_config['concurrency_per_file']
         self.parent_temp_dir = os.path.join(f'{self.out_dir}', 'temp_dir') if dl_config.get('temp_download_dir', 'auto') == 'auto' else dl_config['temp_download_dir']
         self.temp_dir = os.path.join(f"{self.parent_temp_dir}", f"{self.out_file.replace('.mp4','')}") #create temp directory per episode
@@ -34,13 +56,54 @@ class BaseDownloader():
         self.subtitles = ep_details.get('subtitles', {})
         # special case for encrypted subtitles in kisskh client
         self.encrypted_subs_details = ep_details.get('encrypted_subs_details', {})
-        self.thread_name_prefix = 'udb-mp4-'
+        # equivalent mp4 links. Chunks are spread across all the healthy mirrors
+        self.mirror_links = ep_details.get('mirrorLinks', [])
+        self.mirrors = None
+        # subtitles are downloaded along with the video data
+        self.subtitle_details = []
+        self.subtitle_futures = None
+        self.subtitle_job = None
+        # mp4 write mode: 'preallocate' writes chunks directly into the output file, 'chunks' writes chunk files and merges them at the end
+        self.mp4_write_mode = dl_config.get('mp4_write_mode', 'preallocate')
+        self.part_file = os.path.join(f'{self.out_dir}', f'{self.out_file}.part')
+        # mux the subtitles while downloading (single write of the output), if the mp4 can be read from a pipe
+        self.mp4_single_pass_mux = dl_config.get('mp4_single_pass_mux', True)
+        self.stream_state_file = os.path.join(f'{self.temp_dir}', 'stream.state')
+        self.out_fd = None
+        self.write_lock = Lock()
+        self.journal = None
+        # remux steps run after the download on the post-processing workers, so that the download slot is free for the next episode
+        self.post_processor = get_post_processor(dl_config)
+        self.post_process_steps = []
+        self.ffmpeg_log_file = os.path.join(f'{self.temp_dir}', 'ffmpeg.log')
 
         # create a requests session and use across to re-use cookies
         self.req_session = session if session else requests.Session()
 
         # set http client usage based on config. As on Feb 21 2025, kisskh works with only http.client
         self.use_http_client = dl_config.get('use_http_client', False)
+        # keep-alive connections & TLS sessions shared by all workers and downloads
+        self.connection_pool = get_connection_pool() if self.use_http_client else None
+        # download engine: 'threads' uses the workers shared by all episodes, 'asyncio' runs all requests on one event loop
+        download_engine = dl_config.get('download_engine', 'threads')
+        if download_engine == 'asyncio' and self.use_http_client:
+            # sources requiring http.client (its connection pool & SSL context) can't be downloaded using aiohttp
+            self.logger.debug('Source requires http.client. Using threads as download engine')
+            download_engine = 'threads'
+        self.async_engine = get_async_engine(dl_config) if download_engine == 'asyncio' else None
+        self.scheduler = None if self.async_engine else get_download_scheduler(dl_config)
+        if self.scheduler:
+            # keep a connection per worker, instead of dropping them once the default pool of 10 connections is full
+            adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=self.scheduler.max_workers)
+            self.req_session.mount('https://', adapter)
+            self.req_session.mount('http://', adapter)
+        # download rate limit shared by all downloads. Read in smaller blocks when limited, for a smoother rate
+        self.rate_limiter = get_rate_limiter(dl_config)
+        self.chunk_size = 1024*1024     # 1MiB
+        # persistent cache of segments / chunks shared across runs & episodes, if enabled
+        self.segment_cache = get_segment_cache(dl_config)
+        self.chunk_cache_id = None      # validator of the mp4. Chunks are cached only if the source has a validator
+        self.read_block_size = 64*1024 if self.rate_limiter else self.chunk_size
 
         self.req_session.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36",
@@ -64,37 +127,11 @@ class BaseDownloader():
         Fetch raw stream data using requests or http.client
         '''
         if self.use_http_client:
-            # Use http.client for the request with redirect support
-            max_redirects = 5
-            current_url = url
-            for _ in range(max_redirects):
-                parsed_url = requests.utils.urlparse(current_url)
-                conn = http.client.HTTPSConnection(parsed_url.netloc, timeout=self.request_timeout, context=_create_unverified_context())
-                path = parsed_url.path
-                if parsed_url.query:
-                    path += '?' + parsed_url.query
-                headers = self.req_session.headers.copy()
-                if header: headers.update(header)
-                conn.request("GET", path, headers=headers)
-                response = conn.getresponse()
-                if response.status in [200, 206]:  # Success - 206 means partial data (i.e., for chunked downloads)
-                    return response
-                elif response.status in [301, 302, 303, 307, 308]:
-                    # Handle redirect
-                    location = response.getheader('Location')
-                    if not location:
-                        raise Exception(f'Redirect ({response.status}) with no Location header')
-                    current_url = requests.compat.urljoin(current_url, location)
-                    conn.close()
-                    continue
-                else:
-                    raise Exception(f'Failed with response code: {response.status}')
-            raise Exception(f'Too many redirects while fetching {url}')
+            # Use pooled keep-alive http.client connections with redirect support
+            return self.connection_pool.get(url, headers=self._get_request_headers(header), timeout=self.request_timeout)
         else:
             # Use requests for the request
-            headers = self.req_session.headers.copy()
-            if header: headers.update(header)
-            response = self.req_session.get(url, stream=stream, timeout=self.request_timeout, headers=headers)
+            response = self.req_session.get(url, stream=stream, timeout=self.request_timeout, headers=self._get_request_headers(header))
             if response.status_code in [200, 206]:  # 206 means partial data (i.e., for chunked downloads)
                 return response
             else:
@@ -117,12 +154,12 @@ class BaseDownloader():
         rmtree(self.temp_dir)
 
     def _cleanup_out_dirs(self):
-        if len(os.listdir(self.parent_temp_dir)) == 0: os.rmdir(self.parent_temp_dir)
-        if len(os.listdir(self.out_dir)) == 0: os.rmdir(self.out_dir)
-
-    def _exec_cmd(self, cmd):
-        self.logger.debug(f'Executing system command: {cmd}')
-        return exec_os_cmd(cmd)
+        # directories are shared by the episodes. Another episode might have removed them (or added files) already
+        for dir in (self.parent_temp_dir, self.out_dir):
+            try:
+                if len(os.listdir(dir)) == 0: os.rmdir(dir)
+            except OSError as e:
+                self.logger.debug(f'Skipped removing directory [{dir}]: {e}')
 
     def _get_display_prefix(self):
         # shorten the name to show only ep number
@@ -151,50 +188,349 @@ class BaseDownloader():
         end = start + self.chunk_size - 1
         return {'Range': f'bytes={start}-{end}'}
 
+    def _get_chunk_length(self, start):
+        return min(self.chunk_size, self.file_size - start)
+
+    def _get_status_code(self, response):
+        return response.status if isinstance(response, http.client.HTTPResponse) else response.status_code
+
+    def _parse_content_range(self, response):
+        '''
+        Returns (start, total size) from Content-Range header of a partial response. Returns (None, None) if not a valid partial response.
+        '''
+        content_range = re.match(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', response.headers.get('content-range') or '')
+        if self._get_status_code(response) != 206 or content_range is None:
+            return None, None
+
+        total = content_range.group(3)
+        return int(content_range.group(1)), (int(total) if total != '*' else None)
+
+    def _get_validator(self, response):
+        '''
+        Returns ETag (only strong) or Last-Modified of the response which can be used in If-Range header
+        '''
+        etag = response.headers.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.headers.get('last-modified')
+
+    def _iter_response(self, response):
+        '''
+        Iterate over the response data in blocks. Every block is accounted against the download rate limit.
+        '''
+        if isinstance(response, http.client.HTTPResponse):
+            blocks = iter(lambda: response.read(self.read_block_size), b'')
+        else:
+            blocks = response.iter_content(self.read_block_size)
+
+        for chunk in blocks:
+            if chunk:
+                if self.rate_limiter: self.rate_limiter.consume(len(chunk))
+                yield chunk
+
+    def _preallocate_file(self, file_path, size):
+        '''
+        Reserve the disk space for the output file, so that chunks can be written directly at their offsets.
+        Creates a sparse file if the platform / filesystem doesn't support fallocate.
+        '''
+        fd = os.open(file_path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0))
+        try:
+            current_size = os.fstat(fd).st_size
+            if current_size == size:
+                return
+            if current_size > size:
+                os.ftruncate(fd, size)
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                    return
+                except OSError as e:
+                    self.logger.debug(f'fallocate not supported ({e}). Creating a sparse file instead')
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+    def _write_at(self, offset, data):
+        '''
+        Write data at the given offset of the (preallocated) output file. Safe to call from multiple threads.
+        '''
+        view = memoryview(data)
+        if hasattr(os, 'pwrite'):
+            while view:
+                written = os.pwrite(self.out_fd, view, offset)
+                view, offset = view[written:], offset + written
+        else:
+            # no positional writes in Windows. So, serialize seek + write
+            with self.write_lock:
+                os.lseek(self.out_fd, offset, os.SEEK_SET)
+                while view:
+                    view = view[os.write(self.out_fd, view):]
+
+        return len(data)
+
+    def _is_saved(self, file_path, size):
+        # file of the journaled item exists with all of its data
+        return os.path.isfile(file_path) and os.path.getsize(file_path) == size
+
+    def _write_file(self, file_path, data):
+        '''
+        Write data to a temp file and rename it, so that a half-written file is never used
+        '''
+        with open(f'{file_path}.part', 'wb') as f:
+            size = f.write(data)
+        os.replace(f'{file_path}.part', file_path)
+
+        return size
+
+    def _get_reusable_chunk_size(self, chunk_details):
+        '''
+        Returns the size of the chunk if it is already downloaded, else None
+        '''
+        chunk_no = chunk_details[3]
+        return self.journal.get_size(chunk_no) if self.journal.is_completed(chunk_no) else None
+
+    def _save_chunk(self, data_blocks, chunk_details):
+        '''
+        Write the chunk data (iterable of blocks) to its own chunk file or directly into the output file, based on mp4 write mode.
+        Returns the size of the chunk written.
+        '''
+        _, _, chunk_name, chunk_no, chunk_start = chunk_details
+        size = 0
+        blocks = [] if self.chunk_cache_id else None
+        if self.mp4_write_mode == 'preallocate':
+            for chunk in data_blocks:
+                size += self._write_at(chunk_start + size, chunk)
+                if blocks is not None: blocks.append(chunk)
+        else:
+            with open(os.path.join(f'{self.temp_dir}', f'{chunk_name}'), 'wb') as f:
+                for chunk in data_blocks:
+                    size += f.write(chunk)
+                    if blocks is not None: blocks.append(chunk)
+
+        # chunk is complete only if all of its bytes are written. Journal ignores the chunk otherwise
+        self.journal.mark_completed(chunk_no, size)
+        if not self.journal.is_completed(chunk_no):
+            raise Exception(f'Incomplete chunk. Received {size} / {self._get_chunk_length(chunk_start)} bytes')
+        if blocks is not None: self.segment_cache.put(self._get_chunk_cache_key(chunk_details), b''.join(blocks))
+
+        return size
+
+    def _get_chunk_cache_key(self, chunk_details):
+        chunk_start = chunk_details[4]
+        return self.segment_cache.get_key(chunk_details[0], f'{chunk_start}-{chunk_start + self._get_chunk_length(chunk_start) - 1}|{self.chunk_cache_id}')
+
+    def _save_cached_chunk(self, chunk_details):
+        '''
+        Save the chunk from the segment cache, if cached. Returns the size of the chunk, else None
+        '''
+        if not self.chunk_cache_id:
+            return None
+        _, _, chunk_name, chunk_no, chunk_start = chunk_details
+        data = self.segment_cache.get(self._get_chunk_cache_key(chunk_details))
+        if data is None or len(data) != self._get_chunk_length(chunk_start):
+            return None
+
+        if self.mp4_write_mode == 'preallocate':
+            size = self._write_at(chunk_start, data)
+        else:
+            size = self._write_file(os.path.join(f'{self.temp_dir}', f'{chunk_name}'), data)
+        self.journal.mark_completed(chunk_no, size)
+
+        return size
+
     @retry()
     def _download_chunk(self, chunk_details):
         '''
-        download chunk file from download link based on defined chunk size. Reuse if already downloaded.
+        download chunk from download link based on defined chunk size. Reuse if already downloaded.
 
         Returns: (download_status, progress_bar_increment)
         '''
         try:
-            dl_link, chunk_header, chunk_name = chunk_details
-            chunk_file = os.path.join(f'{self.temp_dir}', f'{chunk_name}')
+            dl_link, chunk_header, chunk_name, _, _ = chunk_details
 
             # check if the chunk is already downloaded
-            if os.path.isfile(chunk_file) and os.path.getsize(chunk_file) > 0:
-                return (f'Chunk [{chunk_name}] already exists. Reusing.', os.path.getsize(chunk_file))
-
-            # get the data for the chunk size defined in the header
-            response = self._get_raw_stream_data(dl_link, False, chunk_header)
-
-            # capture the size to update progress bar
-            size = 0 
-            with open(chunk_file, 'wb') as f:
-                if isinstance(response, http.client.HTTPResponse):
-                    while True:
-                        chunk = response.read(self.chunk_size)
-                        if not chunk:
-                            break
-                        size += f.write(chunk)
-                else:
-                    for chunk in response.iter_content(self.chunk_size):
-                        if chunk:
-                            size += f.write(chunk)
+            reusable_size = self._get_reusable_chunk_size(chunk_details)
+            if reusable_size is not None:
+                return (f'Chunk [{chunk_name}] already exists. Reusing.', reusable_size)
+
+            # check if the chunk is cached by an earlier run
+            cached_size = self._save_cached_chunk(chunk_details)
+            if cached_size is not None:
+                return (f'Chunk [{chunk_name}] found in cache. Reusing.', cached_size)
+
+            # pick a mirror for every attempt. So, a retry of a failed chunk can go to another mirror
+            if self.mirrors: dl_link = self.mirrors.select()
+            start_time = perf_counter()
+            try:
+                # get the data for the chunk size defined in the header
+                response = self._get_raw_stream_data(dl_link, True, chunk_header)
+                if self._get_status_code(response) != 206:
+                    # never write the whole file into a chunk
+                    response.close()
+                    raise Exception('Server ignored the range request')
+
+                # capture the size to update progress bar
+                size = self._save_chunk(self._iter_response(response), chunk_details)
+
+            except Exception:
+                if self.mirrors: self.mirrors.report_failure(dl_link)
+                raise
+
+            if self.mirrors: self.mirrors.report_success(dl_link, size, perf_counter() - start_time)
 
             return (f'Chunk [{chunk_name}] downloaded', size)
 
         except Exception as e:
             return (f'\nERROR: Chunk download failed [{chunk_name}] due to: {e}', 0)
 
-    def _multi_threaded_download(self, download_func, urls, **metadata):
-        reused_segments = 0
-        failed_segments = 0
-        ep_no = self._get_display_prefix()
-        type = metadata.pop('type')
-        self.logger.debug(f'[{ep_no}] Downloading {len(urls)} {type} using {self.concurrency} workers...')
+    def _get_request_headers(self, header=None):
+        headers = self.req_session.headers.copy()
+        if header: headers.update(header)
+        return headers
+
+    def _get_async_request_headers(self, url, header=None):
+        # aiohttp session doesn't share the cookies of the requests session. So, send them in the headers
+        headers = self._get_request_headers(header)
+        cookie = get_cookie_header(self.req_session.cookies, requests.Request('GET', url))
+        if cookie: headers['Cookie'] = cookie
+        return headers
 
+    async def _save_chunk_async(self, response, chunk_details):
+        '''
+        Async version of _save_chunk. Data is written through the file I/O threads of the asyncio engine.
+        '''
+        _, _, chunk_name, chunk_no, chunk_start = chunk_details
+        size = 0
+        blocks = [] if self.chunk_cache_id else None
+        if self.mp4_write_mode == 'preallocate':
+            async for chunk in self.async_engine.iter_response(response, self.read_block_size, self.rate_limiter):
+                size += await self.async_engine.run_blocking(self._write_at, chunk_start + size, chunk)
+                if blocks is not None: blocks.append(chunk)
+        else:
+            # chunks are small. So, write the chunk file at once
+            blocks = [ chunk async for chunk in self.async_engine.iter_response(response, self.read_block_size, self.rate_limiter) ]
+            size = await self.async_engine.run_blocking(self._write_file, os.path.join(f'{self.temp_dir}', f'{chunk_name}'), b''.join(blocks))
+            if not self.chunk_cache_id: blocks = None
+
+        await self.async_engine.run_blocking(self.journal.mark_completed, chunk_no, size)
+        if not self.journal.is_completed(chunk_no):
+            raise Exception(f'Incomplete chunk. Received {size} / {self._get_chunk_length(chunk_start)} bytes')
+        if blocks is not None: await self.async_engine.run_blocking(self.segment_cache.put, self._get_chunk_cache_key(chunk_details), b''.join(blocks))
+
+        return size
+
+    @async_retry()
+    async def _download_chunk_async(self, chunk_details):
+        '''
+        Async version of _download_chunk, used by the asyncio download engine.
+
+        Returns: (download_status, progress_bar_increment)
+        '''
+        try:
+            dl_link, chunk_header, chunk_name, _, _ = chunk_details
+
+            # check if the chunk is already downloaded
+            reusable_size = self._get_reusable_chunk_size(chunk_details)
+            if reusable_size is not None:
+                return (f'Chunk [{chunk_name}] already exists. Reusing.', reusable_size)
+
+            cached_size = await self.async_engine.run_blocking(self._save_cached_chunk, chunk_details)
+            if cached_size is not None:
+                return (f'Chunk [{chunk_name}] found in cache. Reusing.', cached_size)
+
+            if self.mirrors: dl_link = self.mirrors.select()
+            start_time = perf_counter()
+            try:
+                async with self.async_engine.get(dl_link, self._get_async_request_headers(dl_link, chunk_header), self.request_timeout) as response:
+                    if response.status != 206:
+                        # never write the whole file into a chunk
+                        raise Exception('Server ignored the range request')
+
+                    size = await self._save_chunk_async(response, chunk_details)
+
+            except Exception:
+                if self.mirrors: self.mirrors.report_failure(dl_link)
+                raise
+
+            if self.mirrors: self.mirrors.report_success(dl_link, size, perf_counter() - start_time)
+
+            return (f'Chunk [{chunk_name}] downloaded', size)
+
+        except Exception as e:
+            return (f'\nERROR: Chunk download failed [{chunk_name}] due to: {e}', 0)
+
+    @retry()
+    def _fetch_chunk(self, chunk_details):
+        '''
+        fetch a chunk into memory (from the segment cache, if cached) without saving it. Used to stream the chunks to ffmpeg.
+
+        Returns: (download_status, chunk data)
+        '''
+        try:
+            dl_link, chunk_header, chunk_name, _, chunk_start = chunk_details
+            cache_key = self._get_chunk_cache_key(chunk_details) if self.chunk_cache_id else None
+            data = self.segment_cache.get(cache_key) if cache_key else None
+            if data is not None and len(data) == self._get_chunk_length(chunk_start):
+                return (f'Chunk [{chunk_name}] found in cache. Reusing.', data)
+
+            if self.mirrors: dl_link = self.mirrors.select()
+            start_time = perf_counter()
+            try:
+                response = self._get_raw_stream_data(dl_link, True, chunk_header)
+                if self._get_status_code(response) != 206:
+                    response.close()
+                    raise Exception('Server ignored the range request')
+                data = b''.join(self._iter_response(response))
+                if len(data) != self._get_chunk_length(chunk_start):
+                    raise Exception(f'Incomplete chunk. Received {len(data)} / {self._get_chunk_length(chunk_start)} bytes')
+
+            except Exception:
+                if self.mirrors: self.mirrors.report_failure(dl_link)
+                raise
+
+            if self.mirrors: self.mirrors.report_success(dl_link, len(data), perf_counter() - start_time)
+            if cache_key: self.segment_cache.put(cache_key, data)
+
+            return (f'Chunk [{chunk_name}] downloaded', data)
+
+        except Exception as e:
+            return (f'\nERROR: Chunk download failed [{chunk_name}] due to: {e}', 0)
+
+    @async_retry()
+    async def _fetch_chunk_async(self, chunk_details):
+        '''
+        Async version of _fetch_chunk, used by the asyncio download engine.
+        '''
+        try:
+            dl_link, chunk_header, chunk_name, _, chunk_start = chunk_details
+            cache_key = self._get_chunk_cache_key(chunk_details) if self.chunk_cache_id else None
+            data = await self.async_engine.run_blocking(self.segment_cache.get, cache_key) if cache_key else None
+            if data is not None and len(data) == self._get_chunk_length(chunk_start):
+                return (f'Chunk [{chunk_name}] found in cache. Reusing.', data)
+
+            if self.mirrors: dl_link = self.mirrors.select()
+            start_time = perf_counter()
+            try:
+                async with self.async_engine.get(dl_link, self._get_async_request_headers(dl_link, chunk_header), self.request_timeout) as response:
+                    if response.status != 206:
+                        raise Exception('Server ignored the range request')
+                    data = b''.join([ chunk async for chunk in self.async_engine.iter_response(response, self.read_block_size, self.rate_limiter) ])
+                if len(data) != self._get_chunk_length(chunk_start):
+                    raise Exception(f'Incomplete chunk. Received {len(data)} / {self._get_chunk_length(chunk_start)} bytes')
+
+            except Exception:
+                if self.mirrors: self.mirrors.report_failure(dl_link)
+                raise
+
+            if self.mirrors: self.mirrors.report_success(dl_link, len(data), perf_counter() - start_time)
+            if cache_key: await self.async_engine.run_blocking(self.segment_cache.put, cache_key, data)
+
+            return (f'Chunk [{chunk_name}] downloaded', data)
+
+        except Exception as e:
+            return (f'\nERROR: Chunk download failed [{chunk_name}] due to: {e}', 0)
+
+    def _create_progress_bar(self, ep_no, **metadata):
         theme = PRINT_THEMES['results'] if DISPLAY_COLORS else ''
         metadata.update({
             'desc': f'Downloading {ep_no}',
@@ -204,12 +540,34 @@ class BaseDownloader():
             'bar_format': theme + '{l_bar}{bar}' + theme + '{r_bar}'
         })
 
+        return tqdm(**metadata)
+
+    def _get_item_host(self, item):
+        # work item is an url, chunk details (with url as first element) or a group of segments
+        url = item if isinstance(item, str) else item[0]
+        return urlparse(getattr(url, 'uri', url)).netloc
+
+    def _multi_threaded_download(self, download_func, urls, async_download_func=None, **metadata):
+        reused_segments = 0
+        failed_segments = 0
+        ep_no = self._get_display_prefix()
+        type = metadata.pop('type')
+        engine = f'asyncio engine ({self.async_engine.max_connections} connections)' if self.async_engine else f'{self.concurrency or self.scheduler.max_workers} workers'
+        self.logger.debug(f'[{ep_no}] Downloading {len(urls)} {type} using {engine}...')
+
         # show progress of download using tqdm
-        with tqdm(**metadata) as progress:
-            # parallelize download of segments/chunks using a threadpool
-            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=self.thread_name_prefix) as executor:
-                results = [ executor.submit(download_func, ts_url) for ts_url in urls ]
+        with self._create_progress_bar(ep_no, **metadata) as progress:
+            if self.async_engine:
+                # run all downloads as coroutines on the shared event loop
+                results = self.async_engine.submit(async_download_func, urls, self.concurrency)
+                cleanup = lambda: self.async_engine.cancel(results)
+            else:
+                # parallelize download of segments/chunks using the workers shared by all episodes
+                job = self.scheduler.create_job(ep_no, self.concurrency)
+                results = self.scheduler.submit(job, download_func, urls, self._get_item_host)
+                cleanup = lambda: self.scheduler.close_job(job)
 
+            try:
                 for result in as_completed(results):
                     status, size = result.result()
                     if 'ERROR' in status:
@@ -225,11 +583,47 @@ class BaseDownloader():
                     # add reused / failed segments/chunks status
                     seg_status = f'R/F: {reused_segments}/{failed_segments}'
                     progress.set_postfix_str(seg_status, refresh=True)
+            finally:
+                # cancel pending work, if download is interrupted
+                cleanup()
 
         self.logger.info(f'[{ep_no}] {type.capitalize()} download status: Total: {len(urls)} | Reused: {reused_segments} | Failed: {failed_segments}')
+        if self.mirrors: self.logger.debug(f'[{ep_no}] Mirror stats: {self.mirrors.get_stats()}')
+        if self.connection_pool: self.logger.debug(f'[{ep_no}] Connection pool stats: {self.connection_pool.stats}')
+        if self.segment_cache: self.logger.info(f'[{ep_no}] Segment cache stats: {self.segment_cache.get_stats()}')
         if failed_segments > 0:
             raise Exception(f'Failed to download {failed_segments} / {len(urls)} {type}')
 
+    def _ordered_download(self, download_func, urls, async_download_func=None, window=32):
+        '''
+        Download in parallel, but yield the results in the same order as urls.
+        At most `window` items are downloaded ahead of the oldest pending one, which bounds the results held in memory.
+        '''
+        ep_no = self._get_display_prefix()
+        if self.async_engine:
+            submit = lambda url: self.async_engine.submit(async_download_func, [url])[0]
+        else:
+            job = self.scheduler.create_job(ep_no, self.concurrency)
+            submit = lambda url: self.scheduler.submit(job, download_func, [url], self._get_item_host)[0]
+
+        pending = {}
+        next_submit = 0
+        try:
+            for next_yield in range(len(urls)):
+                # keep the reorder window full
+                while next_submit < len(urls) and next_submit < next_yield + window:
+                    pending[next_submit] = submit(urls[next_submit])
+                    next_submit += 1
+
+                yield pending.pop(next_yield).result()
+
+        finally:
+            # cancel pending work, if download is interrupted
+            if self.async_engine:
+                self.async_engine.cancel(pending.values())
+            else:
+                self.scheduler.close_job(job)
+
     def _merge_chunks(self, chunks_count):
         out_file = os.path.join(f'{self.out_dir}', f'{self.out_file}')
 
@@ -243,114 +637,452 @@ class BaseDownloader():
                 # remove the merged chunk
                 os.remove(chunk_file)
 
-    def _download_subtitles(self):
-        for sub_name in list(self.subtitles):
-            sub_link = self.subtitles[sub_name]
-            sub_file = os.path.join(self.temp_dir, sub_name.replace(' ', '_') + '_' + os.path.basename(sub_link.split('?')[0]))
-            # update the dictionary pointing to downloaded file
-            self.subtitles[sub_name] = sub_file
+    def _get_subtitle_data(self, sub_name, sub_link):
+        '''
+        Returns the (decrypted) subtitle of the url. Subtitles are fetched once per url & shared by all downloads of the run
+        (ex: same episode in another resolution), and kept in the segment cache (if enabled) for the later runs.
+        '''
+        with _subtitles_lock:
+            if sub_link in _subtitles:
+                return _subtitles[sub_link]
+            sub_lock = _subtitle_locks.setdefault(sub_link, Lock())
 
-            try:
-                self.logger.debug(f'Downloading {sub_name} subtitle from {sub_link} to {sub_file}')
-                if os.path.isfile(sub_file):
-                    self.logger.debug('Subtitle file already exists. Skipping...')
-                    continue
-                sub_content = self._get_stream_data(sub_link)
-                # download the subtitle to local
-                with open(sub_file, 'wb') as f:
-                    f.write(sub_content)
-
-                if self.encrypted_subs_details.get(sub_name):
-                    self._decrypt_subtitle_file(sub_file, **self.encrypted_subs_details[sub_name])
+        with sub_lock:
+            if sub_link not in _subtitles:
+                encryption_details = self.encrypted_subs_details.get(sub_name)
+                cache_key = self.segment_cache.get_key(sub_link, f'subtitle|{bool(encryption_details)}') if self.segment_cache else None
+                sub_content = self.segment_cache.get(cache_key) if cache_key else None
+                if sub_content is None:
+                    self.logger.debug(f'Downloading {sub_name} subtitle from {sub_link}')
+                    sub_content = self._get_stream_data(sub_link)
+                    if encryption_details:
+                        sub_content = self._decrypt_subtitle(sub_content, **encryption_details)
+                    if cache_key: self.segment_cache.put(cache_key, sub_content)
+                with _subtitles_lock:
+                    _subtitles[sub_link] = sub_content
 
-            except Exception as e:
-                self.logger.warning(f'Failed to download {sub_name} subtitle with error: {e}')
-                self.subtitles.pop(sub_name)
-
-    def _decrypt_subtitle_file(self, sub_file, **kwargs):
-        self.logger.debug(f'Decrypting subtitle file: {sub_file}')
-        decrypter = kwargs['decrypter']
-        subs_key, subs_iv = kwargs['key'], kwargs['iv']
-
-        with open(sub_file, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-
-        decryption_fail_count = 0
-        total_line_count = 0
-        with open(sub_file, 'w', encoding='utf-8') as file:
-            for line in lines:
-                if line.strip() and not line.strip().isdigit() and "-->" not in line:
-                    try:
-                        # decrypt and replace subtitle text lines
-                        file.write(decrypter(line.strip(), subs_key, subs_iv) + '\n')
-                        total_line_count += 1
-                    except:
-                        # write the line as-is if decryption fails
-                        file.write(line)
-                        decryption_fail_count += 1
+        return _subtitles[sub_link]
+
+    def _download_subtitle(self, sub_details):
+        '''
+        download (and decrypt) a subtitle to its file. Runs on the download workers, along with the video data.
+
+        Returns: (download_status, size)
+        '''
+        sub_link, sub_name, sub_file = sub_details
+        try:
+            if os.path.isfile(sub_file):
+                return (f'Subtitle [{sub_name}] already exists. Reusing.', os.path.getsize(sub_file))
+
+            size = self._write_file(sub_file, self._get_subtitle_data(sub_name, sub_link))
+
+            return (f'Subtitle [{sub_name}] downloaded', size)
+
+        except Exception as e:
+            return (f'ERROR: Subtitle download failed [{sub_name}] due to: {e}', 0)
+
+    async def _download_subtitle_async(self, sub_details):
+        return await self.async_engine.run_blocking(self._download_subtitle, sub_details)
+
+    def _prefetch_subtitles(self):
+        '''
+        Schedule the download of all the subtitles on the download workers, as soon as the episode starts.
+        '''
+        self.subtitle_details = [ [sub_link, sub_name, os.path.join(self.temp_dir, sub_name.replace(' ', '_') + '_' + os.path.basename(sub_link.split('?')[0]))]
+                                  for sub_name, sub_link in self.subtitles.items() ]
+        if not self.subtitle_details:
+            return
+
+        self.logger.debug(f'Prefetching {len(self.subtitle_details)} subtitles')
+        if self.async_engine:
+            self.subtitle_futures = self.async_engine.submit(self._download_subtitle_async, self.subtitle_details)
+        else:
+            self.subtitle_job = self.scheduler.create_job(f'{self._get_display_prefix()}-subtitles')
+            self.subtitle_futures = self.scheduler.submit(self.subtitle_job, self._download_subtitle, self.subtitle_details, self._get_item_host)
+
+    def _download_subtitles(self):
+        '''
+        Wait for the prefetched subtitles & point them to their downloaded files. Failed subtitles are skipped.
+        '''
+        if self.subtitle_futures is None:
+            self._prefetch_subtitles()
+
+        try:
+            for (_, sub_name, sub_file), future in zip(self.subtitle_details, self.subtitle_futures or []):
+                status, _ = future.result()
+                if 'ERROR' in status:
+                    self.logger.warning(status)
+                    self.subtitles.pop(sub_name)
                 else:
-                    # write sequence numbers, timestamps, and empty lines as-is
-                    file.write(line)
+                    self.logger.debug(status)
+                    self.subtitles[sub_name] = sub_file
+        finally:
+            self._close_subtitle_job()
+
+    def _close_subtitle_job(self):
+        # pending subtitles (if any) are cancelled
+        if self.subtitle_job:
+            self.scheduler.close_job(self.subtitle_job)
+            self.subtitle_job = None
+        for future in self.subtitle_futures or []:
+            future.cancel()
+
+    def _decrypt_subtitle(self, sub_content, key, iv, **kwargs):
+        self.logger.debug('Decrypting subtitle')
+        sub_content, decryption_fail_count, total_line_count = decrypt_srt(sub_content, key, iv)
         if decryption_fail_count > 0:
             self.logger.warning(f'Failed to decrypt {decryption_fail_count}/{total_line_count} lines in the subtitle file')
 
+        return sub_content
+
+    def _get_remux_cmd(self, input_args, out_file, adts_audio=True):
+        '''
+        ffmpeg command to remux the input (and the downloaded subtitles) into mp4
+        '''
+        command = ['ffmpeg', '-loglevel', 'warning', '-y'] + input_args
+        maps = ['-map', '0:v', '-map', '0:a'] if self.subtitles else []
+        metadata = []
+
+        for i, (lang, sub_file) in enumerate(self.subtitles.items(), start=1):
+            command.extend(['-i', sub_file])
+            maps.extend(['-map', f'{i}'])
+            metadata.extend([f'-metadata:s:s:{i-1}', f'title={lang}'])
+
+        metadata.extend(['-c:v', 'copy', '-c:a', 'copy', '-c:s', 'mov_text'])
+        # mpeg-ts carries aac in adts format, which mp4 doesn't support
+        if adts_audio: metadata.extend(['-bsf:a', 'aac_adtstoasc'])
+        metadata.append(out_file)
+
+        return command + maps + metadata
+
+    def _pipe_to_ffmpeg(self, cmd, out_file, data_blocks):
+        '''
+        Run the ffmpeg command reading from stdin (pipe:0) & feed it the data blocks, as they are downloaded. Output is removed on failure.
+        '''
+        with open(self.ffmpeg_log_file, 'wb') as ffmpeg_log:
+            process = Popen(cmd, stdin=PIPE, stdout=DEVNULL, stderr=ffmpeg_log)
+            try:
+                for data in data_blocks:
+                    process.stdin.write(data)
+                process.stdin.close()
+
+            except BrokenPipeError:
+                pass    # ffmpeg exited early. Error is reported below
+
+            except BaseException:
+                process.kill()
+                process.wait()
+                if os.path.isfile(out_file): os.remove(out_file)
+                raise
+
+            if process.wait() != 0:
+                if os.path.isfile(out_file): os.remove(out_file)
+                with open(self.ffmpeg_log_file, 'r', errors='replace') as f:
+                    raise Exception(f'Error occured: {f.read()}')
+
+    def _run_ffmpeg(self, cmd, out_file, duration=None):
+        try:
+            self.post_processor.run_ffmpeg(cmd, self.ffmpeg_log_file, duration, f'Converting {self._get_display_prefix()}')
+        except Exception:
+            if os.path.isfile(out_file): os.remove(out_file)
+            raise
+
     def _add_subtitles(self):
-        # print(f'Converting {self.out_file} to mp4')
         out_file = os.path.join(f'{self.out_dir}', f'{self.out_file}')
         # ffmpeg can't do in-place conversion. So, create a temp file and replace the original file
         temp_out_file = os.path.join(f'{self.out_dir}', f'temp_{self.out_file}')
-        command = [f'ffmpeg -loglevel warning -i "{out_file}"']
-        maps = ['-map 0:v -map 0:a'] if self.subtitles else []
-        metadata = []
+        self._run_ffmpeg(self._get_remux_cmd(['-i', out_file], temp_out_file, adts_audio=False), temp_out_file)
 
-        # Prepare the command if subtitles are present
-        for i, (lang, url) in enumerate(self.subtitles.items(), start=1):
-            command.append(f'-i "{url}"')
-            maps.append(f'-map {i}')
-            metadata.append(f'-metadata:s:s:{i-1} title="{lang}"')
+        # Replace original file with the new file
+        os.replace(temp_out_file, out_file)
 
-        metadata.append(f'-c:v copy -c:a copy -c:s mov_text -bsf:a aac_adtstoasc "{temp_out_file}"')
+    def _load_stream_state(self):
+        '''
+        Returns (bytes already downloaded, validator) of an interrupted single stream download
+        '''
+        if not os.path.isfile(self.stream_state_file) or not os.path.isfile(self.part_file):
+            return 0, None
 
-        cmd = ' '.join(command + maps + metadata)
-        self._exec_cmd(cmd)
+        with open(self.stream_state_file, 'r') as f:
+            validator = f.read().strip()
 
-        # Replace original file with the new file
-        os.replace(temp_out_file, out_file)
+        return (os.path.getsize(self.part_file), validator) if validator else (0, None)
 
-    def start_download(self, dl_link):
-        # set chunk size to 1MiB
-        self.chunk_size = 1024*1024
-        # create output directory
-        self._create_out_dirs()
+    def _init_mirrors(self, dl_link):
+        '''
+        Verify the mirror links serve the same file (by size) and set up the mirror selector
+        '''
+        mirrors = [dl_link]
+        for mirror_link in self.mirror_links:
+            if mirror_link in mirrors: continue
+            try:
+                response = self._get_raw_stream_data(mirror_link, True, {'Range': 'bytes=0-0'})
+                _, total = self._parse_content_range(response)
+                response.close()
+                if total != self.file_size:
+                    raise Exception(f'size mismatch ({total} != {self.file_size}) or no range support')
+                mirrors.append(mirror_link)
+            except Exception as e:
+                self.logger.warning(f'Ignoring mirror [{mirror_link}] due to: {e}')
+
+        if len(mirrors) > 1:
+            self.logger.debug(f'Downloading {self.out_file} using {len(mirrors)} mirrors')
+            self.mirrors = MirrorSelector(mirrors)
+
+    def _is_faststart(self, data):
+        '''
+        Check if the index (moov box) of the mp4 is before its media data (mdat box), using the top-level boxes in the first chunk
+        '''
+        offset = 0
+        while offset + 8 <= len(data):
+            size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat':
+                return False
+            if size == 1 and offset + 16 <= len(data):
+                # 64-bit box size
+                size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            if size < 8:
+                return False
+            offset += size
+
+        return False
+
+    def _read_first_chunk(self, response):
+        # returns the data of the probe response. Incomplete data is fetched again by the download
+        try:
+            return b''.join(self._iter_response(response))
+        except Exception as e:
+            self.logger.debug(f'Failed to read first chunk from probe response: {e}')
+            return b''
+
+    def _stream_chunks_to_mp4(self, dl_link, first_response, first_chunk):
+        '''
+        Download the chunks in parallel and feed them to ffmpeg in order, which muxes the subtitles while writing the output.
+        So, the output is written once and no other copy of the episode is kept on disk. Used only if the index of the mp4 is at
+        its start (faststart), as ffmpeg can't seek back in a pipe. Unlike chunk downloads, an interrupted stream starts over.
+        '''
+        ep_no = self._get_display_prefix()
+        out_file = os.path.join(f'{self.out_dir}', f'{self.out_file}')
+        chunks = range(0, self.file_size, self.chunk_size)
+        chunk_urls = [[dl_link, self._create_chunk_header(chunk), f'{self.out_file}.chunk{chunk_no}', chunk_no, chunk] for chunk_no, chunk in enumerate(chunks)]
+        validator = self._get_validator(first_response)
+        if self.segment_cache and validator: self.chunk_cache_id = f'{validator}|{self.file_size}'
+        if len(first_chunk) == self._get_chunk_length(0):
+            chunk_urls = chunk_urls[1:]
+        else:
+            first_chunk = b''
+
+        if self.mirror_links: self._init_mirrors(dl_link)
+
+        self.logger.debug('Downloading subtitles')
+        self._download_subtitles()
+        cmd = self._get_remux_cmd(['-f', 'mp4', '-i', 'pipe:0'], out_file, adts_audio=False)
+        self.logger.debug(f'[{ep_no}] Streaming {len(chunks)} chunks to ffmpeg: {cmd}')
+
+        def iter_data():
+            yield first_chunk
+            progress.update(len(first_chunk))
+            for status, data in self._ordered_download(self._fetch_chunk, chunk_urls, self._fetch_chunk_async):
+                if 'ERROR' in status:
+                    raise Exception(status)
+                yield data
+                progress.update(len(data))
+
+        with self._create_progress_bar(ep_no, total=self.file_size, unit='iB', unit_scale=True, unit_divisor=1024) as progress:
+            self._pipe_to_ffmpeg(cmd, out_file, iter_data())
+
+        self.logger.info(f'[{ep_no}] Chunks download status: Total: {len(chunks)} | Streamed to ffmpeg')
+        if self.segment_cache: self.logger.info(f'[{ep_no}] Segment cache stats: {self.segment_cache.get_stats()}')
+
+    def _download_chunks(self, dl_link, first_response, first_data=None):
+        '''
+        Download the file in chunks using range requests. The already open probe response (or its data, if already read) is used for the first chunk.
+        '''
+        chunks = range(0, self.file_size, self.chunk_size)
+        chunk_urls = [[dl_link, self._create_chunk_header(chunk), f'{self.out_file}.chunk{chunk_no}', chunk_no, chunk] for chunk_no, chunk in enumerate(chunks)]
+
+        # remove stale state of a single stream download, if any
+        if os.path.isfile(self.stream_state_file): os.remove(self.stream_state_file)
 
-        self.logger.debug('Fetching stream data')
-        dl_data = self._get_raw_stream_data(dl_link, True)
-        file_size = int(dl_data.headers.get('content-length', 0))
+        # load the journal of completed chunks. Source is identified by its validator & size
+        validator = self._get_validator(first_response)
+        source_id = f'{validator}|{self.file_size}|{self.chunk_size}|{self.mp4_write_mode}'
+        # content of the link can change, unless it has a validator. So, cache the chunks only if there is a validator
+        if self.segment_cache and validator: self.chunk_cache_id = f'{validator}|{self.file_size}'
+        self.journal = DownloadJournal(self.temp_dir, len(chunks), source_id, expected_sizes=lambda chunk_no: self._get_chunk_length(chunk_no * self.chunk_size))
+        if self.journal.invalidated:
+            self.logger.warning(f'Source of {self.out_file} has changed since the last attempt. Downloading from scratch')
+        # journal is reused only if the data it describes is still there (ex: temp dir is kept, but the partial file is removed)
+        if self.mp4_write_mode == 'preallocate':
+            if self.journal.completed_count() and not self._is_saved(self.part_file, self.file_size):
+                self.logger.warning(f'Partial file of {self.out_file} is missing or incomplete. Downloading from scratch')
+                self.journal.reset()
+        else:
+            missing = self.journal.verify(lambda chunk_no, size: self._is_saved(os.path.join(f'{self.temp_dir}', f'{self.out_file}.chunk{chunk_no}'), size))
+            if missing: self.logger.warning(f'{missing} downloaded chunks of {self.out_file} are missing. Downloading them again')
+
+        if self.mp4_write_mode == 'preallocate':
+            self.logger.debug(f'Preallocating {self.file_size} bytes for the output file')
+            self._preallocate_file(self.part_file, self.file_size)
+            self.out_fd = os.open(self.part_file, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+
+        try:
+            # the probe response already holds the first chunk. Save it instead of requesting it again
+            initial_size = 0
+            if self._get_reusable_chunk_size(chunk_urls[0]) is None:
+                try:
+                    initial_size = self._save_chunk([first_data] if first_data is not None else self._iter_response(first_response), chunk_urls[0])
+                    chunk_urls = chunk_urls[1:]
+                except Exception as e:
+                    self.logger.warning(f'Failed to save first chunk from probe response. Will retry. Error: {e}')
+            elif first_data is None:
+                first_response.close()
 
-        chunks = range(0, file_size, self.chunk_size)
-        chunk_urls = [[dl_link, self._create_chunk_header(chunk), f'{self.out_file}.chunk{chunk_no}'] for chunk_no, chunk in enumerate(chunks)] 
+            if self.mirror_links: self._init_mirrors(dl_link)
+
+            self.logger.debug('Downloading chunks')
+            metadata = {
+                'type': 'chunks',
+                'total': self.file_size,
+                'initial': initial_size,
+                'unit': 'iB',
+                'unit_scale': True,
+                'unit_divisor': 1024
+            }
+            self._multi_threaded_download(self._download_chunk, chunk_urls, self._download_chunk_async, **metadata)
+
+        finally:
+            self.journal.close()
+            if self.out_fd is not None:
+                os.close(self.out_fd)
+                self.out_fd = None
+
+        if self.mp4_write_mode == 'preallocate':
+            # chunks are already in place. No need to merge
+            os.replace(self.part_file, os.path.join(f'{self.out_dir}', f'{self.out_file}'))
+        else:
+            self.logger.debug('Merging chunks to single file')
+            self._merge_chunks(len(chunks))
+
+    def _download_single_stream(self, dl_link, response, resume_from=0, max_retries=3):
+        '''
+        Download the whole file over a single connection. Used when the server doesn't support range requests.
+        Interrupted downloads are resumed using If-Range, if the server allows it.
+        '''
+        ep_no = self._get_display_prefix()
+        validator = self._get_validator(response)
+        content_length = int(response.headers.get('content-length') or 0)
+        total_size = resume_from + content_length if content_length else None
+        self.logger.debug(f'[{ep_no}] Downloading as a single stream from byte {resume_from}. Total size: {total_size}')
 
-        self.logger.debug('Downloading chunks')
         metadata = {
-            'type': 'chunks',
-            'total': file_size,
+            'total': total_size,
+            'initial': resume_from,
             'unit': 'iB',
             'unit_scale': True,
             'unit_divisor': 1024
         }
-        self._multi_threaded_download(self._download_chunk, chunk_urls, **metadata)
+        with self._create_progress_bar(ep_no, **metadata) as progress:
+            attempt = 0
+            while True:
+                # save validator to resume the download in the next run
+                with open(self.stream_state_file, 'w') as f:
+                    f.write(validator or '')
+
+                try:
+                    with open(self.part_file, 'ab' if resume_from else 'wb') as f:
+                        for chunk in self._iter_response(response):
+                            resume_from += f.write(chunk)
+                            progress.update(len(chunk))
+                    break
+
+                except Exception as e:
+                    attempt += 1
+                    if attempt > max_retries:
+                        raise Exception(f'Single stream download failed after {max_retries} retries: {e}')
+                    self.logger.warning(f'[{ep_no}] Single stream download interrupted at byte {resume_from} due to: {e}. Retrying...')
+                    header = {'Range': f'bytes={resume_from}-', 'If-Range': validator} if validator and resume_from else None
+                    response = self._get_raw_stream_data(dl_link, True, header)
+                    if self._parse_content_range(response)[0] != resume_from:
+                        # server sent the complete file. Start over
+                        resume_from = 0
+                        progress.reset(total=total_size)
+                    validator = self._get_validator(response) or validator
+
+        if total_size and resume_from != total_size:
+            raise Exception(f'Incomplete download. Received {resume_from} / {total_size} bytes')
 
-        self.logger.debug('Merging chunks to single file')
-        self._merge_chunks(len(chunks))
+        os.replace(self.part_file, os.path.join(f'{self.out_dir}', f'{self.out_file}'))
+        os.remove(self.stream_state_file)
 
-        if self.subtitles:
+    def start_download(self, dl_link):
+        # create output directory
+        self._create_out_dirs()
+        self._prefetch_subtitles()
+        try:
+            status = self._start_download(dl_link)
+            # download is complete. Its data is moved (or removed) by the post-processing, and the journal can't be reused anymore
+            if self.journal: self.journal.remove()
+            return status
+        finally:
+            # release the subtitles from the scheduler, even if the download failed before waiting for them
+            self._close_subtitle_job()
+
+    def _start_download(self, dl_link):
+        # probe range support using the first chunk (or the remaining bytes of an interrupted single stream download)
+        resume_from, validator = self._load_stream_state()
+        if resume_from:
+            self.logger.debug(f'Found interrupted single stream download. Trying to resume from byte {resume_from}')
+            probe_header = {'Range': f'bytes={resume_from}-', 'If-Range': validator}
+        else:
+            probe_header = self._create_chunk_header(0)
+
+        muxed = False
+        self.logger.debug('Fetching stream data & probing range support')
+        response = self._get_raw_stream_data(dl_link, True, probe_header)
+        range_start, range_total = self._parse_content_range(response)
+        self.logger.debug(f'Probe status: {self._get_status_code(response)}, Accept-Ranges: {response.headers.get("accept-ranges")}, Content-Range: {response.headers.get("content-range")}')
+
+        if resume_from and range_start == resume_from:
+            self._download_single_stream(dl_link, response, resume_from)
+        elif range_start == 0 and range_total:
+            self.file_size = range_total
+            # with subtitles, check if the mp4 can be streamed to ffmpeg. Interrupted chunk downloads are resumed instead
+            single_pass = self.subtitles and self.mp4_single_pass_mux and not os.path.isfile(os.path.join(self.temp_dir, 'udb.journal'))
+            first_data = self._read_first_chunk(response) if single_pass else None
+            if first_data and self._is_faststart(first_data):
+                self._stream_chunks_to_mp4(dl_link, response, first_data)
+                muxed = True
+            else:
+                self._download_chunks(dl_link, response, first_data)
+        else:
+            # server ignored the range (or the size is unknown). Requesting in chunks would transfer the whole file for every chunk
+            self.logger.warning(f'Range requests are not supported for {self.out_file}. Falling back to single stream download')
+            if range_start is not None:
+                # partial response which can't be used from start. Request the complete file
+                response.close()
+                response = self._get_raw_stream_data(dl_link, True)
+            self._download_single_stream(dl_link, response)
+
+        if self.subtitles and not muxed:
             self.logger.debug('Downloading subtitles')
             self._download_subtitles()
-            self.logger.debug('Adding subtitles to the video')
-            self._add_subtitles()
+            self.post_process_steps.append(self._add_subtitles)
+
+        return (0, None)
+
+    def post_process(self):
+        '''
+        Run the post-processing steps (remux / add subtitles) of the downloaded episode. Runs on the post-processing workers.
+        '''
+        self.logger.debug(f'Post-processing {self.out_file} ({len(self.post_process_steps)} steps)')
+        for step in self.post_process_steps:
+            step()
 
         # remove temp dir once completed and dir is empty
         self.logger.debug('Removing temporary directories')
         self._remove_out_dirs()
 
-        return (0, None)
\ No newline at end of file
+        return (0, None)
@@ -0,0 +1,228 @@
+__author__ = 'Prudhvi PLN'
+
+import http.client
+import logging
+import select
+from collections import defaultdict, deque
+from ssl import _create_unverified_context
+from threading import Lock
+from time import monotonic
+from urllib.parse import urljoin, urlparse
+
+
+class PooledHTTPResponse(http.client.HTTPResponse):
+    '''
+    HTTPResponse which hands its connection back to the pool once the body is completely read
+    '''
+    def __init__(self, sock, *args, **kwargs):
+        super().__init__(sock, *args, **kwargs)
+        self.release_callback = None
+
+    def _close_conn(self):
+        # called by http.client when the body is completely read (or when the response is closed early)
+        super()._close_conn()
+        if self.release_callback:
+            callback, self.release_callback = self.release_callback, None
+            callback(self)
+
+    def close(self):
+        # fp is still open only if the body is not completely read. Unread data on the connection means it can't be re-used
+        if self.fp and self.release_callback:
+            callback, self.release_callback = self.release_callback, None
+            super().close()
+            callback(self, reusable=False)
+        else:
+            super().close()
+
+
+class _ResumableHTTPSConnection(http.client.HTTPSConnection):
+    '''
+    HTTPSConnection which resumes the last TLS session of the host to avoid a full handshake
+    '''
+    response_class = PooledHTTPResponse
+
+    def __init__(self, host, pool, **kwargs):
+        super().__init__(host, context=pool.ssl_context, **kwargs)
+        self.pool = pool
+
+    def connect(self):
+        # establish TCP connection (and tunnel if any) and then wrap it with TLS, re-using the saved session if available
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host if self._tunnel_host else self.host
+        session = self.pool._get_tls_session(self.host)
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname, session=session)
+        self.pool._record_handshake(self.host, self.sock.session_reused)
+
+
+class _PlainHTTPConnection(http.client.HTTPConnection):
+    response_class = PooledHTTPResponse
+
+    def __init__(self, host, pool, **kwargs):
+        super().__init__(host, **kwargs)
+        self.pool = pool
+
+    def connect(self):
+        super().connect()
+        self.pool._record_handshake(self.host, False)
+
+
+class ConnectionPool():
+    '''
+    Thread-safe per-host pool of keep-alive http.client connections with a shared SSL context.
+    - Idle connections are re-used (LIFO) and checked for staleness before re-use.
+    - TLS sessions are saved per host and resumed for new connections.
+    - Redirect targets are remembered, so that repeated requests for the same url skip the redirect hops.
+    '''
+    # exceptions raised when a kept-alive connection was closed by the server in between requests
+    STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+    def __init__(self, max_idle_per_host=32, idle_timeout=30, max_redirects=5):
+        self.logger = logging.getLogger()
+        self.ssl_context = _create_unverified_context()     # one context for all connections
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.max_redirects = max_redirects
+        self.idle_connections = defaultdict(deque)          # (scheme, host) -> deque of (connection, idle since)
+        self.tls_sessions = {}
+        self.redirects = {}
+        self.stats = {'handshakes': 0, 'tls_resumed': 0, 'reused': 0}
+        self.lock = Lock()
+
+    def _get_tls_session(self, host):
+        with self.lock:
+            return self.tls_sessions.get(host)
+
+    def _record_handshake(self, host, session_reused):
+        with self.lock:
+            self.stats['handshakes'] += 1
+            if session_reused: self.stats['tls_resumed'] += 1
+
+    def _is_stale(self, conn, idle_since):
+        if conn.sock is None or monotonic() - idle_since > self.idle_timeout:
+            return True
+        try:
+            # an idle keep-alive socket must not be readable. If it is, server has closed it (EOF) or sent junk
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+            return bool(readable)
+        except (OSError, ValueError):
+            return True
+
+    def _acquire(self, scheme, host, timeout):
+        key = (scheme, host)
+        with self.lock:
+            while self.idle_connections[key]:
+                conn, idle_since = self.idle_connections[key].pop()
+                if not self._is_stale(conn, idle_since):
+                    self.stats['reused'] += 1
+                    conn.timeout = timeout
+                    if conn.sock: conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+
+        conn_class = _ResumableHTTPSConnection if scheme == 'https' else _PlainHTTPConnection
+        return conn_class(host, self, timeout=timeout), False
+
+    def _release(self, conn, key, response, reusable=True):
+        if not reusable or response.will_close or conn.sock is None:
+            conn.close()
+            return
+
+        with self.lock:
+            # save the TLS session for resumption. TLS 1.3 tickets are available only after reading the response
+            session = getattr(conn.sock, 'session', None)
+            if session is not None: self.tls_sessions[conn.host] = session
+            if len(self.idle_connections[key]) < self.max_idle_per_host:
+                self.idle_connections[key].append((conn, monotonic()))
+                return
+        conn.close()
+
+    def _request(self, url, headers, timeout):
+        parsed_url = urlparse(url)
+        scheme = parsed_url.scheme or 'https'
+        path = parsed_url.path or '/'
+        if parsed_url.query:
+            path += '?' + parsed_url.query
+
+        conn, reused = self._acquire(scheme, parsed_url.netloc, timeout)
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        except self.STALE_CONNECTION_ERRORS:
+            conn.close()
+            if not reused: raise
+            # kept-alive connection was closed by the server. Retry once on a fresh connection
+            self.logger.debug(f'Stale connection to {parsed_url.netloc}. Retrying with a new connection')
+            conn, _ = self._acquire(scheme, parsed_url.netloc, timeout)
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+
+        response.release_callback = lambda resp, reusable=True: self._release(conn, (scheme, parsed_url.netloc), resp, reusable)
+        return response
+
+    def get(self, url, headers=None, timeout=30):
+        '''
+        Send a GET request and return the response (status 200/206). Follows redirects.
+        The connection goes back to the pool once the response body is completely read.
+        '''
+        headers = headers or {}
+        with self.lock:
+            target_url = self.redirects.get(url, url)
+
+        for _ in range(self.max_redirects):
+            try:
+                response = self._request(target_url, headers, timeout)
+            except Exception:
+                # do not stick to a remembered redirect target which is failing
+                if target_url != url:
+                    with self.lock: self.redirects.pop(url, None)
+                raise
+
+            if response.status in [200, 206]:  # Success - 206 means partial data (i.e., for chunked downloads)
+                if target_url != url:
+                    with self.lock: self.redirects[url] = target_url
+                return response
+
+            # drain the (usually tiny) body, so that the connection can be re-used
+            response.read()
+            if response.status in [301, 302, 303, 307, 308]:
+                # Handle redirect
+                location = response.getheader('Location')
+                if not location:
+                    raise Exception(f'Redirect ({response.status}) with no Location header')
+                target_url = urljoin(target_url, location)
+                continue
+
+            if target_url != url and url in self.redirects:
+                # remembered redirect target might have expired. Retry from the original url
+                self.logger.debug(f'Remembered redirect for {url} failed with {response.status}. Retrying with original url')
+                with self.lock: self.redirects.pop(url, None)
+                target_url = url
+                continue
+
+            raise Exception(f'Failed with response code: {response.status}')
+
+        raise Exception(f'Too many redirects while fetching {url}')
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle_connections.values():
+                for conn, _ in connections:
+                    conn.close()
+            self.idle_connections.clear()
+
+
+_connection_pool = None
+_connection_pool_lock = Lock()
+
+def get_connection_pool():
+    '''
+    Returns the process-wide connection pool shared by all downloads
+    '''
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            _connection_pool = ConnectionPool()
+        return _connection_pool
@@ -0,0 +1,151 @@
+__author__ = 'Prudhvi PLN'
+
+import json
+import logging
+import os
+from base64 import b64decode, b64encode
+from threading import Lock
+
+
+class DownloadJournal():
+    '''
+    Per-episode journal of completed chunks / segments, kept in the temp directory and used to resume downloads.
+    - snapshot file: source id, items count, bitmap of completed items and their sizes. Replaced atomically.
+    - log file: every completed item is appended as a single "<item_no> <size>" line. Replayed on load and merged into the snapshot periodically.
+
+    An item is marked as completed only after its data is completely written. So, a half-written chunk / segment (crash) is never reused.
+    If the source id (ETag / Last-Modified / playlist fingerprint) or the items count changes, the journal is invalidated.
+    '''
+    def __init__(self, journal_dir, items_count, source_id, expected_sizes=None, compact_every=256):
+        self.logger = logging.getLogger()
+        self.snapshot_file = os.path.join(journal_dir, 'udb.journal')
+        self.log_file = os.path.join(journal_dir, 'udb.journal.log')
+        self.items_count = items_count
+        self.source_id = source_id
+        self.expected_sizes = expected_sizes        # function returning expected size of an item, if known
+        self.compact_every = compact_every
+        self.bitmap = bytearray((items_count + 7) // 8)
+        self.sizes = {}
+        self.pending_log_entries = 0
+        self.invalidated = False
+        self.lock = Lock()
+        self._load()
+        self.log_fd = os.open(self.log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0))
+
+    def _set_completed(self, item_no, size):
+        if not 0 <= item_no < self.items_count:
+            return
+        if self.expected_sizes and self.expected_sizes(item_no) != size:
+            return      # incomplete item
+        self.bitmap[item_no >> 3] |= 1 << (item_no & 7)
+        self.sizes[item_no] = size
+
+    def _load(self):
+        snapshot = {}
+        if os.path.isfile(self.snapshot_file):
+            try:
+                with open(self.snapshot_file, 'r') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f'Ignoring corrupted download journal [{self.snapshot_file}]: {e}')
+
+        has_history = bool(snapshot) or os.path.isfile(self.log_file)
+        if snapshot.get('source_id') != self.source_id or snapshot.get('items_count') != self.items_count:
+            # source has changed (or no journal yet). Nothing can be reused
+            if has_history:
+                self.logger.debug(f'Download journal is stale (source: {snapshot.get("source_id")} -> {self.source_id}). Invalidating it')
+                self.invalidated = True
+            if os.path.isfile(self.log_file): os.remove(self.log_file)
+            self._write_snapshot()
+            return
+
+        bitmap = b64decode(snapshot.get('bitmap', ''))
+        sizes = snapshot.get('sizes', [])
+        for item_no in range(min(self.items_count, len(bitmap) * 8)):
+            if bitmap[item_no >> 3] & (1 << (item_no & 7)):
+                self._set_completed(item_no, sizes[item_no] if item_no < len(sizes) else 0)
+
+        if os.path.isfile(self.log_file):
+            with open(self.log_file, 'r') as f:
+                for line in f:
+                    try:
+                        item_no, size = map(int, line.split())
+                    except ValueError:
+                        continue        # torn line written during a crash
+                    self._set_completed(item_no, size)
+
+        self.logger.debug(f'Download journal loaded. Completed: {self.completed_count()} / {self.items_count}')
+
+    def _write_snapshot(self):
+        snapshot = {
+            'source_id': self.source_id,
+            'items_count': self.items_count,
+            'bitmap': b64encode(bytes(self.bitmap)).decode('ascii'),
+            'sizes': [ self.sizes.get(i, 0) for i in range(self.items_count) ] if self.sizes else []
+        }
+        temp_file = f'{self.snapshot_file}.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(temp_file, self.snapshot_file)
+
+    def _compact(self):
+        # merge the log into the snapshot and start a new log
+        self._write_snapshot()
+        os.ftruncate(self.log_fd, 0)
+        self.pending_log_entries = 0
+
+    def is_completed(self, item_no):
+        return bool(self.bitmap[item_no >> 3] & (1 << (item_no & 7)))
+
+    def get_size(self, item_no):
+        return self.sizes.get(item_no)
+
+    def completed_count(self):
+        return len(self.sizes)
+
+    def mark_completed(self, item_no, size):
+        with self.lock:
+            self._set_completed(item_no, size)
+            os.write(self.log_fd, f'{item_no} {size}\n'.encode('ascii'))
+            self.pending_log_entries += 1
+            if self.pending_log_entries >= self.compact_every:
+                self._compact()
+
+    def reset(self):
+        '''
+        Forget all the completed items. Used when the downloaded data can't be reused anymore
+        '''
+        with self.lock:
+            self.bitmap = bytearray(len(self.bitmap))
+            self.sizes = {}
+            self._compact()
+
+    def verify(self, is_valid):
+        '''
+        Forget the completed items whose data is missing or incomplete, i.e. is_valid(item_no, size) is False.
+        Returns the count of forgotten items
+        '''
+        with self.lock:
+            invalid_items = [ item_no for item_no, size in self.sizes.items() if not is_valid(item_no, size) ]
+            for item_no in invalid_items:
+                self.bitmap[item_no >> 3] &= ~(1 << (item_no & 7)) & 0xff
+                del self.sizes[item_no]
+            if invalid_items: self._compact()
+
+        return len(invalid_items)
+
+    def remove(self):
+        '''
+        Close and delete the journal. Used once the downloaded data is moved to the output file
+        '''
+        self.close()
+        for journal_file in (self.snapshot_file, self.log_file):
+            if os.path.isfile(journal_file): os.remove(journal_file)
+
+    def close(self):
+        with self.lock:
+            if self.log_fd is None:
+                return
+            self._compact()
+            os.close(self.log_fd)
+            self.log_fd = None
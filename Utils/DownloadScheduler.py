@@ -0,0 +1,131 @@
+__author__ = 'Prudhvi PLN'
+
+import logging
+import os
+from collections import Counter, deque
+from concurrent.futures import Future
+from itertools import count
+from threading import Condition, Lock, Thread
+
+
+class DownloadJob():
+    '''
+    Work items (segments / chunks) of a single episode submitted to the download scheduler
+    '''
+    _sequence = count()
+
+    def __init__(self, name, max_in_flight=None):
+        self.name = name
+        self.max_in_flight = max_in_flight      # optional per-episode cap
+        self.order = next(self._sequence)
+        self.pending = deque()                  # (function, item, host, future)
+        self.in_flight = 0
+
+    def remaining(self):
+        return len(self.pending) + self.in_flight
+
+
+class DownloadScheduler():
+    '''
+    One pool of download workers shared by all active episodes.
+    - Total in-flight requests are limited by the number of workers, and requests to a single host by max_per_host.
+    - Idle workers pick up work from any episode. The episode with the least remaining work is served first,
+      so that episodes which are almost done finish (and move to post-processing) early.
+    '''
+    def __init__(self, max_workers, max_per_host=None):
+        self.logger = logging.getLogger()
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.jobs = []
+        self.host_in_flight = Counter()
+        self.condition = Condition()
+        for i in range(max_workers):
+            Thread(target=self._worker, name=f'udb-dl-{i}', daemon=True).start()
+        self.logger.debug(f'Download scheduler started with {max_workers} workers & {max_per_host} requests per host')
+
+    def _pick_next(self):
+        # pick the first item of the episode with least remaining work, whose host has free capacity
+        selected_job = None
+        for job in self.jobs:
+            if not job.pending or (job.max_in_flight and job.in_flight >= job.max_in_flight):
+                continue
+            if self.max_per_host and self.host_in_flight[job.pending[0][2]] >= self.max_per_host:
+                continue
+            if selected_job is None or (job.remaining(), job.order) < (selected_job.remaining(), selected_job.order):
+                selected_job = job
+
+        if selected_job is None:
+            return None, None
+
+        return selected_job, selected_job.pending.popleft()
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                job, work_item = self._pick_next()
+                while job is None:
+                    self.condition.wait()
+                    job, work_item = self._pick_next()
+                func, item, host, future = work_item
+                job.in_flight += 1
+                self.host_in_flight[host] += 1
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(item))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self.condition:
+                    job.in_flight -= 1
+                    self.host_in_flight[host] -= 1
+                    self.condition.notify_all()
+
+    def create_job(self, name, max_in_flight=None):
+        job = DownloadJob(name, max_in_flight)
+        with self.condition:
+            self.jobs.append(job)
+        return job
+
+    def submit(self, job, func, items, get_host):
+        '''
+        Submit work items of an episode. Returns futures in the same order as items.
+        '''
+        futures = []
+        with self.condition:
+            for item in items:
+                future = Future()
+                job.pending.append((func, item, get_host(item), future))
+                futures.append(future)
+            self.condition.notify_all()
+
+        return futures
+
+    def close_job(self, job):
+        '''
+        Remove the episode from the scheduler. Pending work items (if any) are cancelled.
+        '''
+        with self.condition:
+            while job.pending:
+                job.pending.popleft()[3].cancel()
+            if job in self.jobs: self.jobs.remove(job)
+
+
+_scheduler = None
+_scheduler_lock = Lock()
+
+def get_download_scheduler(dl_config):
+    '''
+    Returns the process-wide download scheduler. Created from the downloader configuration on first use.
+    '''
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            max_workers = dl_config.get('max_concurrent_requests', 'auto')
+            if max_workers == 'auto':
+                # same upper bound as per-episode threadpools of old, but shared
+                max_workers = min(32, (os.cpu_count() or 1) + 4) * dl_config.get('max_parallel_downloads', 1)
+            max_per_host = dl_config.get('max_requests_per_host', 'auto')
+            _scheduler = DownloadScheduler(int(max_workers), None if max_per_host == 'auto' else int(max_per_host))
+        return _scheduler
@@ -0,0 +1,61 @@
+__author__ = 'Prudhvi PLN'
+
+import logging
+from threading import Lock
+
+from Cryptodome.Cipher import AES
+
+
+# keys shared by all downloads of the run. Fetched once per key uri
+_keys = {}
+_key_locks = {}
+_keys_lock = Lock()
+
+
+class HLSDecrypter():
+    '''
+    Decrypt AES-128 encrypted HLS segments in-process, so that ffmpeg receives plain segments.
+    - Keys are fetched on first use and cached for the run. Concurrent requests for the same key wait for a single fetch.
+    - IV is either explicit (IV attribute of #EXT-X-KEY) or derived from the media sequence number of the segment.
+    '''
+    def __init__(self, fetch_key):
+        self.logger = logging.getLogger()
+        self.fetch_key = fetch_key      # function returning the key bytes of a key uri
+
+    def get_key(self, key_uri):
+        with _keys_lock:
+            if key_uri in _keys:
+                return _keys[key_uri]
+            key_lock = _key_locks.setdefault(key_uri, Lock())
+
+        with key_lock:
+            if key_uri not in _keys:
+                self.logger.debug(f'Fetching decryption key: {key_uri}')
+                key = self.fetch_key(key_uri)
+                if len(key) != 16:
+                    raise Exception(f'Invalid AES-128 key of {len(key)} bytes from {key_uri}')
+                with _keys_lock:
+                    _keys[key_uri] = key
+
+        return _keys[key_uri]
+
+    @staticmethod
+    def get_iv(iv, media_sequence):
+        if iv:
+            # explicit IV: hexadecimal with 0x prefix
+            return bytes.fromhex(iv[2:] if iv.lower().startswith('0x') else iv).rjust(16, b'\0')
+        # IV is the media sequence number as a 16-byte big-endian integer
+        return media_sequence.to_bytes(16, 'big')
+
+    def decrypt(self, data, key_uri, iv=None, media_sequence=0):
+        if len(data) % 16:
+            raise Exception(f'Encrypted segment size ({len(data)}) is not a multiple of AES block size')
+        cipher = AES.new(self.get_key(key_uri), AES.MODE_CBC, self.get_iv(iv, media_sequence))
+        data = cipher.decrypt(data)
+
+        # remove PKCS#7 padding, if valid
+        pad = data[-1] if data else 0
+        if 0 < pad <= 16 and data.endswith(bytes([pad]) * pad):
+            data = data[:-pad]
+
+        return data
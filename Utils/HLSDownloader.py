@@ -1,10 +1,17 @@
 __author__ = 'Prudhvi PLN'
 
+import hashlib
+import json
 import os
-import re
+from functools import partial
+from time import monotonic, sleep
+from urllib.parse import urlparse
 
-from Utils.commons import retry
+from Utils.commons import async_retry, retry
 from Utils.BaseDownloader import BaseDownloader
+from Utils.DownloadJournal import DownloadJournal
+from Utils.HLSDecrypter import HLSDecrypter
+from Utils.M3U8Parser import M3U8Parser, coalesce_segments, generate_m3u8, parse_m3u8
 
 
 class HLSDownloader(BaseDownloader):
@@ -17,135 +24,587 @@ class HLSDownloader(BaseDownloader):
         super().__init__(dl_config, ep_details, session)
         # initialize HLS specific configuration
         self.m3u8_file = os.path.join(f'{self.temp_dir}', 'uwu.m3u8')
-        self.thread_name_prefix = 'udb-hls-'
+        self.playlist = None
+        self.segment_files = {}         # (uri, byterange) -> segment file. Duplicate segments share the file
+        self.map_files = {}
+        self.decrypter = HLSDecrypter(self._get_stream_data)
+        # output mode: 'segments' writes segments to temp dir & converts them at the end, 'stream' pipes them to ffmpeg as they arrive
+        self.output_mode = dl_config.get('hls_output_mode', 'segments')
+        # max segments downloaded ahead in stream / progressive modes (held in memory, to restore the playlist order)
+        self.reorder_window = self._get_reorder_window(dl_config.get('hls_reorder_window', 'auto'))
+        # live / EVENT playlists (without ENDLIST) are reloaded till they end, or don't change for the idle timeout
+        self.live_enabled = dl_config.get('hls_live', False)
+        self.live_state_file = os.path.join(f'{self.temp_dir}', 'live.json')
+        self.live_idle_timeout = dl_config.get('hls_live_idle_timeout', 'auto')
+        self.live_digest = None
+        self.live_next_sequence = 0
+
+    def _get_reorder_window(self, reorder_window):
+        if reorder_window != 'auto':
+            return int(reorder_window)
+        # twice the requests that can be in-flight, so that the workers are not idle while waiting for a slow segment
+        max_requests = self.concurrency or (self.async_engine.max_connections if self.async_engine else self.scheduler.max_workers)
+        return min(2 * max_requests, 128)
+
+    def _prepare_segments(self):
+        '''
+        Assign a file to every unique segment (by index, as segments can share the file name or differ only by query) & map.
+        Returns the unique segments in playlist order.
+        '''
+        unique_segments = []
+        for segment in self.playlist.segments:
+            key = (segment.uri, segment.byterange)
+            if key not in self.segment_files:
+                extension = os.path.splitext(urlparse(segment.uri).path)[1] or '.ts'
+                self.segment_files[key] = os.path.join(f'{self.temp_dir}', f'segment{segment.index}{extension}')
+                unique_segments.append(segment)
+
+        self.map_files = { init_map: os.path.join(f'{self.temp_dir}', f'init{i}.mp4') for i, init_map in enumerate(self.playlist.get_maps()) }
+
+        return unique_segments
+
+    def _get_segment_file(self, segment):
+        return self.segment_files[(segment.uri, segment.byterange)]
+
+    def _get_segments_name(self, segments):
+        return f'segment{segments[0].index}' if len(segments) == 1 else f'segment{segments[0].index}-{segments[-1].index}'
+
+    def _get_range_header(self, segments):
+        # byte-range segments of a group are fetched using a single range request
+        if segments[0].byterange is None:
+            return None
+        return {'Range': f'bytes={segments[0].byterange[0]}-{sum(segments[-1].byterange) - 1}'}
+
+    def _decrypt_segment(self, segment, data):
+        if segment.key is None:
+            return data
+        method, key_uri, iv = segment.key
+        if method != 'AES-128':
+            raise Exception(f'Unsupported HLS encryption method: {method}')
+
+        return self.decrypter.decrypt(data, key_uri, iv, segment.sequence)
+
+    def _split_segments(self, segments, data, status_code):
+        '''
+        Split the data of a (range) request into its segments. Data of every segment is added to the segment cache, if enabled.
+        '''
+        if segments[0].byterange is None:
+            segments_data = [ data ]
+        else:
+            # offsets are relative to the requested range, or absolute if the server ignored the range
+            start = segments[0].byterange[0] if status_code == 206 else 0
+            if len(data) < sum(segments[-1].byterange) - start:
+                raise Exception(f'Incomplete range. Received {len(data)} bytes')
+            segments_data = [ data[segment.byterange[0] - start:sum(segment.byterange) - start] for segment in segments ]
+        if not all(segments_data):
+            raise Exception('Empty segment received')
+
+        if self.segment_cache:
+            for segment, segment_data in zip(segments, segments_data):
+                self.segment_cache.put(self._get_cache_key(segment), segment_data)
+
+        return segments_data
+
+    def _decrypt_segments(self, segments, data, status_code):
+        '''
+        Split the data of a (range) request into its segments & decrypt them.
+        '''
+        return [ self._decrypt_segment(segment, segment_data) for segment, segment_data in zip(segments, self._split_segments(segments, data, status_code)) ]
 
-    def _has_uri(self, m3u8_data):
-        method = re.search('URI=(.*)', m3u8_data)
-        if method is None: return False
-        if method.group(1) == "NONE": return False
+    def _get_cache_key(self, segment):
+        # encrypted data is cached. So, the key doesn't depend on the decryption key
+        return self.segment_cache.get_key(segment.uri, segment.byterange)
 
-        return True
+    def _save_segment(self, segment, data):
+        # write to a temp file and rename it, so that a half-written segment is never used
+        size = self._write_file(self._get_segment_file(segment), data)
+        self.journal.mark_completed(segment.index, size)
+
+    def _save_segments(self, segments, data, status_code):
+        # decrypt on the worker thread, overlapping with the network I/O of other workers
+        for segment, segment_data in zip(segments, self._decrypt_segments(segments, data, status_code)):
+            self._save_segment(segment, segment_data)
+
+    def _save_cached_segments(self, segments):
+        '''
+        Save the segments found in the segment cache. Returns the segments which are not cached.
+        '''
+        if not self.segment_cache:
+            return segments
+
+        missing_segments = []
+        for segment in segments:
+            data = self.segment_cache.get(self._get_cache_key(segment))
+            if data is None:
+                missing_segments.append(segment)
+            else:
+                self._save_segment(segment, self._decrypt_segment(segment, data))
+
+        return missing_segments
+
+    def _get_cached_segments(self, segments):
+        '''
+        Returns the decrypted data of the segments, if all of them are in the segment cache. Else None
+        '''
+        if not self.segment_cache:
+            return None
 
-    def _collect_uri_iv(self, m3u8_data):
-        # Case-1: typical HLS using URI & IV
-        uri_iv = re.search('#EXT-X-KEY:METHOD=AES-128,URI="(.*)",IV=(.*)', m3u8_data)
+        segments_data = []
+        for segment in segments:
+            data = self.segment_cache.get(self._get_cache_key(segment))
+            if data is None:
+                return None
+            segments_data.append(self._decrypt_segment(segment, data))
 
-        # Case-2: typical HLS using URI only
-        if uri_iv is None:
-            uri_data = re.search('URI="(.*)"', m3u8_data)
-            return uri_data.group(1), None
+        return segments_data
 
-        uri = uri_iv.group(1)
-        iv = uri_iv.group(2)
+    @retry()
+    def _download_map(self, init_map):
+        '''
+        download the init section (#EXT-X-MAP) of fMP4 segments
 
-        return uri, iv
+        Returns: (download_status, size)
+        '''
+        try:
+            uri, byterange = init_map
+            header = {'Range': f'bytes={byterange[0]}-{sum(byterange) - 1}'} if byterange else None
+            response = self._get_raw_stream_data(uri, True, header)
+            data = b''.join(self._iter_response(response))
+            if byterange and self._get_status_code(response) != 206:
+                data = data[byterange[0]:sum(byterange)]
+            size = self._write_file(self.map_files[init_map], data)
 
-    def _collect_ts_urls(self, m3u8_link, m3u8_data):
-        # Improved regex to handle all cases. (get all lines except those starting with #)
-        base_url = '/'.join(m3u8_link.split('/')[:-1])
-        normalize_url = lambda url, base_url: (url if url.startswith('http') else 'https:' + url if url.startswith('//') else base_url + '/' + url)
-        # Some m3u8 files have duplicate urls, so using set to remove duplicates
-        urls = list(set( normalize_url(url.group(0), base_url) for url in re.finditer("^(?!#).+$", m3u8_data, re.MULTILINE) ))
+            return (f'Map file [{uri}] downloaded', size)
 
-        return urls
+        except Exception as e:
+            return (f'ERROR: Map file download failed [{init_map[0]}] due to: {e}', 0)
 
     @retry()
-    def _download_segment(self, ts_url):
+    def _download_segment(self, segments):
+        '''
+        download a segment (or a group of byte-range segments of the same resource) to file. Reuse if already downloaded.
+
+        Returns: (download_status, progress_bar_increment)
+        '''
+        try:
+            segments_name = self._get_segments_name(segments)
+
+            # check if the segments are already downloaded
+            pending_segments = [ segment for segment in segments if not self.journal.is_completed(segment.index) ]
+            if not pending_segments:
+                return (f'Segment file [{segments_name}] already exists. Reusing.', len(segments))
+
+            # check if the segments are cached by an earlier run / episode
+            pending_segments = self._save_cached_segments(pending_segments)
+            if not pending_segments:
+                return (f'Segment file [{segments_name}] found in cache. Reusing.', len(segments))
+
+            response = self._get_raw_stream_data(pending_segments[0].uri, True, self._get_range_header(pending_segments))
+            data = b''.join(self._iter_response(response))
+            self._save_segments(pending_segments, data, self._get_status_code(response))
+
+            return (f'Segment file [{segments_name}] downloaded', len(segments))
+
+        except Exception as e:
+            return (f'\nERROR: Segment download failed [{segments_name}] due to: {e}', 0)
+
+    @async_retry()
+    async def _download_segment_async(self, segments):
         '''
-        download segment file from url. Reuse if already downloaded.
+        Async version of _download_segment, used by the asyncio download engine.
 
         Returns: (download_status, progress_bar_increment)
         '''
         try:
-            segment_file_nm = ts_url.split('/')[-1]
-            segment_file = os.path.join(f"{self.temp_dir}", f"{segment_file_nm}")
+            segments_name = self._get_segments_name(segments)
+
+            # check if the segments are already downloaded
+            pending_segments = [ segment for segment in segments if not self.journal.is_completed(segment.index) ]
+            if not pending_segments:
+                return (f'Segment file [{segments_name}] already exists. Reusing.', len(segments))
+
+            pending_segments = await self.async_engine.run_blocking(self._save_cached_segments, pending_segments)
+            if not pending_segments:
+                return (f'Segment file [{segments_name}] found in cache. Reusing.', len(segments))
+
+            headers = self._get_async_request_headers(pending_segments[0].uri, self._get_range_header(pending_segments))
+            async with self.async_engine.get(pending_segments[0].uri, headers, self.request_timeout) as response:
+                data = b''.join([ chunk async for chunk in self.async_engine.iter_response(response, self.read_block_size, self.rate_limiter) ])
+
+            await self.async_engine.run_blocking(self._save_segments, pending_segments, data, response.status)
+
+            return (f'Segment file [{segments_name}] downloaded', len(segments))
+
+        except Exception as e:
+            return (f'\nERROR: Segment download failed [{segments_name}] due to: {e}', 0)
+
+    @retry()
+    def _fetch_segment(self, segments):
+        '''
+        fetch a segment (or a group of byte-range segments) into memory. Used in stream & progressive modes.
+
+        Returns: (download_status, [data of every segment])
+        '''
+        try:
+            segments_name = self._get_segments_name(segments)
+            segments_data = self._get_cached_segments(segments)
+            if segments_data:
+                return (f'Segment [{segments_name}] found in cache', segments_data)
+
+            response = self._get_raw_stream_data(segments[0].uri, True, self._get_range_header(segments))
+            segments_data = self._decrypt_segments(segments, b''.join(self._iter_response(response)), self._get_status_code(response))
+            if not all(segments_data):
+                raise Exception('Empty segment')
+
+            return (f'Segment [{segments_name}] downloaded', segments_data)
 
-            # check if the segment is already downloaded
-            if os.path.isfile(segment_file) and os.path.getsize(segment_file) > 0:
-                return (f'Segment file [{segment_file_nm}] already exists. Reusing.', 1)
+        except Exception as e:
+            return (f'ERROR: Segment download failed [{segments_name}] due to: {e}', 0)
+
+    @async_retry()
+    async def _fetch_segment_async(self, segments):
+        '''
+        Async version of _fetch_segment, used by the asyncio download engine.
+        '''
+        try:
+            segments_name = self._get_segments_name(segments)
+            segments_data = await self.async_engine.run_blocking(self._get_cached_segments, segments)
+            if segments_data:
+                return (f'Segment [{segments_name}] found in cache', segments_data)
 
-            with open(segment_file, "wb") as ts_file:
-                ts_file.write(self._get_stream_data(ts_url))
+            headers = self._get_async_request_headers(segments[0].uri, self._get_range_header(segments))
+            async with self.async_engine.get(segments[0].uri, headers, self.request_timeout) as response:
+                data = b''.join([ chunk async for chunk in self.async_engine.iter_response(response, self.read_block_size, self.rate_limiter) ])
+            segments_data = await self.async_engine.run_blocking(self._decrypt_segments, segments, data, response.status)
+            if not all(segments_data):
+                raise Exception('Empty segment')
 
-            return (f'Segment file [{segment_file_nm}] downloaded', 1)
+            return (f'Segment [{segments_name}] downloaded', segments_data)
 
         except Exception as e:
-            return (f'\nERROR: Segment download failed [{segment_file_nm}] due to: {e}', 0)
+            return (f'ERROR: Segment download failed [{segments_name}] due to: {e}', 0)
 
-    def _rewrite_m3u8_file(self, m3u8_data):
-        # regex safe temp dir path
-        seg_temp_dir = self.temp_dir.replace('\\', '\\\\')
-        # ffmpeg doesn't accept backward slash in key file irrespective of platform
-        key_temp_dir = self.temp_dir.replace('\\', '/')
+    def _write_m3u8_file(self):
+        # playlist of the downloaded segments. ffmpeg doesn't accept backward slash in map file irrespective of platform
+        m3u8_content = generate_m3u8(self.playlist, self._get_segment_file, lambda init_map: self.map_files[init_map].replace('\\', '/'))
         with open(self.m3u8_file, 'w', encoding='utf-8') as m3u8_f:
-            m3u8_content = re.sub('URI=(.*)/', f'URI="{key_temp_dir}/', m3u8_data, count=1)
-            regex_safe = '\\\\' if os.sep == '\\' else '/'
-            # strip off url for segments
-            m3u8_content = re.sub(r'(.*)//(.*)/', '', m3u8_content)
-            # prefix the downloaded path for segments
-            m3u8_content = re.sub(r'^(?!#).+$', rf'{seg_temp_dir}{regex_safe}\g<0>', m3u8_content, flags=re.MULTILINE)
             m3u8_f.write(m3u8_content)
 
     def _convert_to_mp4(self):
-        # print(f'Converting {self.out_file} to mp4')
         out_file = os.path.join(f'{self.out_dir}', f'{self.out_file}')
-        command = [f'ffmpeg -extension_picky 0 -loglevel warning -allowed_extensions ALL -i "{self.m3u8_file}"']
-        maps = ['-map 0:v -map 0:a'] if self.subtitles else []
-        metadata = []
+        input_args = ['-extension_picky', '0', '-allowed_extensions', 'ALL', '-i', self.m3u8_file]
+        self._run_ffmpeg(self._get_remux_cmd(input_args, out_file), out_file, self.playlist.duration)
 
-        # Prepare the command if subtitles are present
-        for i, (lang, url) in enumerate(self.subtitles.items(), start=1):
-            command.append(f'-i "{url}"')
-            maps.append(f'-map {i}')
-            metadata.append(f'-metadata:s:s:{i-1} title="{lang}"')
+    def _stream_to_mp4(self, segment_groups, segments_count):
+        '''
+        Download the segments in parallel and feed them to ffmpeg in playlist order, as they complete.
+        The mp4 is remuxed while downloading, without keeping the segments on disk.
+        '''
+        ep_no = self._get_display_prefix()
+        out_file = os.path.join(f'{self.out_dir}', f'{self.out_file}')
+        cmd = self._get_remux_cmd(['-f', 'mpegts', '-i', 'pipe:0'], out_file)
+        self.logger.debug(f'[{ep_no}] Streaming {segments_count} segments to ffmpeg with a reorder window of {self.reorder_window}: {cmd}')
 
-        metadata.append(f'-c:v copy -c:a copy -c:s mov_text -bsf:a aac_adtstoasc "{out_file}"')
+        def iter_data():
+            for segments, segments_data in self._iter_ordered_segments(segment_groups):
+                yield from segments_data
+                progress.update(len(segments))
 
-        cmd = ' '.join(command + maps + metadata)
-        self._exec_cmd(cmd)
+        with self._create_progress_bar(ep_no, total=segments_count, unit='seg') as progress:
+            self._pipe_to_ffmpeg(cmd, out_file, iter_data())
 
-    def start_download(self, m3u8_link):
-        # create output directory
-        self._create_out_dirs()
+        self.logger.info(f'[{ep_no}] Segments download status: Total: {segments_count} | Streamed to ffmpeg')
 
-        iv = None
-        self.logger.debug('Fetching stream data')
-        m3u8_data = self._get_stream_data(m3u8_link, True)
+    def _iter_ordered_segments(self, segment_groups):
+        '''
+        Download the segment groups in parallel (within the reorder window) & yield (segments, [data of every segment]) in playlist order
+        '''
+        for segments, (status, segments_data) in zip(segment_groups, self._ordered_download(self._fetch_segment, segment_groups, self._fetch_segment_async, self.reorder_window)):
+            if 'ERROR' in status:
+                raise Exception(status)
+            yield segments, segments_data
+
+    def _get_partial_file(self, init_map):
+        return os.path.join(f'{self.out_dir}', f'{os.path.splitext(self.out_file)[0]}.partial{".mp4" if init_map else ".ts"}')
+
+    def _get_map_data(self, init_map):
+        status = self._download_map(init_map)
+        if status[1] == 0: raise Exception(f'Failed to download map file with error: {status[0]}')
+        with open(self.map_files[init_map], 'rb') as f:
+            return f.read()
 
-        self.logger.debug('Check if stream is encrypted/mapped')
-        if self._has_uri(m3u8_data):
-            self.logger.debug('Stream is encrypted/mapped. Collect iv data and download key')
-            key_uri, iv = self._collect_uri_iv(m3u8_data)
-            status = self._download_segment(key_uri)
-            if status[1] == 0: self.logger.error(f'Failed to download key/map file with error: {status[0]}')
+    def _convert_partial_file(self, partial_file, init_map):
+        out_file = os.path.join(f'{self.out_dir}', f'{self.out_file}')
+        input_args = ['-i', partial_file] if init_map else ['-f', 'mpegts', '-i', partial_file]
+        self._run_ffmpeg(self._get_remux_cmd(input_args, out_file, adts_audio=init_map is None), out_file, self.playlist.duration)
+        os.remove(partial_file)
 
-        # did not run into HLS with IV during development, so skipping it
-        if iv:
-            raise Exception("Current code cannot decode IV links")
+    def _progressive_download(self, segments):
+        '''
+        Download the segments in playlist order (within a sliding window) & append the contiguous downloaded part to a partial file,
+        which can be played while downloading (mpeg-ts, or fragmented mp4 for mapped segments). It is remuxed to mp4 at the end.
+        Appended segments are recorded in the journal. So, an interrupted download resumes from the end of the partial file.
+        '''
+        ep_no = self._get_display_prefix()
+        init_map = next(iter(self.map_files), None)
+        partial_file = self._get_partial_file(init_map)
+
+        # load the journal of appended segments. Source is identified by the segments in the playlist
+        source_id = hashlib.sha1('\n'.join( f'{segment.uri.split("?")[0]}|{segment.byterange}' for segment in segments ).encode('utf-8')).hexdigest()
+        self.journal = DownloadJournal(self.temp_dir, len(self.playlist.segments), f'{source_id}|progressive')
+
+        # fragmented mp4 starts with the init section
+        init_data = self._get_map_data(init_map) if init_map else b''
+
+        # reuse the appended segments, if the partial file has all of them. Else, start from scratch
+        appended, expected_size = 0, len(init_data)
+        while appended < len(segments) and self.journal.is_completed(segments[appended].index):
+            expected_size += self.journal.get_size(segments[appended].index)
+            appended += 1
+        if appended and (not os.path.isfile(partial_file) or os.path.getsize(partial_file) < expected_size):
+            self.logger.warning(f'Partial file of {self.out_file} is missing or incomplete. Downloading from scratch')
+            self.journal.reset()
+            appended, expected_size = 0, len(init_data)
+
+        remaining_groups = coalesce_segments(segments[appended:])
+        self.logger.info(f'[{ep_no}] Playable while downloading: {partial_file}')
+        self.logger.debug(f'[{ep_no}] Downloading {len(segments) - appended} segments progressively with a window of {self.reorder_window}')
 
-        self.logger.debug('Collect m3u8 segment urls')
-        ts_urls = self._collect_ts_urls(m3u8_link, m3u8_data)
+        try:
+            with open(partial_file, 'ab') as f, self._create_progress_bar(ep_no, total=len(segments), initial=appended, unit='seg') as progress:
+                if appended == 0:
+                    # fresh start. Partial file starts with the init section (if any)
+                    f.truncate(0)
+                    f.write(init_data)
+                else:
+                    # drop the data appended after the last journal entry (interrupted write)
+                    f.truncate(expected_size)
+
+                for group, segments_data in self._iter_ordered_segments(remaining_groups):
+                    for data in segments_data:
+                        f.write(data)
+                    # make the data available to players before marking it as appended
+                    f.flush()
+                    for segment, data in zip(group, segments_data):
+                        self.journal.mark_completed(segment.index, len(data))
+                    progress.update(len(group))
+        finally:
+            self.journal.close()
+
+        self.logger.info(f'[{ep_no}] Segments download status: Total: {len(segments)} | Reused: {appended}')
+        self.post_process_steps.append(partial(self._convert_partial_file, partial_file, init_map))
+
+    def _refresh_live_playlist(self, m3u8_link):
+        '''
+        Reload the live playlist & add the segments with new media sequences to the playlist.
+        Known segments are skipped by the parser, and an unchanged playlist is not parsed at all.
+
+        Returns: (playlist_changed, new_segments)
+        '''
+        m3u8_data = self._get_stream_data(m3u8_link, True)
+        digest = hashlib.sha1(m3u8_data.encode('utf-8')).digest()
+        if digest == self.live_digest:
+            return (False, [])
+        self.live_digest = digest
+
+        playlist = M3U8Parser(m3u8_link, self.live_next_sequence).parse(m3u8_data.splitlines())
+        if playlist.media_sequence > self.live_next_sequence:
+            self.logger.warning(f'{playlist.media_sequence - self.live_next_sequence} segments expired from the live playlist before they were downloaded')
+
+        # number the new segments after the known ones
+        for segment in playlist.segments:
+            segment.index = len(self.playlist.segments)
+            self.playlist.segments.append(segment)
+        if playlist.segments:
+            self.live_next_sequence = playlist.segments[-1].sequence + 1
+        self.playlist.endlist = playlist.endlist
+        self.playlist.target_duration = playlist.target_duration or self.playlist.target_duration
+
+        return (True, playlist.segments)
+
+    def _is_live(self, m3u8_link):
+        '''
+        Check if the playlist (without ENDLIST) is live. Many VOD hosts omit ENDLIST & PLAYLIST-TYPE. So, it is live only on evidence:
+        an EVENT playlist, or a playlist whose segments / media sequence change when it is reloaded after a target duration.
+        '''
+        if not self.playlist.is_live:
+            return False
+        if self.playlist.playlist_type == 'EVENT':
+            return True
+
+        # servers update a live playlist once every target duration. So, wait a little longer before reloading
+        sleep(1.5 * (self.playlist.target_duration or 6))
+        playlist = parse_m3u8(self._get_stream_data(m3u8_link, True), m3u8_link)
+        changed = playlist.media_sequence != self.playlist.media_sequence or len(playlist.segments) != len(self.playlist.segments)
+        self.logger.debug(f'Playlist without ENDLIST {"changed" if changed else "did not change"} on reload. Treating it as {"live" if changed else "VOD"}')
+        return changed
+
+    def _load_live_state(self, source_id):
+        # state of the appended segments of an earlier attempt: {'source_id': ..., 'next_sequence': ..., 'size': ...}
+        try:
+            with open(self.live_state_file, 'r') as f:
+                state = json.load(f)
+            return state if state.get('source_id') == source_id else None
+        except (OSError, ValueError):
+            return None
+
+    def _save_live_state(self, state):
+        temp_file = f'{self.live_state_file}.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_file, self.live_state_file)
+
+    def _live_download(self, m3u8_link):
+        '''
+        Download a live / EVENT playlist. It is reloaded every target duration & the new segments are appended in order to a partial file
+        (playable while downloading), till ENDLIST is added or the playlist doesn't change for the idle timeout. It is remuxed to mp4 at the end.
+        The last appended media sequence is saved in the temp dir. So, an interrupted download resumes with the segments still in the playlist.
+        '''
+        ep_no = self._get_display_prefix()
+        maps = self.playlist.get_maps()
+        if len(maps) > 1:
+            raise Exception('Live playlists with multiple init sections are not supported')
+        init_map = maps[0] if maps else None
+        partial_file = self._get_partial_file(init_map)
+        target_duration = self.playlist.target_duration or 6
+        idle_timeout = 3 * target_duration if self.live_idle_timeout == 'auto' else self.live_idle_timeout
+
+        segments = self.playlist.segments
+        self.live_next_sequence = segments[-1].sequence + 1 if segments else self.playlist.media_sequence
+        self.logger.info(f'[{ep_no}] Live playlist. Downloading till it ends. Playable while downloading: {partial_file}')
+
+        # resume after the segments appended in an earlier attempt, if the partial file has all of them
+        source_id = urlparse(m3u8_link)._replace(query='').geturl()
+        state = self._load_live_state(source_id)
+        if state and not (os.path.isfile(partial_file) and os.path.getsize(partial_file) >= state['size']):
+            self.logger.warning(f'Partial file of {self.out_file} is missing or incomplete. Downloading from the live playlist again')
+            state = None
+        if state:
+            if segments and segments[0].sequence > state['next_sequence']:
+                self.logger.warning(f'{segments[0].sequence - state["next_sequence"]} segments expired from the live playlist since the last attempt')
+            segments = [ segment for segment in segments if segment.sequence >= state['next_sequence'] ]
+            self.live_next_sequence = max(self.live_next_sequence, state['next_sequence'])
+        else:
+            state = {'source_id': source_id, 'next_sequence': 0, 'size': 0}
+
+        last_change, reload_interval = monotonic(), target_duration
+        with open(partial_file, 'ab') as f, self._create_progress_bar(ep_no, total=len(segments), unit='seg') as progress:
+            if state['size']:
+                # drop the data appended after the last saved state (interrupted write)
+                f.truncate(state['size'])
+            else:
+                f.truncate(0)
+                if init_map: f.write(self._get_map_data(init_map))
+
+            while True:
+                reload_at = monotonic() + reload_interval
+                for group, segments_data in self._iter_ordered_segments(coalesce_segments(segments)):
+                    for data in segments_data:
+                        f.write(data)
+                    f.flush()
+                    self._save_live_state({**state, 'next_sequence': group[-1].sequence + 1, 'size': f.tell()})
+                    progress.update(len(group))
+
+                if self.playlist.endlist:
+                    break
+
+                sleep(max(0, reload_at - monotonic()))
+                changed, segments = self._refresh_live_playlist(m3u8_link)
+                if any( segment.map != init_map for segment in segments ):
+                    raise Exception('Init section of the live playlist has changed')
+
+                if changed:
+                    last_change, reload_interval = monotonic(), target_duration
+                    progress.total += len(segments)
+                    progress.refresh()
+                elif monotonic() - last_change > idle_timeout:
+                    self.logger.warning(f'[{ep_no}] Live playlist did not change for {idle_timeout}s. Stopping the download')
+                    break
+                else:
+                    # reload sooner, if the playlist didn't change (RFC 8216, section 6.3.4)
+                    reload_interval = target_duration / 2
+
+        self.logger.info(f'[{ep_no}] Segments download status: Total: {len(self.playlist.segments)} | Live')
+        self.post_process_steps.append(partial(self._convert_partial_file, partial_file, init_map))
+
+    def _download_segments(self, segments, segment_groups):
+        '''
+        Download the segments to temp dir and convert them to mp4 once all are downloaded
+        '''
+        for init_map in self.map_files:
+            self.logger.debug('Stream is mapped. Downloading the map file')
+            status = self._download_map(init_map)
+            if status[1] == 0: raise Exception(f'Failed to download map file with error: {status[0]}')
+
+        # load the journal of completed segments. Source is identified by the segments in the playlist
+        source_id = hashlib.sha1('\n'.join( f'{segment.uri.split("?")[0]}|{segment.byterange}' for segment in segments ).encode('utf-8')).hexdigest()
+        if any( segment.key for segment in segments ): source_id += '|decrypted'
+        self.journal = DownloadJournal(self.temp_dir, len(self.playlist.segments), source_id)
+        if self.journal.invalidated:
+            self.logger.warning(f'Source of {self.out_file} has changed since the last attempt. Downloading from scratch')
+        # segments are reused only if their files are still there
+        missing = self.journal.verify(lambda index, size: self._is_saved(self._get_segment_file(self.playlist.segments[index]), size))
+        if missing: self.logger.warning(f'{missing} downloaded segments of {self.out_file} are missing. Downloading them again')
 
         self.logger.debug('Downloading collected segments')
         metadata = {
             'type': 'segments',
-            'total': len(ts_urls),
+            'total': len(segments),
             'unit': 'seg'
         }
-        self._multi_threaded_download(self._download_segment, ts_urls, **metadata)
+        try:
+            self._multi_threaded_download(self._download_segment, segment_groups, self._download_segment_async, **metadata)
+        finally:
+            self.journal.close()
 
-        self.logger.debug('Rewrite m3u8 file with downloaded segments paths')
-        self._rewrite_m3u8_file(m3u8_data)
+        self.logger.debug('Write m3u8 file with downloaded segments paths')
+        self._write_m3u8_file()
 
         if self.subtitles:
             self.logger.debug('Downloading subtitles')
             self._download_subtitles()
 
-        self.logger.debug('Converting m3u8 segments to .mp4')
-        self._convert_to_mp4()
+        self.post_process_steps.append(self._convert_to_mp4)
+
+    def _start_download(self, m3u8_link):
+        self.logger.debug('Fetching stream data')
+        m3u8_data = self._get_stream_data(m3u8_link, True)
 
-        # remove temp dir once completed and dir is empty
-        self.logger.debug('Removing temporary directories')
-        self._remove_out_dirs()
+        self.logger.debug('Parse m3u8 segments')
+        self.playlist = parse_m3u8(m3u8_data, m3u8_link)
+        segments = self._prepare_segments()
+        # byte-range segments of the same resource are fetched together
+        segment_groups = coalesce_segments(segments)
+        self.logger.debug(f'Segments: {len(self.playlist.segments)}, Unique: {len(segments)}, Requests: {len(segment_groups)}, Maps: {len(self.map_files)}, '
+                          f'Encrypted: {sum( 1 for segment in segments if segment.key )}')
+
+        if self.live_enabled and self._is_live(m3u8_link):
+            if self.subtitles:
+                self.logger.debug('Downloading subtitles')
+                self._download_subtitles()
+
+            self.logger.debug('Downloading live playlist')
+            self._live_download(m3u8_link)
+
+        elif self.output_mode == 'stream' and not self.map_files:
+            if self.subtitles:
+                self.logger.debug('Downloading subtitles')
+                self._download_subtitles()
+
+            self.logger.debug('Streaming segments to ffmpeg')
+            self._stream_to_mp4(segment_groups, len(segments))
+
+        elif self.output_mode == 'progressive' and len(self.map_files) <= 1:
+            if self.subtitles:
+                self.logger.debug('Downloading subtitles')
+                self._download_subtitles()
+
+            self.logger.debug('Downloading segments progressively')
+            self._progressive_download(segments)
+
+        else:
+            # mapped (fMP4) segments need the init sections & the playlist
+            if self.output_mode != 'segments': self.logger.debug(f'Stream is mapped. Falling back to segments output mode from {self.output_mode}')
+            self._download_segments(segments, segment_groups)
 
         return (0, None)
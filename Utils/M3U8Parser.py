@@ -0,0 +1,226 @@
+__author__ = 'Prudhvi PLN'
+
+import re
+from urllib.parse import urljoin
+
+
+_ATTRIBUTES_REGEX = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(value):
+    '''
+    Parse attribute list of a tag. Ex: METHOD=AES-128,URI="key.bin" -> {'METHOD': 'AES-128', 'URI': 'key.bin'}
+    '''
+    return { k: v[1:-1] if v.startswith('"') else v for k, v in _ATTRIBUTES_REGEX.findall(value) }
+
+
+def parse_byterange(value, default_offset=0):
+    '''
+    Parse byte range "<length>[@<offset>]" to (offset, length)
+    '''
+    length, _, offset = value.partition('@')
+    return (int(offset) if offset else default_offset, int(length))
+
+
+class Segment():
+    '''
+    A media segment of the playlist with all the tags applicable to it
+    - byterange: (offset, length) within the resource, if any
+    - key: (method, key uri, iv) of the encryption, if any
+    - map: (init section uri, byterange) of the segment, if any
+    '''
+    __slots__ = ('index', 'uri', 'duration', 'title', 'byterange', 'key', 'map', 'discontinuity', 'sequence')
+
+    def __init__(self, index, uri, duration, title=None, byterange=None, key=None, map=None, discontinuity=False, sequence=0):
+        self.index = index
+        self.uri = uri
+        self.duration = duration
+        self.title = title
+        self.byterange = byterange
+        self.key = key
+        self.map = map
+        self.discontinuity = discontinuity
+        self.sequence = sequence
+
+    def __repr__(self):
+        return f'Segment({self.index}, {self.uri}, {self.duration}, byterange={self.byterange}, key={self.key}, map={self.map})'
+
+
+class M3U8Playlist():
+    '''
+    Parsed playlist. Media playlists have segments, master playlists have variants.
+    '''
+    def __init__(self):
+        self.segments = []
+        self.variants = []          # [{'uri': ..., 'BANDWIDTH': ..., 'RESOLUTION': ..., ...}]
+        self.version = None
+        self.target_duration = None
+        self.media_sequence = 0
+        self.playlist_type = None
+        self.endlist = False
+
+    @property
+    def is_master(self):
+        return bool(self.variants)
+
+    @property
+    def is_live(self):
+        # EVENT playlists grow till ENDLIST is added. Live playlists also remove the old segments
+        return not self.endlist and self.playlist_type != 'VOD' and not self.is_master
+
+    @property
+    def duration(self):
+        return sum( segment.duration for segment in self.segments )
+
+    def get_maps(self):
+        # unique init sections in the order of their use
+        return list(dict.fromkeys( segment.map for segment in self.segments if segment.map ))
+
+
+class M3U8Parser():
+    '''
+    Streaming (line by line) parser of HLS playlists. URIs are resolved against the playlist url.
+    Segment tags apply to the next segment, while KEY & MAP apply to all the following segments, till they are redefined.
+    Use feed() to parse lines as they are received, or parse() for the complete playlist.
+    Segments with a media sequence below min_sequence (already known, on refresh of a live playlist) are skipped without resolving them.
+    '''
+    def __init__(self, base_url, min_sequence=0):
+        self.base_url = base_url
+        self.min_sequence = min_sequence
+        self._base_dir = urljoin(base_url, '.')
+        self.playlist = M3U8Playlist()
+        # state applicable to the next segment
+        self._duration = None
+        self._title = None
+        self._byterange = None
+        self._discontinuity = False
+        self._variant = None
+        # state applicable to all the following segments
+        self._key = None
+        self._map = None
+        self._last_uri = None
+        self._last_range_end = 0
+        self._segments_count = 0        # including the skipped segments
+
+    def _resolve(self, uri):
+        # fast path for the common case: plain relative path (no scheme, no absolute path, no dot segments)
+        if ':' not in uri.partition('/')[0] and not uri.startswith(('/', '.', '?', '#')) and '/.' not in uri:
+            return self._base_dir + uri
+        return urljoin(self.base_url, uri)
+
+    def _add_segment(self, uri):
+        byterange = None
+        if self._byterange:
+            # without offset, range starts after the previous range of the same resource
+            byterange = parse_byterange(self._byterange, self._last_range_end if uri == self._last_uri else 0)
+            self._last_range_end = byterange[0] + byterange[1]
+        self._last_uri = uri
+
+        sequence = self.playlist.media_sequence + self._segments_count
+        self._segments_count += 1
+        if sequence >= self.min_sequence:
+            segments = self.playlist.segments
+            segments.append(Segment(len(segments), self._resolve(uri), self._duration or 0, self._title, byterange, self._key, self._map,
+                                    self._discontinuity, sequence))
+        self._duration, self._title, self._byterange, self._discontinuity = None, None, None, False
+
+    def feed(self, line):
+        line = line.strip()
+        if not line:
+            return
+
+        if not line.startswith('#'):
+            if self._variant is not None:
+                self._variant['uri'] = self._resolve(line)
+                self.playlist.variants.append(self._variant)
+                self._variant = None
+            else:
+                self._add_segment(line)
+            return
+
+        tag, _, value = line.partition(':')
+        # most frequent tags first
+        if tag == '#EXTINF':
+            duration, _, title = value.partition(',')
+            self._duration = float(duration)
+            self._title = title or None
+        elif tag == '#EXT-X-BYTERANGE':
+            self._byterange = value
+        elif tag == '#EXT-X-KEY':
+            attrs = parse_attributes(value)
+            method = attrs.get('METHOD', 'NONE')
+            self._key = None if method == 'NONE' else (method, self._resolve(attrs.get('URI', '')), attrs.get('IV'))
+        elif tag == '#EXT-X-MAP':
+            attrs = parse_attributes(value)
+            self._map = (self._resolve(attrs['URI']), parse_byterange(attrs['BYTERANGE']) if 'BYTERANGE' in attrs else None)
+        elif tag == '#EXT-X-DISCONTINUITY':
+            self._discontinuity = True
+        elif tag == '#EXT-X-STREAM-INF':
+            self._variant = parse_attributes(value)
+        elif tag == '#EXT-X-MEDIA-SEQUENCE':
+            self.playlist.media_sequence = int(value)
+        elif tag == '#EXT-X-TARGETDURATION':
+            self.playlist.target_duration = float(value)
+        elif tag == '#EXT-X-PLAYLIST-TYPE':
+            self.playlist.playlist_type = value
+        elif tag == '#EXT-X-VERSION':
+            self.playlist.version = int(value)
+        elif tag == '#EXT-X-ENDLIST':
+            self.playlist.endlist = True
+
+    def parse(self, lines):
+        for line in lines:
+            self.feed(line)
+        return self.playlist
+
+
+def parse_m3u8(data, base_url):
+    '''
+    Parse the playlist text received from base_url
+    '''
+    return M3U8Parser(base_url).parse(data.splitlines())
+
+
+def coalesce_segments(segments, max_size=4*1024*1024):
+    '''
+    Group consecutive byte-range segments of the same resource, so that a group can be fetched using a single range request of up to max_size bytes.
+    Returns list of segment groups. Segments without a byte range are in their own group.
+    '''
+    groups = []
+    for segment in segments:
+        if groups and segment.byterange:
+            first, last = groups[-1][0], groups[-1][-1]
+            if (last.byterange and last.uri == segment.uri and sum(last.byterange) == segment.byterange[0]
+                    and sum(segment.byterange) - first.byterange[0] <= max_size):
+                groups[-1].append(segment)
+                continue
+        groups.append([segment])
+
+    return groups
+
+
+def generate_m3u8(playlist, get_segment_path, get_map_path=None):
+    '''
+    Generate a (VOD) playlist of the given segments with their local paths. Keys & byte ranges are not included,
+    as the segments are expected to be decrypted & saved to their own files.
+    '''
+    max_duration = max( (segment.duration for segment in playlist.segments), default=0 )
+    lines = [
+        '#EXTM3U',
+        f'#EXT-X-VERSION:{7 if playlist.get_maps() else 3}',
+        f'#EXT-X-TARGETDURATION:{int(max(playlist.target_duration or 0, max_duration) + 0.999)}',
+        f'#EXT-X-MEDIA-SEQUENCE:{playlist.media_sequence}',
+        '#EXT-X-PLAYLIST-TYPE:VOD'
+    ]
+    current_map = None
+    for segment in playlist.segments:
+        if segment.discontinuity:
+            lines.append('#EXT-X-DISCONTINUITY')
+        if segment.map and segment.map != current_map:
+            current_map = segment.map
+            lines.append(f'#EXT-X-MAP:URI="{get_map_path(segment.map)}"')
+        lines.append(f'#EXTINF:{segment.duration},')
+        lines.append(get_segment_path(segment))
+    lines.append('#EXT-X-ENDLIST')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,148 @@
+__author__ = 'Prudhvi PLN'
+
+import re
+import struct
+
+
+# types of the first box of an mp4 (or its fragment / init section)
+_FIRST_BOX_TYPES = (b'ftyp', b'styp', b'moov', b'free', b'skip', b'wide', b'mdat')
+
+
+def _iter_boxes(data, end=None):
+    '''
+    Yields (type, start, payload start, end) of the consecutive boxes in data, whose headers are within data.
+    Box end can be beyond data. A box of size 0 extends to end (default: end of data).
+    '''
+    end = len(data) if end is None else end
+    offset = 0
+    while offset + 8 <= len(data) and offset < end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            # 64-bit box size
+            if offset + 16 > len(data):
+                return
+            size, header_size = struct.unpack_from('>Q', data, offset + 8)[0], 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield box_type, offset, offset + header_size, offset + size
+        offset += size
+
+
+def _get_child(data, box_type):
+    # payload of the first child box of the type, if any
+    for child_type, _, payload, end in _iter_boxes(data):
+        if child_type == box_type:
+            return data[payload:end]
+    return None
+
+
+def parse_moov(data):
+    '''
+    Parse the index (moov box) of an mp4 / fMP4 init section and return its metadata:
+    {'duration': seconds, 'width': pixels, 'height': pixels}. Width & height are of the first video track (None if there is none).
+    Returns None if there is no moov box in the data.
+    '''
+    moov = _get_child(data, b'moov')
+    if moov is None:
+        return None
+
+    metadata = {'duration': 0, 'width': None, 'height': None}
+    timescale = 0
+    mvhd = _get_child(moov, b'mvhd')
+    if mvhd:
+        # version 1 has 64-bit times & duration
+        timescale, duration = struct.unpack_from('>IQ', mvhd, 20) if mvhd[0] == 1 else struct.unpack_from('>II', mvhd, 12)
+        if not duration and _get_child(moov, b'mvex'):
+            # fragmented mp4: duration of all the fragments, if known
+            mehd = _get_child(_get_child(moov, b'mvex'), b'mehd')
+            if mehd: duration = struct.unpack_from('>Q' if mehd[0] == 1 else '>I', mehd, 4)[0]
+        metadata['duration'] = duration / timescale if timescale else 0
+
+    for box_type, _, payload, end in _iter_boxes(moov):
+        if box_type != b'trak':
+            continue
+        trak = moov[payload:end]
+        hdlr = _get_child(_get_child(trak, b'mdia') or b'', b'hdlr')
+        tkhd = _get_child(trak, b'tkhd')
+        if hdlr and tkhd and hdlr[8:12] == b'vide':
+            # width & height (16.16 fixed-point) are the last fields of tkhd
+            width, height = struct.unpack_from('>II', tkhd, len(tkhd) - 8)
+            metadata.update({'width': width >> 16, 'height': height >> 16})
+            break
+
+    return metadata
+
+
+def _fetch_range(url, session, start, end, headers=None, timeout=30):
+    '''
+    Returns the data of the byte range [start, end] of the url, and the size of the resource (None if not known).
+    '''
+    headers = {**(headers or {}), 'Range': f'bytes={start}-{end}'}
+    with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        if response.status_code == 206:
+            content_range = re.match(r'bytes\s+\d+-\d+/(\d+)', response.headers.get('content-range') or '')
+            return response.content, int(content_range.group(1)) if content_range else None
+
+        # range is ignored. Read only the requested bytes, if they are from the start
+        if start > 0:
+            raise ValueError('Range requests are not supported')
+        data = b''
+        for chunk in response.iter_content(64*1024):
+            data += chunk
+            if len(data) > end:
+                break
+        size = response.headers.get('content-length')
+        return data[:end + 1], int(size) if size else None
+
+
+def probe_mp4(url, session, headers=None, timeout=30, head_size=64*1024, max_moov_size=32*1024**2):
+    '''
+    Returns the metadata of an mp4: {'duration': seconds, 'size': bytes, 'width': pixels, 'height': pixels}, using the index (moov box)
+    fetched with range requests: the head of the file, and the rest of the index or the tail of the file (when moov is after the media data).
+    Returns None if the url is not an mp4, or the index is not found.
+    '''
+    fetch = lambda start, end: _fetch_range(url, session, start, end, headers, timeout)
+    head, size = fetch(0, head_size - 1)
+    if head[4:8] not in _FIRST_BOX_TYPES:
+        return None
+
+    # top-level boxes in the head. Index is either in the head, or at the tail after the media data (mdat)
+    next_offset, moov = 0, None
+    for box_type, start, _, end in _iter_boxes(head, size):
+        if box_type == b'moov':
+            if end - start > max_moov_size:
+                return None
+            moov = head[start:end] if end <= len(head) else head[start:] + fetch(len(head), end - 1)[0]
+            break
+        next_offset = end
+
+    else:
+        # fetch the boxes after the ones in the head
+        if size is None or next_offset >= size or size - next_offset > max_moov_size:
+            return None
+        tail, _ = fetch(next_offset, size - 1)
+        for box_type, start, _, end in _iter_boxes(tail):
+            if box_type == b'moov':
+                moov = tail[start:end]
+                break
+
+    metadata = parse_moov(moov) if moov else None
+    if metadata is None:
+        return None
+
+    metadata['size'] = size
+    return metadata
+
+
+def probe_init_section(url, session, byterange=None, headers=None, timeout=30, max_size=1024**2):
+    '''
+    Returns the metadata of the init section (EXT-X-MAP) of a fragmented mp4 HLS stream, as in parse_moov.
+    byterange: (offset, length) of the init section within the url, if any.
+    '''
+    start, length = byterange or (0, max_size)
+    data, _ = _fetch_range(url, session, start, start + min(length, max_size) - 1, headers, timeout)
+    return parse_moov(data)
@@ -0,0 +1,75 @@
+__author__ = 'Prudhvi PLN'
+
+import logging
+import random
+from threading import Lock
+
+
+class MirrorSelector():
+    '''
+    Distribute the range requests of a download across equivalent mirrors, weighted by their measured throughput.
+    - Throughput of a mirror is an EWMA of bytes/sec of its completed requests. Unmeasured mirrors get the best known weight, so they are tried early.
+    - A mirror is dropped after max_failures consecutive failures, or if it is slower than slow_ratio of the fastest mirror.
+      Ranges of a dropped mirror are retried on the remaining ones. The last mirror is never dropped.
+    '''
+    def __init__(self, urls, max_failures=2, slow_ratio=0.2, min_samples=3, alpha=0.3):
+        self.logger = logging.getLogger()
+        self.max_failures = max_failures
+        self.slow_ratio = slow_ratio
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self.lock = Lock()
+        self.mirrors = { url: {'throughput': None, 'samples': 0, 'failures': 0, 'bytes': 0} for url in urls }
+        self.dropped = {}
+
+    def __len__(self):
+        return len(self.mirrors)
+
+    def select(self):
+        '''
+        Returns the mirror to use for the next request
+        '''
+        with self.lock:
+            known = [ m['throughput'] for m in self.mirrors.values() if m['throughput'] ]
+            default_weight = max(known) if known else 1
+            urls = list(self.mirrors)
+            weights = [ self.mirrors[url]['throughput'] or default_weight for url in urls ]
+
+        return random.choices(urls, weights)[0]
+
+    def _drop(self, url, reason):
+        if url not in self.mirrors or len(self.mirrors) == 1:
+            return
+        self.logger.warning(f'Dropping mirror [{url}] due to {reason}. Remaining mirrors: {len(self.mirrors) - 1}')
+        self.dropped[url] = self.mirrors.pop(url)
+
+    def report_success(self, url, size, elapsed):
+        with self.lock:
+            mirror = self.mirrors.get(url)
+            if mirror is None:
+                return
+            throughput = size / max(elapsed, 1e-6)
+            mirror['throughput'] = throughput if mirror['throughput'] is None else self.alpha * throughput + (1 - self.alpha) * mirror['throughput']
+            mirror['samples'] += 1
+            mirror['failures'] = 0
+            mirror['bytes'] += size
+
+            # drop the mirror if it is consistently slower than the fastest mirror
+            fastest = max( m['throughput'] or 0 for m in self.mirrors.values() )
+            if mirror['samples'] >= self.min_samples and mirror['throughput'] < fastest * self.slow_ratio:
+                self._drop(url, f'low throughput ({mirror["throughput"] / 1024:.0f} KiB/s vs {fastest / 1024:.0f} KiB/s)')
+
+    def report_failure(self, url):
+        with self.lock:
+            mirror = self.mirrors.get(url)
+            if mirror is None:
+                return
+            mirror['failures'] += 1
+            if mirror['failures'] >= self.max_failures:
+                self._drop(url, f'{mirror["failures"]} consecutive failures')
+
+    def get_stats(self):
+        with self.lock:
+            stats = { url: {'MiB': round(m['bytes'] / 1024**2, 1), 'KiB/s': round((m['throughput'] or 0) / 1024), 'dropped': url in self.dropped}
+                      for url, m in list(self.mirrors.items()) + list(self.dropped.items()) }
+        return stats
@@ -0,0 +1,105 @@
+__author__ = 'Prudhvi PLN'
+
+import logging
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+from time import monotonic
+from tqdm.auto import tqdm
+
+
+class PostProcessor():
+    '''
+    Bounded pool of workers running the post-processing (ffmpeg remux, subtitle mux) of completed downloads,
+    so that a download slot moves on to the next episode as soon as its data is downloaded.
+    - ffmpeg runs with argv lists (no shell) & reports its progress through `-progress pipe:1`.
+    - ffmpeg is killed if it doesn't report any progress for stall_timeout seconds, or runs longer than timeout seconds.
+    - ffmpeg runs with a lower priority, if niceness is set. So, it doesn't slow down the downloads.
+    '''
+    def __init__(self, max_workers, niceness=0, timeout=None, stall_timeout=120):
+        self.logger = logging.getLogger()
+        self.max_workers = max_workers
+        self.niceness = niceness
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='udb-post-')
+
+    def submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+    def _get_priority_args(self):
+        # returns (command prefix, popen kwargs) to lower the priority of the process
+        if not self.niceness:
+            return [], {}
+        if os.name == 'nt':
+            return [], {'creationflags': subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+        if shutil.which('nice'):
+            return ['nice', '-n', str(self.niceness)], {}
+        return [], {}
+
+    def _watch(self, process, state, finished):
+        # kill the process if it stalls or runs too long
+        start = monotonic()
+        while not finished.wait(1):
+            now = monotonic()
+            if now - state['last_progress'] > self.stall_timeout:
+                state['error'] = f'no progress for {self.stall_timeout}s'
+            elif self.timeout and now - start > self.timeout:
+                state['error'] = f'timed out after {self.timeout}s'
+            else:
+                continue
+            process.kill()
+            return
+
+    def run_ffmpeg(self, cmd, log_file, duration=None, desc='Converting'):
+        '''
+        Run the ffmpeg command (argv list) & show its progress. Errors of ffmpeg are written to the log file.
+        duration (in seconds) of the output is used to show the progress in percentage, if known.
+        '''
+        prefix, popen_kwargs = self._get_priority_args()
+        cmd = prefix + cmd[:1] + ['-nostats', '-progress', 'pipe:1'] + cmd[1:]
+        self.logger.debug(f'Executing ffmpeg command: {cmd}')
+
+        state = {'last_progress': monotonic(), 'error': None}
+        finished = Event()
+        with open(log_file, 'wb') as ffmpeg_log, tqdm(total=round(duration) if duration else None, desc=desc, unit='s', leave=False) as progress:
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=ffmpeg_log, **popen_kwargs)
+            watcher = Thread(target=self._watch, args=(process, state, finished), daemon=True)
+            watcher.start()
+
+            # progress is reported as key=value lines. out_time_us is the position of the output
+            for line in process.stdout:
+                state['last_progress'] = monotonic()
+                key, _, value = line.decode('utf-8', errors='replace').strip().partition('=')
+                if key == 'out_time_us' and value.isdigit():
+                    progress.update(int(value) // 10**6 - progress.n)
+
+            returncode = process.wait()
+            finished.set()
+            watcher.join()
+
+        if state['error']:
+            raise Exception(f'ffmpeg killed as it {state["error"]}')
+        if returncode != 0:
+            with open(log_file, 'r', errors='replace') as f:
+                raise Exception(f'Error occured: {f.read()}')
+
+
+_post_processor = None
+_post_processor_lock = Lock()
+
+def get_post_processor(dl_config):
+    '''
+    Returns the process-wide post-processor shared by all downloads
+    '''
+    global _post_processor
+    with _post_processor_lock:
+        if _post_processor is None:
+            max_workers = dl_config.get('post_process_workers', 'auto')
+            # remux is mostly disk bound. So, a few workers are enough
+            max_workers = max(1, min(4, (os.cpu_count() or 1) // 2)) if max_workers == 'auto' else int(max_workers)
+            timeout = dl_config.get('post_process_timeout', 0) or None
+            _post_processor = PostProcessor(max_workers, dl_config.get('post_process_niceness', 10), timeout)
+        return _post_processor
@@ -0,0 +1,116 @@
+__author__ = 'Prudhvi PLN'
+
+import logging
+import re
+from datetime import datetime
+from threading import Lock
+from time import monotonic, sleep
+
+
+def parse_rate(value):
+    '''
+    Convert a human-readable rate (bytes/sec) like 512K, 2.5M, 1G or 1048576 to bytes/sec.
+    Returns None for unlimited (empty, 0, auto or unlimited).
+    '''
+    if value is None or str(value).strip().lower() in ('', '0', 'auto', 'unlimited', 'none'):
+        return None
+
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?(?:/s)?', str(value).strip(), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f'Invalid rate: {value}. Valid examples: 512K, 2.5M, 1G, 1048576')
+
+    multiplier = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}[match.group(2).upper()]
+    return int(float(match.group(1)) * multiplier) or None
+
+
+class RateLimiter():
+    '''
+    Process-wide token bucket limiting the total download rate across all concurrent downloads.
+    - Tokens are reserved in the order of arrival. A reservation beyond the available tokens becomes a debt,
+      and the caller sleeps till it is paid off. So, waiting readers are served first-come-first-served and
+      every episode gets a share proportional to its active readers.
+    - Rate can change based on the time of day using a schedule: [{'start': 'HH:MM', 'end': 'HH:MM', 'rate': '1M'}, ...].
+      Rate of the first matching window is used, else the default rate. Use rate 0 for unlimited within a window.
+    '''
+    def __init__(self, rate=None, burst=None, schedule=None):
+        self.logger = logging.getLogger()
+        self.default_rate = parse_rate(rate)
+        self.burst = parse_rate(burst)
+        self.schedule = [ (self._parse_time(w['start']), self._parse_time(w['end']), parse_rate(w.get('rate'))) for w in (schedule or []) ]
+        self.lock = Lock()
+        self.tokens = 0
+        self.last_refill = monotonic()
+        self.rate = None
+        self.rate_checked_at = None
+        self._update_rate(self.last_refill)
+
+    @staticmethod
+    def _parse_time(value):
+        hours, minutes = map(int, str(value).split(':'))
+        return hours * 60 + minutes
+
+    def _update_rate(self, now):
+        # re-evaluate the schedule at most once a second
+        if self.rate_checked_at is not None and now - self.rate_checked_at < 1:
+            return
+        self.rate_checked_at = now
+
+        rate = self.default_rate
+        current_time = datetime.now()
+        minute_of_day = current_time.hour * 60 + current_time.minute
+        for start, end, window_rate in self.schedule:
+            # windows can cross midnight, ex: 22:00 - 06:00
+            in_window = start <= minute_of_day < end if start <= end else (minute_of_day >= start or minute_of_day < end)
+            if in_window:
+                rate = window_rate
+                break
+
+        if rate != self.rate:
+            self.logger.debug(f'Download rate limit set to {rate if rate else "unlimited"} bytes/sec')
+            self.rate = rate
+            self.tokens = min(self.tokens, self._get_burst())
+
+    def _get_burst(self):
+        # allow a burst of one second worth of data by default
+        return self.burst or self.rate or 0
+
+    def is_limited(self):
+        return self.rate is not None or bool(self.schedule)
+
+    def reserve(self, size):
+        '''
+        Reserve tokens for the given number of bytes. Returns the seconds to wait before using them.
+        '''
+        with self.lock:
+            now = monotonic()
+            self._update_rate(now)
+            if self.rate is None:
+                self.last_refill = now
+                return 0
+
+            self.tokens = min(self._get_burst(), self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= size
+
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def consume(self, size):
+        '''
+        Block till the given number of bytes are allowed to be consumed
+        '''
+        delay = self.reserve(size)
+        if delay > 0: sleep(delay)
+
+
+_rate_limiter = None
+_rate_limiter_lock = Lock()
+
+def get_rate_limiter(dl_config):
+    '''
+    Returns the process-wide rate limiter shared by all downloads. Returns None if the download rate is not limited.
+    '''
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(dl_config.get('max_download_rate'), dl_config.get('download_rate_burst'), dl_config.get('download_rate_schedule'))
+        return _rate_limiter if _rate_limiter.is_limited() else None
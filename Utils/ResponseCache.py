@@ -0,0 +1,255 @@
+__author__ = 'Prudhvi PLN'
+
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from requests.structures import CaseInsensitiveDict
+
+from Utils.RateLimiter import parse_rate
+
+
+# response headers kept with the cached body. Validators are used to revalidate the stale entries
+_CACHED_HEADERS = ['etag', 'last-modified', 'content-type', 'date']
+
+
+class CacheMissError(Exception):
+    '''Raised in offline mode, if the response is not cached (or the request can't be served from the cache)'''
+    pass
+
+
+class CachedResponse():
+    '''
+    Response served from the cache. Provides the parts of requests.Response used by the clients.
+    '''
+    def __init__(self, entry):
+        self.status_code = 200
+        self.url = entry['url']
+        self.headers = CaseInsensitiveDict(entry['headers'])
+        self.content = entry['body']
+        self.encoding = entry['encoding']
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self, **kwargs):
+        return json.loads(self.text, **kwargs)
+
+
+class ResponseCache():
+    '''
+    Cache of the (GET) responses of the site clients, so that a run doesn't repeat the same metadata requests.
+    - memory: entries of the run, least recently used are evicted once max_memory_size is exceeded.
+    - disk (optional): cache_dir/<key>, a json line of metadata followed by the body. Shared across runs, bounded by max_disk_size.
+    TTL of an url is from the first matching rule: [{'pattern': regex, 'ttl': seconds}, ...], else default_ttl. TTL 0 disables the cache for the url.
+    Expired entries with ETag / Last-Modified are revalidated using a conditional request. So, an unchanged response isn't transferred again.
+    Concurrent requests of the same url are coalesced: the first one fetches, the rest wait & use its response.
+    In offline mode, responses are served only from the cache (even if expired).
+    '''
+    def __init__(self, ttl_rules=None, default_ttl=0, cache_dir=None, max_memory_size=64*1024**2, max_disk_size=256*1024**2, offline=False):
+        self.logger = logging.getLogger()
+        self.ttl_rules = [ (re.compile(rule['pattern']), int(rule['ttl'])) for rule in ttl_rules or [] ]
+        self.default_ttl = default_ttl
+        self.cache_dir = cache_dir
+        self.max_memory_size = max_memory_size
+        self.max_disk_size = max_disk_size
+        self.offline = offline
+        self.entries = OrderedDict()
+        self.memory_size = 0
+        self.lock = Lock()
+        self.inflight_locks = {}
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'coalesced': 0}
+        self.disk_size = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.disk_size = sum( entry.stat().st_size for entry in self._scan_disk() )
+
+    def get_ttl(self, url):
+        for pattern, ttl in self.ttl_rules:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def _get_key(self, url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _get_disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _scan_disk(self):
+        for sub_dir in os.scandir(self.cache_dir):
+            if sub_dir.is_dir():
+                yield from ( entry for entry in os.scandir(sub_dir.path) if entry.is_file() and '.tmp' not in entry.name )
+
+    def _read_disk(self, key):
+        try:
+            path = self._get_disk_path(key)
+            with open(path, 'rb') as f:
+                entry = json.loads(f.readline())
+                entry['body'] = f.read()
+            # mark as recently used
+            os.utime(path)
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, entry):
+        path = self._get_disk_path(key)
+        temp_file = f'{path}.{os.getpid()}.tmp'
+        metadata = { k: v for k, v in entry.items() if k != 'body' }
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            previous_size = os.path.getsize(path) if os.path.isfile(path) else 0
+            with open(temp_file, 'wb') as f:
+                f.write(json.dumps(metadata).encode('utf-8') + b'\n')
+                f.write(entry['body'])
+                size = f.tell()
+            os.replace(temp_file, path)
+        except OSError as e:
+            self.logger.debug(f'Failed to write response cache entry: {e}')
+            return
+
+        with self.lock:
+            self.disk_size += size - previous_size
+        if self.disk_size > self.max_disk_size:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        '''
+        Remove the least recently used entries from disk till the cache is within 90% of max disk size
+        '''
+        with self.lock:
+            entries = sorted( (entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._scan_disk() )
+            size = sum( entry[1] for entry in entries )
+            for _, entry_size, path in entries:
+                if size <= 0.9 * self.max_disk_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= entry_size
+            self.disk_size = size
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+
+        entry = self._read_disk(key) if self.cache_dir else None
+        if entry is not None:
+            self._put_memory(key, entry)
+        return entry
+
+    def _put_memory(self, key, entry):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.memory_size -= len(previous['body'])
+            if len(entry['body']) > self.max_memory_size:
+                return
+            self.entries[key] = entry
+            self.memory_size += len(entry['body'])
+            while self.memory_size > self.max_memory_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.memory_size -= len(evicted['body'])
+
+    def _put(self, key, entry):
+        self._put_memory(key, entry)
+        if self.cache_dir: self._write_disk(key, entry)
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def fetch(self, url, send_request):
+        '''
+        Returns the response of the url from the cache, else using send_request(conditional headers), which returns a requests.Response.
+        Only successful (200) responses are cached. Other responses are returned as-is.
+        '''
+        ttl = self.get_ttl(url)
+        if ttl <= 0 and not self.offline:
+            return send_request({})
+
+        key = self._get_key(url)
+        entry = self._get(key)
+        if entry is not None and (self.offline or entry['expires'] > time()):
+            self._count('hits')
+            return CachedResponse(entry)
+        if self.offline:
+            raise CacheMissError(f'Offline mode. No cached response for {url}')
+
+        with self.lock:
+            inflight_lock = self.inflight_locks.setdefault(key, Lock())
+
+        with inflight_lock:
+            try:
+                return self._fetch_locked(url, key, ttl, entry, send_request)
+            finally:
+                # drop the lock of the url once its request is done. So, locks are kept only for the requests in flight
+                with self.lock:
+                    if self.inflight_locks.get(key) is inflight_lock: del self.inflight_locks[key]
+
+    def _fetch_locked(self, url, key, ttl, entry, send_request):
+        # another request of the url might have fetched it, while waiting
+        fresh_entry = self._get(key)
+        if fresh_entry is not None and fresh_entry['expires'] > time():
+            self._count('coalesced')
+            return CachedResponse(fresh_entry)
+
+        entry = fresh_entry or entry
+        conditional_headers = {}
+        if entry is not None:
+            if entry['headers'].get('etag'): conditional_headers['If-None-Match'] = entry['headers']['etag']
+            if entry['headers'].get('last-modified'): conditional_headers['If-Modified-Since'] = entry['headers']['last-modified']
+
+        response = send_request(conditional_headers)
+        if response.status_code == 304 and entry is not None:
+            # not modified. Reuse the cached body for another ttl
+            self.logger.debug(f'Revalidated cached response of {url}')
+            self._count('revalidated')
+            entry = {**entry, 'expires': time() + ttl}
+            self._put(key, entry)
+            return CachedResponse(entry)
+
+        self._count('misses')
+        if response.status_code == 200:
+            headers = { header: response.headers[header] for header in _CACHED_HEADERS if header in response.headers }
+            self._put(key, {'url': url, 'headers': headers, 'encoding': response.encoding or response.apparent_encoding,
+                            'expires': time() + ttl, 'body': response.content})
+
+        return response
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'memory_mb': round(self.memory_size / 1024**2, 1), 'disk_mb': round(self.disk_size / 1024**2, 1)}
+
+
+_response_cache = None
+_response_cache_lock = Lock()
+
+def get_response_cache(cache_config):
+    '''
+    Returns the process-wide response cache shared by all clients. Returns None if the cache is disabled.
+    '''
+    global _response_cache
+    if not cache_config or not cache_config.get('enabled', True):
+        return None
+
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(cache_config.get('ttl_rules'), cache_config.get('default_ttl', 0), cache_config.get('cache_dir'),
+                                            parse_rate(cache_config.get('max_memory_size', '64M')) or 64*1024**2,
+                                            parse_rate(cache_config.get('max_disk_size', '256M')) or 256*1024**2)
+        # offline flag can change between the runs of the process
+        _response_cache.offline = cache_config.get('offline', False)
+        return _response_cache
@@ -0,0 +1,164 @@
+__author__ = 'Prudhvi PLN'
+
+import hashlib
+import logging
+import os
+from threading import Lock, get_ident
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from Utils.RateLimiter import parse_rate
+
+
+# query params which change per request (signatures, tokens, expiry) & don't identify the content
+# only the params which are clearly volatile (signed url params of CDNs). Generic names (e, t, ts, hash, ...) often select the content,
+# and ignoring them could serve wrong data. They can be added using segment_cache_ignore_params
+DEFAULT_IGNORE_PARAMS = ['expires', 'signature', 'token', 'policy', 'key-pair-id',
+                         'x-amz-algorithm', 'x-amz-credential', 'x-amz-date', 'x-amz-expires', 'x-amz-security-token', 'x-amz-signature', 'x-amz-signedheaders',
+                         'x-goog-algorithm', 'x-goog-credential', 'x-goog-date', 'x-goog-expires', 'x-goog-signature', 'x-goog-signedheaders']
+
+
+class SegmentCache():
+    '''
+    Persistent content-addressed cache of downloaded segments / chunks, shared across runs & episodes.
+    - index/<key>: content hash & size of the data of a key. Key is the normalized url (without volatile params) + range of the data.
+    - objects/<hash>: the data. Same data under different keys is stored once.
+    Entries are written to a temp file & renamed. So, a half-written entry is never used.
+    Least recently used (by mtime, updated on every hit) objects are evicted once the cache exceeds max_size.
+    '''
+    def __init__(self, cache_dir, max_size, ignore_params=None):
+        self.logger = logging.getLogger()
+        self.cache_dir = cache_dir
+        self.index_dir = os.path.join(cache_dir, 'index')
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.temp_dir = os.path.join(cache_dir, 'tmp')
+        self.max_size = max_size
+        self.ignore_params = { param.lower() for param in (DEFAULT_IGNORE_PARAMS if ignore_params is None else ignore_params) }
+        self.lock = Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'hit_bytes': 0, 'stored_bytes': 0, 'evicted': 0}
+        for dir in (self.index_dir, self.objects_dir, self.temp_dir):
+            os.makedirs(dir, exist_ok=True)
+        self.size = sum( entry.stat().st_size for entry in self._scan_objects() )
+        self.logger.debug(f'Segment cache [{cache_dir}] loaded. Size: {self.size / 1024**2:.1f} / {self.max_size / 1024**2:.0f} MiB')
+
+    def _scan_objects(self):
+        for sub_dir in os.scandir(self.objects_dir):
+            if sub_dir.is_dir():
+                yield from ( entry for entry in os.scandir(sub_dir.path) if entry.is_file() )
+
+    def _get_path(self, dir, name):
+        return os.path.join(dir, name[:2], name)
+
+    def _write_temp(self, path, data):
+        temp_file = os.path.join(self.temp_dir, f'{os.path.basename(path)}.{os.getpid()}.{get_ident()}.{id(data)}')
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+        return temp_file
+
+    def _write_atomic(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self._write_temp(path, data), path)
+
+    def normalize_url(self, url):
+        '''
+        Lowercase scheme & host, drop the volatile query params & sort the rest. Ex: https://CDN/seg1.ts?token=x&q=1 -> https://cdn/seg1.ts?q=1
+        '''
+        parts = urlsplit(url)
+        params = sorted( (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in self.ignore_params )
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(params), ''))
+
+    def get_key(self, url, data_range=None):
+        return hashlib.sha1(f'{self.normalize_url(url)}|{data_range}'.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''
+        Returns the cached data of the key, else None
+        '''
+        try:
+            with open(self._get_path(self.index_dir, key), 'r') as f:
+                content_hash, size = f.read().split()
+            object_file = self._get_path(self.objects_dir, content_hash)
+            with open(object_file, 'rb') as f:
+                data = f.read()
+            if len(data) != int(size):
+                raise ValueError('Size mismatch')
+            # mark as recently used
+            os.utime(object_file)
+
+        except (OSError, ValueError):
+            # not cached, or evicted
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+
+        with self.lock:
+            self.stats['hits'] += 1
+            self.stats['hit_bytes'] += len(data)
+        return data
+
+    def put(self, key, data):
+        if not data or len(data) > self.max_size:
+            return
+        content_hash = hashlib.sha256(data).hexdigest()
+        object_file = self._get_path(self.objects_dir, content_hash)
+        try:
+            os.makedirs(os.path.dirname(object_file), exist_ok=True)
+            temp_file = self._write_temp(object_file, data)
+            # existence check & size update are done together. So, concurrent puts of the same data count its size once
+            with self.lock:
+                if os.path.isfile(object_file):
+                    os.remove(temp_file)
+                    os.utime(object_file)
+                else:
+                    os.replace(temp_file, object_file)
+                    self.size += len(data)
+                    self.stats['stored_bytes'] += len(data)
+            self._write_atomic(self._get_path(self.index_dir, key), f'{content_hash} {len(data)}'.encode('ascii'))
+
+        except OSError as e:
+            self.logger.debug(f'Failed to add to segment cache: {e}')
+            return
+
+        if self.size > self.max_size:
+            self._evict()
+
+    def _evict(self):
+        '''
+        Remove the least recently used objects till the cache is within 90% of max size. Index entries of the removed objects become misses.
+        '''
+        with self.lock:
+            if self.size <= self.max_size:
+                return
+            objects = sorted( (entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._scan_objects() )
+            size = sum( obj[1] for obj in objects )
+            for _, obj_size, path in objects:
+                if size <= 0.9 * self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= obj_size
+                self.stats['evicted'] += 1
+            self.size = size
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'size_mb': round(self.size / 1024**2, 1)}
+
+
+_segment_cache = None
+_segment_cache_lock = Lock()
+
+def get_segment_cache(dl_config):
+    '''
+    Returns the process-wide segment cache. Returns None if the cache is not enabled.
+    '''
+    global _segment_cache
+    if not dl_config.get('segment_cache_dir'):
+        return None
+
+    with _segment_cache_lock:
+        if _segment_cache is None:
+            _segment_cache = SegmentCache(dl_config['segment_cache_dir'], parse_rate(dl_config.get('segment_cache_size', '2G')) or 2 * 1024**3,
+                                          dl_config.get('segment_cache_ignore_params'))
+        return _segment_cache
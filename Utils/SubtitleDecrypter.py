@@ -0,0 +1,65 @@
+__author__ = 'Prudhvi PLN'
+
+from binascii import Error as Base64Error, a2b_base64
+from functools import lru_cache
+
+from Cryptodome.Cipher import AES
+
+
+@lru_cache(maxsize=16)
+def _get_cipher(key):
+    # ECB has no state. So, the cipher (with its key schedule) is shared by all the lines & subtitles of a key
+    return AES.new(key, AES.MODE_ECB)
+
+
+def decrypt_srt(content, key, iv):
+    '''
+    Decrypt the subtitle (srt) with every cue text line encrypted separately using AES-CBC (base64 encoded, PKCS#7 padded).
+    All the lines are decrypted in a single pass: lines are concatenated & decrypted in ECB mode, and the CBC chaining
+    (XOR with the previous cipher block, or IV for the first block of a line) is applied to the whole buffer at once.
+    Lines which can't be decrypted are kept as-is.
+
+    Returns: (decrypted content, failed lines count, encrypted lines count)
+    '''
+    lines = content.decode('utf-8').splitlines(keepends=True)
+    cue_lines, blobs = [], []
+    failed = 0
+    for i, line in enumerate(lines):
+        # sequence numbers, timings & empty lines are not encrypted
+        line = line.strip()
+        if not line or line.isdigit() or '-->' in line:
+            continue
+        try:
+            blob = a2b_base64(line)
+        except (Base64Error, ValueError):
+            blob = b''
+        if blob and len(blob) % 16 == 0:
+            cue_lines.append(i)
+            blobs.append(blob)
+        else:
+            failed += 1
+
+    # lines which fail to decode below are already counted in blobs
+    total = len(blobs) + failed
+    if blobs:
+        cipher_text = b''.join(blobs)
+        previous_blocks = b''.join( iv + blob[:-16] for blob in blobs )
+        decrypted = _get_cipher(key).decrypt(cipher_text)
+        plain_text = (int.from_bytes(decrypted, 'big') ^ int.from_bytes(previous_blocks, 'big')).to_bytes(len(decrypted), 'big')
+
+        offset = 0
+        for i, blob in zip(cue_lines, blobs):
+            message = plain_text[offset:offset + len(blob)]
+            offset += len(blob)
+            if not 1 <= message[-1] <= 16:
+                # invalid padding. Wrong key, or not an encrypted line
+                failed += 1
+                continue
+            try:
+                # remove the padding
+                lines[i] = message[:-message[-1]].decode('utf-8').strip() + '\n'
+            except UnicodeDecodeError:
+                failed += 1
+
+    return ''.join(lines).encode('utf-8'), failed, total
+
@@ -1,5 +1,6 @@
 __author__ = 'Prudhvi PLN'
 
+import asyncio
 import logging
 import os
 import re
@@ -11,7 +12,7 @@ from datetime import datetime
 from functools import wraps
 from time import sleep
 from logging.handlers import RotatingFileHandler
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, TimeoutExpired
 
 
 # color themes
@@ -140,20 +141,22 @@ class VersionManager():
 
         raise ExitException(0)
 
-def exec_os_cmd(cmd):
+def exec_os_cmd(cmd, timeout=None):
     '''
     Execute any OS commands
-    Args: command to be executed
+    Args: command to be executed (string is run using shell, list is run directly), timeout in seconds
     Returns: output of executed command
     '''
-    proc = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
-    # print stdout to console
-    msg = proc.communicate()[0].decode("utf-8")
-    std_err = proc.communicate()[1].decode("utf-8")
-    rc = proc.returncode
-    if rc != 0:
-        raise Exception(f"Error occured: {std_err}")
-    return msg
+    proc = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=isinstance(cmd, str))
+    try:
+        msg, std_err = proc.communicate(timeout=timeout)
+    except TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise Exception(f"Command timed out after {timeout}s: {cmd}")
+    if proc.returncode != 0:
+        raise Exception(f"Error occured: {std_err.decode('utf-8')}")
+    return msg.decode("utf-8")
 
 # display seconds in hh mm ss format
 def pretty_time(sec: int, fmt='hh:mm:ss'):
@@ -255,6 +258,31 @@ def retry(exceptions=(Exception,), tries=3, delay=2, backoff=2, print_errors=Fal
         return wrapper
     return decorator
 
+# async version of retry decorator, used by coroutines of the asyncio download engine
+def async_retry(exceptions=(Exception,), tries=3, delay=2, backoff=2, print_errors=False):
+    """
+    Retry Decorator for coroutines. Same as retry, but waits without blocking the event loop
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            attempt, mdelay = 0, delay
+            while attempt < tries:
+                try:
+                    return_status = await func(*args, **kwargs)
+                    if type(return_status) == tuple and return_status[1] == 0:
+                        raise Exception(return_status)
+                    return return_status
+                except exceptions as e:
+                    await asyncio.sleep(mdelay)
+                    attempt += 1
+                    mdelay *= backoff
+                    if attempt >= tries and print_errors:
+                        colprint('error', f'{e} | Final Attempt: {attempt} / {tries}')
+            return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
 # custom decorator to make any function multi-threaded
 def threaded(max_parallel=None, thread_name_prefix='udb-', print_status=False):
     '''
@@ -296,6 +324,22 @@ def threaded(max_parallel=None, thread_name_prefix='udb-', print_status=False):
         return wrapper
     return decorator
 
+# parallel map which yields the results in order
+def ordered_map(func, items, max_workers=None, thread_name_prefix='udb-'):
+    '''
+    Run func on every item using a bounded pool of threads, and yield (item, result) in the same order as items.
+    A result is yielded as soon as it and all its predecessors are completed. Exception of an item is raised when it is reached.
+    '''
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix) as executor:
+        futures = [ executor.submit(func, item) for item in items ]
+        try:
+            for item, future in zip(items, futures):
+                yield item, future.result()
+        finally:
+            # cancel pending work, if the consumer stops early
+            for future in futures:
+                future.cancel()
+
 # load yaml config into dict
 def load_yaml(config_file):
     if not os.path.isfile(config_file):
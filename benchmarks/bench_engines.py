@@ -0,0 +1,81 @@
+__author__ = 'Prudhvi PLN'
+
+'''
+Benchmark download engines ('threads' vs 'asyncio') of BaseDownloader against a local server.
+Every run downloads the file in small chunks (many requests) in a separate process, and reports throughput & peak RSS of that process.
+
+Usage: python benchmarks/bench_engines.py [--size-mb 128] [--chunk-kb 64] [--concurrency 8 64 512]
+'''
+
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.local_server import LocalServer, random_payload
+
+
+def run_download(url, engine, concurrency, chunk_kb):
+    '''
+    Download the file once in this process and print the stats as json. Called in a sub-process by the benchmark.
+    '''
+    from Utils.BaseDownloader import BaseDownloader
+
+    logging.disable(logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as out_dir:
+        dl_config = {'download_dir': out_dir, 'download_engine': engine, 'max_concurrent_requests': concurrency}
+        downloader = BaseDownloader(dl_config, {'episodeName': f'Bench Episode 1 - {engine}.mp4', 'type': 'movie'})
+        downloader.chunk_size = chunk_kb * 1024
+        downloader.read_block_size = downloader.chunk_size
+
+        # write the progress bar to devnull. Only the stats are printed
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        start = perf_counter()
+        downloader.start_download(url)
+        elapsed = perf_counter() - start
+        sys.stdout = stdout
+
+        size = os.path.getsize(os.path.join(out_dir, f'Bench Episode 1 - {engine}.mp4'))
+
+    # ru_maxrss is in KiB on linux
+    print(json.dumps({'elapsed': elapsed, 'size': size, 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark download engines')
+    parser.add_argument('--size-mb', type=int, default=128, help='size of the file to download (default: 128)')
+    parser.add_argument('--chunk-kb', type=int, default=64, help='size of a chunk i.e., a single request (default: 64)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 64, 512], help='concurrency levels (default: 8 64 512)')
+    parser.add_argument('--engines', nargs='+', default=['threads', 'asyncio'], help='engines to compare (default: threads asyncio)')
+    parser.add_argument('--worker', nargs=4, metavar=('URL', 'ENGINE', 'CONCURRENCY', 'CHUNK_KB'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        url, engine, concurrency, chunk_kb = args.worker
+        run_download(url, engine, int(concurrency), int(chunk_kb))
+        sys.exit(0)
+
+    results = []
+    with LocalServer() as server:
+        url = server.add_file('/video.mp4', random_payload(args.size_mb * 1024 * 1024))
+        for concurrency in args.concurrency:
+            for engine in args.engines:
+                cmd = [sys.executable, os.path.abspath(__file__), '--worker', url, engine, str(concurrency), str(args.chunk_kb)]
+                output = subprocess.run(cmd, capture_output=True, text=True)
+                if output.returncode != 0:
+                    print(f'{engine} @ {concurrency} failed:\n{output.stderr}')
+                    continue
+                results.append((engine, concurrency, json.loads(output.stdout.strip().splitlines()[-1])))
+
+    print(f'\nFile size: {args.size_mb} MiB | Chunk size: {args.chunk_kb} KiB | Requests: {args.size_mb * 1024 // args.chunk_kb}')
+    print(f'{"Engine":<10} {"Concurrency":>12} {"Time (s)":>10} {"Throughput (MiB/s)":>20} {"Peak RSS (MiB)":>16}')
+    for engine, concurrency, stats in results:
+        throughput = stats['size'] / 1024**2 / stats['elapsed']
+        print(f'{engine:<10} {concurrency:>12} {stats["elapsed"]:>10.3f} {throughput:>20.1f} {stats["max_rss_kb"] / 1024:>16.1f}')
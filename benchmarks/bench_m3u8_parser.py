@@ -0,0 +1,76 @@
+__author__ = 'Prudhvi PLN'
+
+'''
+Micro-benchmark of the m3u8 parser on a generated 5000 segment playlist (with key rotation & byte ranges).
+Compares it with the regex based url extraction used earlier by HLSDownloader (which didn't handle keys, maps or byte ranges),
+and reports how many requests are needed after coalescing the byte-range segments.
+
+Usage: python benchmarks/bench_m3u8_parser.py [--segments 5000] [--runs 20]
+'''
+
+import argparse
+import os
+import re
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Utils.M3U8Parser import coalesce_segments, parse_m3u8
+
+
+BASE_URL = 'https://cdn.example.com/video/720p/index.m3u8'
+
+
+def generate_playlist(segments_count, byterange=False, key_every=500):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:4', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD']
+    for i in range(segments_count):
+        if i % key_every == 0:
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="https://keys.example.com/key{i // key_every}.bin",IV=0x{i:032x}')
+        lines.append('#EXTINF:6.006,')
+        if byterange:
+            lines.append(f'#EXT-X-BYTERANGE:{500000 + i % 1000}')
+            lines.append('video.ts')
+        else:
+            lines.append(f'seg-{i}-v1-a1.ts?token=abcdef0123456789')
+    lines.append('#EXT-X-ENDLIST')
+
+    return '\n'.join(lines) + '\n'
+
+
+def regex_urls(m3u8_link, m3u8_data):
+    # url extraction used earlier by HLSDownloader
+    base_url = '/'.join(m3u8_link.split('/')[:-1])
+    normalize_url = lambda url, base_url: (url if url.startswith('http') else 'https:' + url if url.startswith('//') else base_url + '/' + url)
+    return list(dict.fromkeys( normalize_url(url.group(0), base_url) for url in re.finditer("^(?!#).+$", m3u8_data, re.MULTILINE) ))
+
+
+def best_of(runs, func, *args):
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        result = func(*args)
+        timings.append(perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark m3u8 parser')
+    parser.add_argument('--segments', type=int, default=5000, help='number of segments in the playlist (default: 5000)')
+    parser.add_argument('--runs', type=int, default=20, help='number of runs. Best time is reported (default: 20)')
+    args = parser.parse_args()
+
+    print(f'\nSegments: {args.segments} | Runs: {args.runs} (best time reported)')
+    print(f'{"Playlist":<12} {"Method":<20} {"Time (ms)":>10} {"Segments":>10} {"Requests":>10}')
+    for name, byterange in (('urls', False), ('byte-range', True)):
+        data = generate_playlist(args.segments, byterange)
+
+        elapsed, urls = best_of(args.runs, regex_urls, BASE_URL, data)
+        print(f'{name:<12} {"regex (earlier)":<20} {elapsed * 1000:>10.2f} {len(urls):>10} {len(urls):>10}')
+
+        elapsed, playlist = best_of(args.runs, parse_m3u8, data, BASE_URL)
+        groups = coalesce_segments(playlist.segments)
+        print(f'{name:<12} {"parse_m3u8":<20} {elapsed * 1000:>10.2f} {len(playlist.segments):>10} {len(groups):>10}')
+
+        elapsed, groups = best_of(args.runs, coalesce_segments, playlist.segments)
+        print(f'{name:<12} {"coalesce_segments":<20} {elapsed * 1000:>10.2f} {len(playlist.segments):>10} {len(groups):>10}')
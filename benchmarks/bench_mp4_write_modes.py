@@ -0,0 +1,62 @@
+__author__ = 'Prudhvi PLN'
+
+'''
+Benchmark mp4 write modes of BaseDownloader against a local server.
+Compares wall time & bytes written for 'chunks' (chunk files + merge) and 'preallocate' (positional writes) modes.
+
+Usage: python benchmarks/bench_mp4_write_modes.py [--size-mb 256] [--runs 3]
+'''
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.local_server import LocalServer, bytes_written_by_process, random_payload
+from Utils.BaseDownloader import BaseDownloader
+
+
+def run_download(url, out_dir, write_mode):
+    dl_config = {'download_dir': out_dir, 'mp4_write_mode': write_mode}
+    ep_details = {'episodeName': f'Bench Episode 1 - {write_mode}.mp4', 'type': 'movie'}
+    downloader = BaseDownloader(dl_config, ep_details)
+
+    written_before = bytes_written_by_process()
+    start = perf_counter()
+    downloader.start_download(url)
+    downloader.post_process()
+    elapsed = perf_counter() - start
+    written_after = bytes_written_by_process()
+
+    out_file = os.path.join(out_dir, ep_details['episodeName'])
+    size = os.path.getsize(out_file)
+    os.remove(out_file)
+    bytes_written = written_after - written_before if written_before is not None else None
+
+    return elapsed, bytes_written, size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark mp4 write modes')
+    parser.add_argument('--size-mb', type=int, default=256, help='size of the file to download (default: 256)')
+    parser.add_argument('--runs', type=int, default=3, help='number of runs per mode (default: 3)')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    results = {}
+    with LocalServer() as server, tempfile.TemporaryDirectory() as out_dir:
+        url = server.add_file('/video.mp4', random_payload(args.size_mb * 1024 * 1024))
+        for mode in ('chunks', 'preallocate'):
+            results[mode] = [ run_download(url, out_dir, mode) for _ in range(args.runs) ]
+
+    print(f'\nFile size: {args.size_mb} MiB | Runs: {args.runs}')
+    print(f'{"Mode":<12} {"Best time (s)":>14} {"Avg time (s)":>13} {"Bytes written (MiB)":>20}')
+    for mode, runs in results.items():
+        times = [ r[0] for r in runs ]
+        written = runs[-1][1]
+        written = f'{written / 1024**2:.1f}' if written is not None else 'NA'
+        print(f'{mode:<12} {min(times):>14.3f} {sum(times)/len(times):>13.3f} {written:>20}')
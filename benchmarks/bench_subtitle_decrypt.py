@@ -0,0 +1,100 @@
+__author__ = 'Prudhvi PLN'
+
+'''
+Benchmark decryption of KissKh style encrypted subtitles (every cue text line is AES-CBC encrypted & base64 encoded).
+Compares the earlier per-line decryption (new cipher per line) with the single pass decrypt_srt,
+for a single subtitle and a batch of languages (as downloaded for an episode).
+
+Usage: python benchmarks/bench_subtitle_decrypt.py [--cues 5000] [--languages 12] [--runs 5]
+'''
+
+import argparse
+import base64
+import os
+import random
+import sys
+from time import perf_counter
+
+from Cryptodome.Cipher import AES
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Utils.SubtitleDecrypter import decrypt_srt
+
+
+KEY = b'8056483646328763'
+IV = b'6852612370185273'
+WORDS = ['hello', 'world', 'where', 'are', 'you', 'going', 'tonight', '안녕하세요', 'さようなら', 'música', 'is', 'the']
+
+
+def encrypt_line(text):
+    data = text.encode('utf-8')
+    pad = 16 - len(data) % 16
+    return base64.b64encode(AES.new(KEY, AES.MODE_CBC, IV).encrypt(data + bytes([pad]) * pad)).decode('ascii')
+
+
+def generate_srt(cues_count):
+    lines = []
+    for i in range(cues_count):
+        start = i * 3
+        lines.append(f'{i + 1}\n{start // 3600:02d}:{start // 60 % 60:02d}:{start % 60:02d},000 --> {start // 3600:02d}:{start // 60 % 60:02d}:{start % 60 + 2:02d},000\n')
+        for _ in range(random.randint(1, 2)):
+            lines.append(encrypt_line(' '.join(random.choices(WORDS, k=random.randint(2, 10)))) + '\n')
+        lines.append('\n')
+    return ''.join(lines).encode('utf-8')
+
+
+def per_line_decrypt(content, key, iv):
+    # earlier implementation: BaseClient._aes_decrypt for every text line
+    def aes_decrypt(word):
+        decrypted = AES.new(key, AES.MODE_CBC, iv).decrypt(base64.b64decode(word))
+        return decrypted[:-ord(decrypted[len(decrypted)-1:])].decode('utf-8').strip()
+
+    out = []
+    for line in content.decode('utf-8').splitlines(keepends=True):
+        if line.strip() and not line.strip().isdigit() and '-->' not in line:
+            try:
+                out.append(aes_decrypt(line.strip()) + '\n')
+            except Exception:
+                out.append(line)
+        else:
+            out.append(line)
+    return ''.join(out).encode('utf-8')
+
+
+def best_of(runs, func, *args):
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        result = func(*args)
+        timings.append(perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark subtitle decryption')
+    parser.add_argument('--cues', type=int, default=5000, help='number of cues per subtitle (default: 5000)')
+    parser.add_argument('--languages', type=int, default=12, help='number of subtitles in the batch (default: 12)')
+    parser.add_argument('--runs', type=int, default=5, help='number of runs. Best time is reported (default: 5)')
+    args = parser.parse_args()
+
+    random.seed(1)
+    subtitle = generate_srt(args.cues)
+    expected = per_line_decrypt(subtitle, KEY, IV)
+    batch = [ (generate_srt(args.cues), KEY, IV) for _ in range(args.languages) ]
+    batch_size = sum( len(content) for content, _, _ in batch )
+
+    print(f'\nCues: {args.cues} ({len(subtitle) / 1024:.0f} KiB) | Batch: {args.languages} languages ({batch_size / 1024**2:.1f} MiB) | Runs: {args.runs} (best time reported)')
+    print(f'{"Method":<32} {"Time (ms)":>10} {"Speedup":>8}')
+
+    baseline, _ = best_of(args.runs, per_line_decrypt, subtitle, KEY, IV)
+    print(f'{"per-line (earlier)":<32} {baseline * 1000:>10.1f} {1:>7.1f}x')
+
+    elapsed, (result, failed, _) = best_of(args.runs, decrypt_srt, subtitle, KEY, IV)
+    assert result == expected and failed == 0, 'decrypt_srt output differs from per-line decryption'
+    print(f'{"decrypt_srt":<32} {elapsed * 1000:>10.1f} {baseline / elapsed:>7.1f}x')
+
+    batch_baseline, _ = best_of(args.runs, lambda: [ per_line_decrypt(*item) for item in batch ])
+    print(f'{"batch per-line (earlier)":<32} {batch_baseline * 1000:>10.1f} {1:>7.1f}x')
+    elapsed, _ = best_of(args.runs, lambda: [ decrypt_srt(*item) for item in batch ])
+    print(f'{"batch decrypt_srt":<32} {elapsed * 1000:>10.1f} {batch_baseline / elapsed:>7.1f}x')
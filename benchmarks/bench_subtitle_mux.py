@@ -0,0 +1,115 @@
+__author__ = 'Prudhvi PLN'
+
+'''
+Benchmark muxing of subtitles into mp4 downloads against a local server.
+Compares the two-pass mux (download the mp4, then ffmpeg copies it with the subtitles) in both mp4 write modes
+with the single-pass mux (chunks are streamed to ffmpeg while downloading). Reports wall time, bytes written to disk
+by udb & ffmpeg, and the peak disk usage of the download directory.
+
+Needs ffmpeg in PATH. A faststart mp4 is generated using ffmpeg, unless an mp4 is given using --input.
+
+Usage: python benchmarks/bench_subtitle_mux.py [--duration 600] [--input video.mp4] [--subtitles 2]
+'''
+
+import argparse
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from threading import Event, Thread
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.local_server import LocalServer
+from Utils.BaseDownloader import BaseDownloader
+
+
+SUBTITLE = ''.join( f'{i + 1}\n00:{i // 60:02d}:{i % 60:02d},000 --> 00:{i // 60:02d}:{i % 60:02d},900\nLine {i + 1}\n\n' for i in range(600) )
+
+
+def generate_mp4(out_file, duration):
+    # faststart (index at the start) mp4, like the ones served for progressive playback
+    cmd = ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=25:duration={duration}',
+           '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}', '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', '4M',
+           '-c:a', 'aac', '-movflags', '+faststart', out_file]
+    subprocess.run(cmd, check=True)
+
+
+def disk_blocks_written():
+    # blocks (of 512 bytes) written to disk by this process & its completed child processes (ffmpeg)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_oublock + resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock
+
+
+def disk_usage(dir):
+    usage = 0
+    for root, _, files in os.walk(dir):
+        for file in files:
+            try:
+                usage += os.stat(os.path.join(root, file)).st_blocks * 512
+            except OSError:
+                pass    # removed while walking
+    return usage
+
+
+def run_download(url, subtitles, out_dir, write_mode, single_pass):
+    dl_config = {'download_dir': out_dir, 'mp4_write_mode': write_mode, 'mp4_single_pass_mux': single_pass, 'post_process_niceness': 0}
+    ep_details = {'episodeName': f'Bench Episode 1 - {write_mode}.mp4', 'type': 'movie', 'subtitles': dict(subtitles)}
+    downloader = BaseDownloader(dl_config, ep_details)
+
+    # sample the disk usage of the download directory while downloading & muxing
+    peak_usage, finished = [0], Event()
+    def sample():
+        while not finished.wait(0.005):
+            peak_usage[0] = max(peak_usage[0], disk_usage(out_dir))
+    sampler = Thread(target=sample, daemon=True)
+    sampler.start()
+
+    blocks_before = disk_blocks_written()
+    start = perf_counter()
+    downloader.start_download(url)
+    downloader.post_process()
+    elapsed = perf_counter() - start
+    blocks_written = disk_blocks_written() - blocks_before
+    finished.set()
+    sampler.join()
+
+    out_file = os.path.join(out_dir, ep_details['episodeName'])
+    size = os.path.getsize(out_file)
+    os.remove(out_file)
+    downloader._cleanup_out_dirs()
+
+    return elapsed, blocks_written * 512, peak_usage[0], size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark subtitle muxing of mp4 downloads')
+    parser.add_argument('--duration', type=int, default=600, help='duration (in seconds) of the generated mp4 (default: 600)')
+    parser.add_argument('--input', help='faststart mp4 to use instead of generating one')
+    parser.add_argument('--subtitles', type=int, default=2, help='number of subtitles to mux (default: 2)')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    with LocalServer() as server, tempfile.TemporaryDirectory() as work_dir:
+        input_file = args.input
+        if not input_file:
+            input_file = os.path.join(work_dir, 'input.mp4')
+            generate_mp4(input_file, args.duration)
+        with open(input_file, 'rb') as f:
+            url = server.add_file('/video.mp4', f.read())
+        subtitles = { f'Language {i}': server.add_file(f'/subtitle{i}.srt', SUBTITLE.encode('utf-8')) for i in range(args.subtitles) }
+
+        out_dir = os.path.join(work_dir, 'downloads')
+        results = {
+            'two-pass (chunks)': run_download(url, subtitles, out_dir, 'chunks', False),
+            'two-pass (preallocate)': run_download(url, subtitles, out_dir, 'preallocate', False),
+            'single-pass': run_download(url, subtitles, out_dir, 'preallocate', True)
+        }
+
+    file_size = len(server.httpd.files['/video.mp4'])
+    print(f'\nFile size: {file_size / 1024**2:.1f} MiB | Subtitles: {args.subtitles}')
+    print(f'{"Mode":<24} {"Time (s)":>9} {"Disk writes (MiB)":>18} {"Writes / file size":>19} {"Peak disk (MiB)":>16}')
+    for mode, (elapsed, written, peak, size) in results.items():
+        print(f'{mode:<24} {elapsed:>9.2f} {written / 1024**2:>18.1f} {written / file_size:>18.2f}x {peak / 1024**2:>16.1f}')
@@ -0,0 +1,97 @@
+__author__ = 'Prudhvi PLN'
+
+'''
+A minimal local HTTP server used by the benchmarks. Serves an in-memory payload with Range support (HTTP/1.1 keep-alive).
+'''
+
+import os
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+
+class _RangeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass    # keep the benchmark output clean
+
+    def _send_payload(self, send_body=True):
+        payload = self.server.files.get(self.path.split('?')[0])
+        if payload is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end = 0, len(payload) - 1
+        byte_range = re.match(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if byte_range and self.server.support_ranges:
+            if byte_range.group(1):
+                start = int(byte_range.group(1))
+                end = min(int(byte_range.group(2)), end) if byte_range.group(2) else end
+            else:       # suffix range
+                start = max(0, len(payload) - int(byte_range.group(2)))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(payload)}')
+        else:
+            self.send_response(200)
+
+        if self.server.support_ranges: self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', f'"{len(payload)}"')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(memoryview(payload)[start:end+1])
+
+    def do_GET(self):
+        self._send_payload()
+
+    def do_HEAD(self):
+        self._send_payload(send_body=False)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024       # accept bursts of hundreds of connections
+
+    def handle_error(self, request, client_address):
+        pass    # clients closing connections early (cancelled / failed downloads) are expected
+
+
+class LocalServer():
+    '''
+    Serve in-memory files from a background thread. Use as a context manager.
+    '''
+    def __init__(self, files=None, support_ranges=True):
+        self.httpd = _Server(('127.0.0.1', 0), _RangeRequestHandler)
+        self.httpd.files = files or {}
+        self.httpd.support_ranges = support_ranges
+        self.base_url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def add_file(self, path, payload):
+        self.httpd.files[path] = payload
+        return self.base_url + path
+
+    def __enter__(self):
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def random_payload(size):
+    return os.urandom(size)
+
+
+def bytes_written_by_process():
+    '''
+    Returns the bytes written by this process so far (Linux only). Returns None if not available.
+    '''
+    try:
+        with open('/proc/self/io') as f:
+            return int([ line.split()[1] for line in f if line.startswith('wchar') ][0])
+    except Exception:
+        return None
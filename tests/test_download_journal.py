@@ -0,0 +1,134 @@
+__author__ = 'Prudhvi PLN'
+
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.local_server import LocalServer
+from Utils.BaseDownloader import BaseDownloader
+from Utils.DownloadJournal import DownloadJournal
+from Utils.HLSDownloader import HLSDownloader
+from Utils.M3U8Parser import parse_m3u8
+
+
+class TestDownloadJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_resume(self):
+        journal = DownloadJournal(self.work_dir.name, 10, 'source-1')
+        journal.mark_completed(2, 100)
+        journal.mark_completed(5, 50)
+        journal.close()
+
+        journal = DownloadJournal(self.work_dir.name, 10, 'source-1')
+        self.assertEqual([ i for i in range(10) if journal.is_completed(i) ], [2, 5])
+        self.assertEqual(journal.get_size(2), 100)
+        journal.close()
+
+    def test_source_change_invalidates(self):
+        journal = DownloadJournal(self.work_dir.name, 10, 'source-1')
+        journal.mark_completed(2, 100)
+        journal.close()
+
+        journal = DownloadJournal(self.work_dir.name, 10, 'source-2')
+        self.assertTrue(journal.invalidated)
+        self.assertEqual(journal.completed_count(), 0)
+        journal.close()
+
+    def test_incomplete_item_is_not_completed(self):
+        journal = DownloadJournal(self.work_dir.name, 2, 'source-1', expected_sizes=lambda item_no: 100)
+        journal.mark_completed(0, 99)
+        journal.mark_completed(1, 100)
+        self.assertFalse(journal.is_completed(0))
+        self.assertTrue(journal.is_completed(1))
+        journal.close()
+
+    def test_verify_forgets_missing_items(self):
+        journal = DownloadJournal(self.work_dir.name, 3, 'source-1')
+        for item_no in range(3):
+            journal.mark_completed(item_no, 10)
+        self.assertEqual(journal.verify(lambda item_no, size: item_no != 1), 1)
+        journal.close()
+
+        journal = DownloadJournal(self.work_dir.name, 3, 'source-1')
+        self.assertEqual([ i for i in range(3) if journal.is_completed(i) ], [0, 2])
+        journal.remove()
+        self.assertEqual(os.listdir(self.work_dir.name), [])
+
+
+class TestStaleJournal(unittest.TestCase):
+    '''Download again after the output is removed, while the temp dir (with the journal) is kept'''
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.server = LocalServer().__enter__()
+        self.payload = os.urandom(3 * 1024 * 1024 + 123)
+        self.url = self.server.add_file('/video.mp4', self.payload)
+        self.work_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        self.server.__exit__()
+        self.work_dir.cleanup()
+
+    def _download(self, write_mode):
+        dl_config = {'download_dir': self.work_dir.name, 'mp4_write_mode': write_mode}
+        downloader = BaseDownloader(dl_config, {'episodeName': 'Test Episode 1 - 720P.mp4', 'type': 'movie'})
+        self.assertEqual(downloader.start_download(self.url)[0], 0)
+        out_file = os.path.join(self.work_dir.name, 'Test Episode 1 - 720P.mp4')
+        with open(out_file, 'rb') as f:
+            data = f.read()
+        os.remove(out_file)
+        return data
+
+    def _test_stale_journal(self, write_mode):
+        # journal left behind (ex: interrupted before it is removed)
+        with mock.patch.object(DownloadJournal, 'remove', DownloadJournal.close):
+            self.assertEqual(self._download(write_mode), self.payload)
+        self.assertEqual(self._download(write_mode), self.payload)
+        # journal is removed once the output is complete
+        self.assertEqual(self._download(write_mode), self.payload)
+
+    def test_stale_journal_preallocate(self):
+        self._test_stale_journal('preallocate')
+
+    def test_stale_journal_chunks(self):
+        self._test_stale_journal('chunks')
+
+
+class TestEmptySegment(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_empty_segment_is_not_journaled(self):
+        downloader = HLSDownloader({'download_dir': self.work_dir.name}, {'episodeName': 'Test Episode 1 - 720P.mp4', 'type': 'movie'})
+        downloader._create_out_dirs()
+        downloader.playlist = parse_m3u8('#EXTM3U\n#EXTINF:4.0,\nhttp://127.0.0.1/seg0.ts\n#EXT-X-ENDLIST', 'http://127.0.0.1/index.m3u8')
+        segments = downloader._prepare_segments()
+        downloader.journal = DownloadJournal(downloader.temp_dir, 1, 'source-1')
+
+        with self.assertRaises(Exception):
+            downloader._save_segments(segments, b'', 200)
+        self.assertFalse(downloader.journal.is_completed(0))
+
+        downloader._save_segments(segments, b'data', 200)
+        self.assertTrue(downloader.journal.is_completed(0))
+        downloader.journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+__author__ = 'Prudhvi PLN'
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.local_server import LocalServer
+from Utils.HLSDownloader import HLSDownloader
+
+
+class TestProgressiveDownload(unittest.TestCase):
+    '''Partial file of a progressive download of a fragmented mp4 playlist'''
+
+    def setUp(self):
+        self.server = LocalServer().__enter__()
+        self.init_data = b'\x00\x00\x00\x18ftypisom\x00\x00\x02\x00isomiso6' + b'\x00\x00\x00\x08moov'
+        self.segments = [ os.urandom(1000 + i) for i in range(5) ]
+        self.server.add_file('/init.mp4', self.init_data)
+        lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4', '#EXT-X-MAP:URI="init.mp4"']
+        for i, data in enumerate(self.segments):
+            self.server.add_file(f'/seg{i}.m4s', data)
+            lines += ['#EXTINF:4.0,', f'seg{i}.m4s']
+        lines.append('#EXT-X-ENDLIST')
+        self.m3u8_link = self.server.add_file('/index.m3u8', '\n'.join(lines).encode('utf-8'))
+        self.work_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.__exit__()
+        self.work_dir.cleanup()
+
+    def _download(self):
+        dl_config = {'download_dir': self.work_dir.name, 'hls_output_mode': 'progressive'}
+        downloader = HLSDownloader(dl_config, {'episodeName': 'Test Episode 1 - 720P.mp4', 'type': 'movie'})
+        self.assertEqual(downloader.start_download(self.m3u8_link)[0], 0)
+        return os.path.join(self.work_dir.name, 'Test Episode 1 - 720P.partial.mp4')
+
+    def test_partial_file_starts_with_init_section(self):
+        partial_file = self._download()
+        with open(partial_file, 'rb') as f:
+            self.assertEqual(f.read(), self.init_data + b''.join(self.segments))
+
+    def test_resume_keeps_init_section(self):
+        partial_file = self._download()
+        # interrupted write after the last journal entry is dropped on resume
+        with open(partial_file, 'ab') as f:
+            f.write(b'garbage')
+        self._download()
+        with open(partial_file, 'rb') as f:
+            self.assertEqual(f.read(), self.init_data + b''.join(self.segments))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+__author__ = 'Prudhvi PLN'
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Utils.SegmentCache import SegmentCache
+
+
+class TestSegmentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    def test_normalize_url(self):
+        cache = SegmentCache(self.cache_dir, 1024**2)
+        url = 'HTTPS://CDN.Example.com/Video/seg1.ts?token=abc&q=1&X-Amz-Signature=xyz&a=2'
+        self.assertEqual(cache.normalize_url(url), 'https://cdn.example.com/Video/seg1.ts?a=2&q=1')
+        # generic params like t / e can identify the content. They are kept
+        self.assertEqual(cache.normalize_url('https://cdn/seg1.ts?t=5&e=10'), 'https://cdn/seg1.ts?e=10&t=5')
+        # same content with different signatures & param order has the same key, but a different range doesn't
+        self.assertEqual(cache.get_key('https://cdn/seg1.ts?q=1&token=a&a=2', (0, 99)), cache.get_key('https://cdn/seg1.ts?a=2&q=1&token=b', (0, 99)))
+        self.assertNotEqual(cache.get_key('https://cdn/seg1.ts', (0, 99)), cache.get_key('https://cdn/seg1.ts', (100, 199)))
+
+    def test_put_get(self):
+        cache = SegmentCache(self.cache_dir, 1024**2)
+        cache.put('key1', b'a' * 100)
+        cache.put('key2', b'a' * 100)
+        self.assertEqual(cache.get('key1'), b'a' * 100)
+        self.assertEqual(cache.get('key2'), b'a' * 100)
+        self.assertIsNone(cache.get('key3'))
+        # same data under different keys is stored once
+        self.assertEqual(cache.size, 100)
+        # size is loaded from the disk on restart
+        self.assertEqual(SegmentCache(self.cache_dir, 1024**2).size, 100)
+
+    def set_mtime(self, cache, key, mtime):
+        with open(cache._get_path(cache.index_dir, key)) as f:
+            os.utime(cache._get_path(cache.objects_dir, f.read().split()[0]), (mtime, mtime))
+
+    def test_eviction(self):
+        cache = SegmentCache(self.cache_dir, 1000)
+        for i in range(3):
+            cache.put(f'key{i}', bytes([i]) * 300)
+            self.set_mtime(cache, f'key{i}', i)
+        # a hit marks key0 as recently used. So, key1 is the least recently used
+        self.assertIsNotNone(cache.get('key0'))
+        cache.put('key3', bytes([3]) * 300)
+
+        self.assertLessEqual(cache.size, 0.9 * cache.max_size)
+        self.assertIsNone(cache.get('key1'))
+        self.assertEqual(cache.get('key0'), bytes([0]) * 300)
+        self.assertEqual(cache.get('key3'), bytes([3]) * 300)
+        self.assertEqual(cache.get_stats()['evicted'], 1)
+
+    def test_concurrent_put_same_data(self):
+        cache = SegmentCache(self.cache_dir, 1024**2)
+        isfile = os.path.isfile
+        def slow_isfile(path):
+            # widen the window between the existence check & the write of the object
+            result = isfile(path)
+            time.sleep(0.01)
+            return result
+
+        with mock.patch('Utils.SegmentCache.os.path.isfile', slow_isfile), ThreadPoolExecutor(8) as executor:
+            list(executor.map(lambda i: cache.put(f'key{i}', b'a' * 1000), range(16)))
+        self.assertEqual(cache.size, 1000)
+        self.assertEqual(cache.get_stats()['stored_bytes'], 1000)
+        self.assertEqual(os.listdir(cache.temp_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
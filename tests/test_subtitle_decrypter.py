@@ -0,0 +1,44 @@
+__author__ = 'Prudhvi PLN'
+
+import base64
+import os
+import sys
+import unittest
+
+from Cryptodome.Cipher import AES
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Utils.SubtitleDecrypter import decrypt_srt
+
+
+KEY = b'8056483646328763'
+IV = b'6852612370185273'
+
+
+def encrypt_line(data, pad=None):
+    pad = pad if pad is not None else 16 - len(data) % 16
+    return base64.b64encode(AES.new(KEY, AES.MODE_CBC, IV).encrypt(data + bytes([pad]) * (16 - len(data) % 16))).decode('ascii')
+
+
+class TestDecryptSrt(unittest.TestCase):
+
+    def test_decrypt(self):
+        content = f'1\n00:00:01,000 --> 00:00:02,000\n{encrypt_line("Hello".encode())}\n{encrypt_line("안녕하세요".encode())}\n\n'
+        decrypted, failed, total = decrypt_srt(content.encode('utf-8'), KEY, IV)
+        self.assertEqual(decrypted.decode('utf-8'), '1\n00:00:01,000 --> 00:00:02,000\nHello\n안녕하세요\n\n')
+        self.assertEqual((failed, total), (0, 2))
+
+    def test_failed_lines_are_counted_once(self):
+        bad_utf8 = encrypt_line(b'\xff\xfe\xfd')
+        bad_padding = encrypt_line(b'0123456789', pad=0)
+        content = f'1\n00:00:01,000 --> 00:00:02,000\n{encrypt_line(b"ok")}\n{bad_utf8}\n{bad_padding}\nnot encrypted!\n\n'
+        decrypted, failed, total = decrypt_srt(content.encode('utf-8'), KEY, IV)
+        self.assertEqual((failed, total), (3, 4))
+        # lines which can't be decrypted are kept as-is
+        self.assertIn(bad_utf8, decrypted.decode('utf-8'))
+        self.assertIn(bad_padding, decrypted.decode('utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
 __author__ = 'Prudhvi PLN'
 
 import argparse
+from concurrent.futures import Future
 from datetime import datetime
+import json
 import os, sys
 from time import time
 import traceback
@@ -10,16 +12,23 @@ import traceback
 from Utils.commons import colprint_init, colprint, PRINT_THEMES, ExitException
 from Utils.commons import create_logger, load_yaml, pretty_time, strip_ansi, threaded, delete_old_logs
 from Utils.commons import VersionManager
+from Utils.RateLimiter import parse_rate
 
 
 ACTIVE_CLIENTS = ['Anime (Animepahe)', 'Anime, Drama, Movies & TV Shows (Kisskh)']
 HIDDEN_CLIENTS = []       # obsolete clients
 get_current_time = lambda fmt='%F %T': datetime.now().strftime(fmt)
+# throughput of the last batch of downloads. Used to estimate the download time of the next batch
+DOWNLOAD_STATS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.udb_download_stats.json')
 
 def get_client():
     '''Return a client instance'''
     # add hls_size_accuracy parameter passed from cli
     config.setdefault(series_type, {}).update({'hls_size_accuracy': hls_size_accuracy})
+    # add response cache configuration, with the offline flag passed from cli
+    response_cache_config = dict(config.get('ResponseCacheConfig') or {})
+    if offline_mode: response_cache_config.update({'enabled': True, 'offline': True})
+    config[series_type]['response_cache'] = response_cache_config
     # Load required Client based on user selection, to avoid unnecessary imports
     if 'animepahe' in series_type.lower():
         logger.debug('Creating Anime Client for AnimePahe site')
@@ -198,10 +207,60 @@ def get_ep_range_multiple(season_ep_ranges):
 
     return selected_eps
 
+def get_out_file(ep_details, dl_config):
+    '''Returns the path of the downloaded episode'''
+    # set output directory based on series type
+    out_dir = dl_config['download_dir']
+    if ep_details.get('type', '') == 'tv':
+        out_dir = f"{out_dir}{os.sep}Season-{ep_details['season']}"     # add extra folder for season
+
+    return os.path.join(out_dir, ep_details['episodeName'])
+
+def load_download_stats():
+    try:
+        with open(DOWNLOAD_STATS_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_download_stats(downloaded_bytes, elapsed):
+    '''Save the throughput (bytes/sec) of a batch of downloads'''
+    if downloaded_bytes <= 0 or elapsed <= 0: return
+    try:
+        with open(DOWNLOAD_STATS_FILE, 'w') as f:
+            json.dump({'throughput': round(downloaded_bytes / elapsed), 'updated': get_current_time()}, f)
+    except OSError as e:
+        logger.debug(f'Failed to save download stats: {e}')
+
+def estimate_batch(links, dl_config):
+    '''
+    Returns the estimated total size & download time of the episodes to download, as a message.
+    Size is the sum of the estimated size of the episodes (if known by the client). Time is based on the throughput of the last batch,
+    capped by the download rate limit.
+    '''
+    to_download = [ ep for ep in links.values() if ep.get('downloadLink') and not os.path.isfile(get_out_file(ep, dl_config)) ]
+    sizes = [ ep['filesize_mb'] for ep in to_download if ep.get('filesize_mb') ]
+    if not sizes:
+        return None
+
+    total_mb = sum(sizes)
+    msg = f'Estimated download size: ~{total_mb / 1024:.2f} GB' if total_mb >= 1024 else f'Estimated download size: ~{total_mb} MB'
+    if len(sizes) < len(to_download):
+        msg += f' (size unknown for {len(to_download) - len(sizes)}/{len(to_download)} episodes)'
+
+    try:
+        rate_limit = parse_rate(dl_config.get('max_download_rate'))
+    except ValueError:
+        rate_limit = None
+    rates = [ rate for rate in (load_download_stats().get('throughput'), rate_limit) if rate ]
+    eta = pretty_time(int(total_mb * 1024**2 / min(rates)), fmt='h m s') if rates else 'NA'
+    return f'{msg} | ETA: {eta}'
+
 def downloader(ep_details, dl_config):
     '''
     Download function where Download Client initialization and download happens.
-    Accepts two dicts: download config, episode details. Returns download status.
+    Accepts two dicts: download config, episode details. Returns download status,
+    or a future of the download status if the episode is being post-processed (remux / add subtitles).
     '''
     # load color themes
     error_clr = PRINT_THEMES['error'] if not disable_colors else ''
@@ -218,10 +277,7 @@ def downloader(ep_details, dl_config):
         return f'{error_clr}[{start}] Download skipped for {out_file}, due to error: {ep_details.get("error", "Unknown")}{reset_clr}'
 
     download_type = ep_details['downloadType']
-    # set output directory based on series type
-    out_dir = dl_config['download_dir']
-    if ep_details.get('type', '') == 'tv':
-        out_dir = f"{out_dir}{os.sep}Season-{ep_details['season']}"     # add extra folder for season
+    out_path = get_out_file(ep_details, dl_config)
 
     # create download client for the episode based on type
     logger.debug(f'Creating download client with {ep_details = }, {dl_config = }')
@@ -241,7 +297,27 @@ def downloader(ep_details, dl_config):
 
     logger.info(f'Download started for {out_file}...')
 
-    if os.path.isfile(os.path.join(f'{out_dir}', f'{out_file}')) and os.path.getsize(os.path.join(f'{out_dir}', f'{out_file}')) > 0:
+    def get_download_status(status, msg):
+        # remove target dirs if no files are downloaded
+        dlClient._cleanup_out_dirs()
+
+        end = get_current_time()
+        if status != 0:
+            return f'{error_clr}[{end}] Download failed for {out_file}, with error: {msg}{reset_clr}'
+
+        end_epoch = int(time())
+        download_time = pretty_time(end_epoch-start_epoch, fmt='h m s')
+        return f'{success_clr}[{end}] Download completed for {out_file} in {download_time}!{reset_clr}'
+
+    def post_process():
+        try:
+            status, msg = dlClient.post_process()
+        except Exception as e:
+            status, msg = 1, str(e)
+
+        return get_download_status(status, msg)
+
+    if os.path.isfile(out_path) and os.path.getsize(out_path) > 0:
         # skip file if already exists
         return f'{skipped_clr}[{start}] Download skipped for {out_file}. File already exists!{reset_clr}'
     else:
@@ -251,16 +327,11 @@ def downloader(ep_details, dl_config):
         except Exception as e:
             status, msg = 1, str(e)
 
-        # remove target dirs if no files are downloaded
-        dlClient._cleanup_out_dirs()
-
-        end = get_current_time()
         if status != 0:
-            return f'{error_clr}[{end}] Download failed for {out_file}, with error: {msg}{reset_clr}'
+            return get_download_status(status, msg)
 
-        end_epoch = int(time())
-        download_time = pretty_time(end_epoch-start_epoch, fmt='h m s')
-        return f'{success_clr}[{end}] Download completed for {out_file} in {download_time}!{reset_clr}'
+        # post-process (remux / add subtitles) on its own workers. So, this download slot moves on to the next episode
+        return dlClient.post_processor.submit(post_process)
 
 def batch_downloader(download_fn, links, dl_config, max_parallel_downloads):
 
@@ -268,7 +339,27 @@ def batch_downloader(download_fn, links, dl_config, max_parallel_downloads):
     def call_downloader(link, dl_config):
         return download_fn(link, dl_config)
 
+    # episodes already downloaded are skipped. So, they are excluded from the throughput
+    out_files = [ get_out_file(link, dl_config) for link in links.values() if link.get('downloadLink') ]
+    existing_files = { out_file for out_file in out_files if os.path.isfile(out_file) }
+    start = time()
+
     dl_status = call_downloader(links.values(), dl_config)
+    # wait for the post-processing of the downloaded episodes. A failed episode shouldn't abort the status of the others
+    def get_result(status):
+        if not isinstance(status, Future):
+            return status
+        try:
+            return status.result()
+        except Exception as e:
+            error_clr = PRINT_THEMES['error'] if not disable_colors else ''
+            reset_clr = PRINT_THEMES['reset'] if not disable_colors else ''
+            return f'{error_clr}[{get_current_time()}] Post-processing failed with error: {e}{reset_clr}'
+
+    dl_status = [ get_result(status) for status in dl_status ]
+
+    downloaded_bytes = sum( os.path.getsize(out_file) for out_file in out_files if out_file not in existing_files and os.path.isfile(out_file) )
+    save_download_stats(downloaded_bytes, time() - start)
 
     # show download status at the end, so that progress bars are not disturbed
     print("\033[K") # Clear to the end of line
@@ -323,9 +414,10 @@ if __name__ == '__main__':
         parser.add_argument('-d', '--start-download', action='store_true', help='start download immediately or not')
         parser.add_argument('-dc', '--disable-colors', default=False, action='store_true', help='disable colored output')
         parser.add_argument('-hsa', '--hls-size-accuracy', default=0, type=int, choices=range(0, 101), metavar='[0-100]',
-                            help='accuracy to display the file size of hls files. Use 0 to disable. Please enable only if required as it is slow')
+                            help='percentage of segments sampled to estimate the file size of hls files. Use 0 to disable (default: 0)')
         parser.add_argument('-dl', '--disable-looping', default=False, action='store_true', help='disable auto-restart of UDB')
         parser.add_argument('-u', '--update', default=False, action='store_true', help='update UDB to the latest version available')
+        parser.add_argument('-o', '--offline', default=False, action='store_true', help='serve the site requests only from the response cache')
 
         args = parser.parse_args()
         config_file = args.conf
@@ -349,6 +441,7 @@ if __name__ == '__main__':
         hls_size_accuracy = args.hls_size_accuracy
         disable_looping = args.disable_looping
         update_flag = args.update
+        offline_mode = args.offline
 
         # initialize color printer
         colprint_init(disable_colors)
@@ -488,6 +581,11 @@ if __name__ == '__main__':
             logger.error('No episodes available to download! Exiting.')
             raise ExitException(1)
 
+        batch_estimate = estimate_batch(target_dl_links, downloader_config)
+        if batch_estimate:
+            logger.info(batch_estimate)
+            colprint('predefined', f'\n{batch_estimate}')
+
         msg = f'Episodes available for download [{available_dl_count}/{len(target_dl_links)}].'
         colprint('header', f'\n{msg}', end=' ')
         if available_dl_count == 0: